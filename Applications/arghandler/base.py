@@ -14,12 +14,14 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import os
 import sys
 import argparse
 import logging
 import inspect
 
-__all__ = ['ArgumentHandler','LOG_LEVEL','subcmd','reset_registered_subcommands']
+__all__ = ['ArgumentHandler','LOG_LEVEL','PROFILE_FORMATS','subcmd','register_subcommand',
+		   'reset_registered_subcommands','run_profiled']
 
 LOG_LEVEL='log_level'
 
@@ -63,6 +65,63 @@ def subcmd_fxn(cmd_fxn,name,kwargs):
 
 	return cmd_fxn
 
+def register_subcommand(name,target,help=''):
+	"""
+	Register a subcommand without importing it.  `target` is a dotted path of
+	the form 'package.module:function' (or 'package.module.function'); the module
+	is only imported when the subcommand is selected.  Callables are accepted as
+	well, which makes this the non-decorator form of `@subcmd`.
+	"""
+	global registered_subcommands, registered_subcommands_help
+
+	if isinstance(target,str):
+		target = LazySubcommand(target)
+
+	registered_subcommands[name] = target
+	registered_subcommands_help[name] = help
+
+class LazySubcommand(object):
+	"""
+	A subcommand given by the dotted path of its function, which is imported on
+	first use.
+	"""
+
+	def __init__(self,path):
+		if ':' in path:
+			module_name, _, function_name = path.partition(':')
+		else:
+			module_name, _, function_name = path.rpartition('.')
+
+		if not module_name or not function_name:
+			raise ValueError('subcommand path must be module:function, not %s' % path)
+
+		self.path = path
+		self.module_name = module_name
+		self.function_name = function_name
+		self._function = None
+
+	def resolve(self):
+		if self._function is None:
+			import importlib
+			module = importlib.import_module(self.module_name)
+			self._function = getattr(module,self.function_name)
+		return self._function
+
+	def origin(self):
+		"""
+		The file the subcommand's module would be loaded from, without importing
+		it (parent packages are imported, though).
+		"""
+		import importlib.util
+		spec = importlib.util.find_spec(self.module_name)
+		return None if spec is None else spec.origin
+
+	def __call__(self,parser,context,args):
+		return self.resolve()(parser,context,args)
+
+	def __repr__(self):
+		return 'LazySubcommand(%r)' % self.path
+
 def reset_registered_subcommands():
 	"""
 	Forget about all subcommands that have been registered using @subcmd.
@@ -84,17 +143,35 @@ class ArgumentHandler(argparse.ArgumentParser):
 		kwargs
 		------
 		  * `use_subcommand_help [=False]`: when printing out the help message, use a shortened
-		    version of the help message that simply shows the sub-commands supported and
+			version of the help message that simply shows the sub-commands supported and
 			their description.
 
 		  * `enable_autocompletion [=False]`: make it so that the command line
-		    supports autocompletion
+			supports autocompletion
+
+		  * `completion_cache [=None]`: a file in which to cache the options of all
+			subcommands.  With autocompletion enabled, shell completion is then
+			answered from this file without importing argcomplete or any lazily
+			registered subcommand (see `register_subcommand`).  The file is rebuilt
+			when a subcommand or the source file of one changes.
+
+		  * `enable_batch [=True]`: add the subcommand `batch`, which reads further
+			invocations (one command line per line) from a file or stdin and runs
+			them all in this process.  See `run_batch`.
+
+		  * `enable_profiling [=True]`: add the global options `--profile FILE`,
+			`--profile-format` and `--tracemalloc N`, which run the selected
+			subcommand under cProfile or tracemalloc.  The profiling modules
+			are only imported when one of these options is given.
 
 		"""
 
 		### extract any special keywords here
 		self._use_subcommand_help = kwargs.pop('use_subcommand_help',False)
 		self._enable_autocompletion = kwargs.pop('enable_autocompletion',False)
+		self._enable_profiling = kwargs.pop('enable_profiling',True)
+		self._completion_cache = kwargs.pop('completion_cache',None)
+		self._enable_batch = kwargs.pop('enable_batch',True)
 
 		# some internal logic management info
 		self._logging_argument = None
@@ -105,6 +182,8 @@ class ArgumentHandler(argparse.ArgumentParser):
 		self._subcommand_help = dict()
 
 		self._has_parsed = False
+		self._is_setup = False
+		self._context_fxn = None
 
 		# setup the class
 		if self._use_subcommand_help:
@@ -183,6 +262,9 @@ class ArgumentHandler(argparse.ArgumentParser):
 		support.  This is an alternative to using the decorator `@subcmd`. Note that
 		the total set of subcommands supported will be those specified in this method
 		combined with those identified by the decorator.
+
+		Instead of a function, a dotted path 'package.module:function' can be given,
+		which is only imported if that subcommand is run.
 		"""
 		if type(subcommand_lookup) is not dict:
 			raise TypeError('subcommands must be specified as a dict')
@@ -193,6 +275,11 @@ class ArgumentHandler(argparse.ArgumentParser):
 		for cn,cf in subcommand_lookup.items():
 			if type(cn) is not str:
 				raise TypeError('subcommand keys must be strings. Found %s' % str(cn))
+			if type(cf) == tuple and isinstance(cf[0],str):
+				cf = (LazySubcommand(cf[0]),cf[1])
+			elif isinstance(cf,str):
+				cf = LazySubcommand(cf)
+
 			if type(cf) == tuple:
 				if not callable(cf[0]):
 					raise TypeError('subcommand with name %s must be callable' % cn)
@@ -216,6 +303,33 @@ class ArgumentHandler(argparse.ArgumentParser):
 		if self._has_parsed:
 			raise Exception('ArgumentHandler.parse_args can only be called once')
 
+		self._setup()
+
+		# handle autocompletion if requested
+		# (only completion requests pay for importing the completion code)
+		if self._enable_autocompletion and '_ARGCOMPLETE' in os.environ:
+			if self._completion_cache:
+				from arghandler import completion
+				completion.autocomplete(self,self._completion_cache)
+			import argcomplete
+			argcomplete.autocomplete(self)
+
+		# parse arguments
+		args = argparse.ArgumentParser.parse_args(self,argv)
+		self._has_parsed = True
+
+		return args
+
+	def _setup(self):
+		"""
+		Add the subcommand arguments to the parser, once.
+		"""
+		global registered_subcommands, registered_subcommands_help
+
+		if self._is_setup:
+			return
+		self._is_setup = True
+
 		# collect subcommands into _subcommand_lookup
 		for cn,cf in registered_subcommands.items():
 			self._subcommand_lookup[cn] = cf
@@ -223,6 +337,9 @@ class ArgumentHandler(argparse.ArgumentParser):
 
 		if len(self._subcommand_lookup) == 0:
 			self._use_subcommands = False
+		elif self._enable_batch and 'batch' not in self._subcommand_lookup:
+			self._subcommand_lookup['batch'] = self._batch
+			self._subcommand_help['batch'] = 'run subcommands read line by line from a file or stdin'
 
 		# add in subcommands if appropriate
 		if not self._use_subcommands:
@@ -236,22 +353,21 @@ class ArgumentHandler(argparse.ArgumentParser):
 					subcommands_help_text += command.ljust(max_cmd_length+2)
 					subcommands_help_text += self._subcommand_help[command]
 					subcommands_help_text += '\n'
+			if self._enable_profiling:
+				self.add_argument('--profile',metavar='FILE',
+								help='run the subcommand under cProfile and write the profile to FILE')
+				self.add_argument('--profile-format',choices=PROFILE_FORMATS,default='pstats',
+								help='pstats (for the pstats module or snakeviz), collapsed stacks '
+									'(for flamegraph.pl) or text (the top functions)')
+				self.add_argument('--tracemalloc',metavar='N',type=int,
+								help='trace memory allocations of the subcommand and print the N '
+									'largest allocation sites')
+
 			self.add_argument('cmd',choices=self._subcommand_lookup.keys(),help=subcommands_help_text,metavar='subcommand')
 
 			cargs_help_msg = 'arguments for the subcommand' if not self._use_subcommand_help else argparse.SUPPRESS
 			self.add_argument('cargs',nargs=argparse.REMAINDER,help=cargs_help_msg)
 
-		# handle autocompletion if requested
-		if self._enable_autocompletion:
-			import argcomplete
-			argcomplete.autocomplete(self)
-
-		# parse arguments
-		args = argparse.ArgumentParser.parse_args(self,argv)
-		self._has_parse = True
-
-		return args
-
 	def run(self,argv=None,context_fxn=None):
 		"""
 		This method triggers a three step process:
@@ -282,6 +398,12 @@ class ArgumentHandler(argparse.ArgumentParser):
 			# call the logging config fxn
 			self._logging_config_fxn(level,args)
 
+		self._context_fxn = context_fxn
+		self._run_subcommand(args,context_fxn)
+
+		return args
+
+	def _run_subcommand(self,args,context_fxn):
 		# generate the context
 		context = args
 		if context_fxn:
@@ -292,6 +414,212 @@ class ArgumentHandler(argparse.ArgumentParser):
 			scmd_parser = argparse.ArgumentParser(prog='%s %s' % (self.prog,args.cmd))
 
 			# handle the subcommands
-			self._subcommand_lookup[args.cmd](scmd_parser,context,args.cargs)
+			cmd_fxn = self._subcommand_lookup[args.cmd]
+			if self._enable_profiling and (args.profile or args.tracemalloc):
+				run_profiled(cmd_fxn,scmd_parser,context,args.cargs,
+							profile=args.profile,profile_format=args.profile_format,
+							tracemalloc_top=args.tracemalloc)
+			else:
+				cmd_fxn(scmd_parser,context,args.cargs)
 
-		return args
+	def _batch(self,parser,context,args):
+		parser.add_argument('file',nargs='?',default='-',
+							help='file with one command line per line (default: stdin)')
+		parser.add_argument('-x','--stop-on-error',action='store_true',
+							help='stop at the first command that fails')
+		args = parser.parse_args(args)
+
+		if args.file == '-':
+			results = self.run_batch(sys.stdin,self._context_fxn,args.stop_on_error)
+		else:
+			with open(args.file) as fh:
+				results = self.run_batch(fh,self._context_fxn,args.stop_on_error)
+
+		if any(status != 0 for _, status in results):
+			sys.exit(1)
+
+	def run_batch(self,lines,context_fxn=None,stop_on_error=False,report=None):
+		"""
+		Run one invocation per line of `lines`, each a command line as it would
+		be given to `run` (without the program name).  Empty lines and lines
+		starting with # are skipped.
+
+		Every invocation gets a fresh subcommand parser, but all of them run in
+		this process, so module level caches of the subcommands are kept from
+		one invocation to the next.  A failing invocation (an exception, or
+		SystemExit with a non-zero code, e.g. from a usage error) does not stop
+		the batch unless `stop_on_error` is set.
+
+		The exit status of each invocation is reported to `report` (sys.stderr by
+		default).  Returns a list of (command line, exit status) pairs.
+		"""
+		import shlex
+		import time
+		import traceback
+
+		if report is None:
+			report = sys.stderr
+
+		self._setup()
+
+		results = []
+		for number, line in enumerate(lines,1):
+			line = line.strip()
+			if not line or line.startswith('#'):
+				continue
+
+			started = time.time()
+			try:
+				argv = shlex.split(line)
+				args = argparse.ArgumentParser.parse_args(self,argv)
+				if self._use_subcommands and self._subcommand_lookup[args.cmd] == self._batch:
+					sys.exit('batch cannot be nested')
+				self._run_subcommand(args,context_fxn)
+				status = 0
+			except SystemExit as e:
+				if e.code is None or isinstance(e.code,int):
+					status = e.code or 0
+				else:
+					print(e.code,file=sys.stderr)
+					status = 1
+			except Exception:
+				traceback.print_exc()
+				status = 1
+
+			sys.stdout.flush()
+			print('batch: line %d: exit %d (%.1fs): %s' % (number,status,time.time() - started,line),
+				  file=report)
+			results.append((line,status))
+
+			if status != 0 and stop_on_error:
+				break
+
+		failed = len([status for _, status in results if status != 0])
+		print('batch: %d commands, %d failed' % (len(results),failed),file=report)
+
+		return results
+
+#########################
+# profiling
+#########################
+
+PROFILE_FORMATS = ('pstats','collapsed','text')
+
+def run_profiled(cmd_fxn,parser,context,args,profile=None,profile_format='pstats',
+				tracemalloc_top=None,stream=None):
+	"""
+	Run the subcommand `cmd_fxn` under cProfile (if `profile`, a filename, is
+	given) and/or tracemalloc (if `tracemalloc_top` is given).  The profile and
+	the top allocation sites are written even if the subcommand fails or exits.
+
+	The text reports go to `stream`, sys.stderr by default.
+	"""
+	if stream is None:
+		stream = sys.stderr
+
+	profiler = None
+	if profile:
+		import cProfile
+		profiler = cProfile.Profile()
+
+	if tracemalloc_top:
+		import tracemalloc
+		tracemalloc.start()
+
+	try:
+		if profiler is not None:
+			profiler.enable()
+		try:
+			return cmd_fxn(parser,context,args)
+		finally:
+			if profiler is not None:
+				profiler.disable()
+	finally:
+		if tracemalloc_top:
+			snapshot = tracemalloc.take_snapshot()
+			tracemalloc.stop()
+			write_allocation_sites(snapshot,tracemalloc_top,stream)
+
+		if profiler is not None:
+			write_profile(profiler,profile,profile_format,stream)
+
+def write_profile(profiler,filename,profile_format='pstats',stream=None):
+	"""
+	Write the statistics of a cProfile.Profile to `filename` in one of
+	PROFILE_FORMATS.
+	"""
+	import pstats
+
+	if profile_format == 'pstats':
+		profiler.dump_stats(filename)
+	elif profile_format == 'collapsed':
+		with open(filename,'w') as fh:
+			for stack,weight in collapsed_stacks(pstats.Stats(profiler)):
+				fh.write('%s %d\n' % (';'.join(stack),weight))
+	elif profile_format == 'text':
+		with open(filename,'w') as fh:
+			stats = pstats.Stats(profiler,stream=fh)
+			stats.sort_stats('cumulative').print_stats(40)
+	else:
+		raise ValueError('unknown profile format: %s' % profile_format)
+
+	if stream is not None:
+		print('profile written to %s' % filename,file=stream)
+
+def _function_label(function):
+	filename, line, name = function
+	if filename == '~':
+		return name
+	return '%s:%d(%s)' % (filename.rsplit('/',1)[-1],line,name)
+
+def collapsed_stacks(stats):
+	"""
+	Turn pstats.Stats into (stack, microseconds) pairs as used by flame graph
+	tools.  cProfile only records caller/callee pairs, not whole stacks, so the
+	time of a function is split over its callers in proportion to the time
+	spent in it on behalf of each of them.
+	"""
+	children = {}
+	roots = []
+	for function, (cc, nc, tt, ct, callers) in stats.stats.items():
+		if not callers:
+			roots.append(function)
+		for caller, (ccc, cnc, ctt, cct) in callers.items():
+			children.setdefault(caller,[]).append((function,cct))
+
+	stacks = {}
+
+	def walk(function,stack,share):
+		tt, ct = stats.stats[function][2:4]
+		if ct * share < 1e-6:
+			# below the resolution of the output, stop descending
+			return
+		stack = stack + (_function_label(function),)
+		weight = int(tt * share * 1e6)
+		if weight > 0:
+			stacks[stack] = stacks.get(stack,0) + weight
+		for child, edge_time in children.get(function,[]):
+			child_time = stats.stats[child][3]
+			# recursion is cut off where a function calls itself again
+			if child_time <= 0 or _function_label(child) in stack:
+				continue
+			walk(child,stack,share * edge_time / child_time)
+
+	for root in roots:
+		walk(root,(),1.0)
+
+	return sorted(stacks.items())
+
+def write_allocation_sites(snapshot,top,stream):
+	"""
+	Print the `top` source lines allocating the most memory still held at the
+	time of a tracemalloc snapshot.
+	"""
+	statistics = snapshot.statistics('lineno')
+	total = sum(stat.size for stat in statistics)
+
+	print('top %d allocation sites (%.1f KiB held in total)' % (top,total / 1024.0),file=stream)
+	for index, stat in enumerate(statistics[:top],1):
+		frame = stat.traceback[0]
+		print('%3d %10.1f KiB %8d blocks  %s:%d' % (index,stat.size / 1024.0,stat.count,
+												   frame.filename,frame.lineno),file=stream)
@@ -0,0 +1,203 @@
+"""
+Copyright 2015 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# Shell completion from a cached table of subcommands and their options.
+#
+# argcomplete has to build the complete parser before it can complete anything,
+# which for an ArgumentHandler means importing every subcommand.  Instead, the
+# options of all subcommands are collected once into a JSON file:
+#
+#     {"signature": [...], "global": [["--profile", true], ...],
+#      "subcommands": {"survey": [["-o", true], ["--outdated", false]], ...}}
+#
+# and completion requests are answered from it.  The signature records each
+# subcommand's target and the modification time of its source file, so the table
+# is rebuilt when either changes.  This module speaks argcomplete's protocol
+# (environment variables in, completions on file descriptor 8) so the usual
+# `register-python-argcomplete` shell hook works unchanged.
+
+import argparse
+import json
+import os
+import shlex
+import sys
+import tempfile
+
+__all__ = ['autocomplete','build_table','complete','load_table']
+
+class _OptionsCollected(Exception):
+	pass
+
+class _CollectingParser(argparse.ArgumentParser):
+	"""
+	Handed to a subcommand instead of its parser: records the options the
+	subcommand adds and stops it when it starts parsing.
+	"""
+
+	def parse_args(self,args=None,namespace=None):
+		raise _OptionsCollected()
+
+	def parse_known_args(self,args=None,namespace=None):
+		raise _OptionsCollected()
+
+def _options(parser):
+	return [[option,action.nargs != 0] for action in parser._actions
+			for option in action.option_strings]
+
+def _source_file(cmd_fxn):
+	if hasattr(cmd_fxn,'origin'):
+		return cmd_fxn.origin()
+	module = sys.modules.get(getattr(cmd_fxn,'__module__',None))
+	return getattr(module,'__file__',None)
+
+def signature(handler):
+	"""
+	What the table of `handler` depends on, computed without importing lazily
+	registered subcommands.
+	"""
+	entries = []
+	for name in sorted(handler._subcommand_lookup):
+		cmd_fxn = handler._subcommand_lookup[name]
+		target = getattr(cmd_fxn,'path',None) or '%s.%s' % (
+			getattr(cmd_fxn,'__module__',''),getattr(cmd_fxn,'__qualname__',repr(cmd_fxn)))
+		source = _source_file(cmd_fxn)
+		if source:
+			source = os.path.abspath(source)
+		try:
+			mtime = os.stat(source).st_mtime_ns if source else None
+		except OSError:
+			mtime = None
+		entries.append([name,target,source,mtime])
+
+	return [_options(handler),entries]
+
+def collect_options(cmd_fxn):
+	"""
+	The options a subcommand adds to its parser before parsing.  Subcommands
+	that fail before parsing get an empty list.
+	"""
+	parser = _CollectingParser(add_help=True)
+	try:
+		cmd_fxn(parser,None,[])
+	except _OptionsCollected:
+		pass
+	except (Exception,SystemExit):
+		return []
+
+	return _options(parser)
+
+def build_table(handler):
+	return {'signature': signature(handler),
+			'global': _options(handler),
+			'subcommands': dict((name,collect_options(cmd_fxn))
+								for name, cmd_fxn in handler._subcommand_lookup.items())}
+
+def load_table(handler,filename):
+	"""
+	The completion table for `handler`, read from `filename` or rebuilt (and
+	written back) if missing or stale.
+	"""
+	current = signature(handler)
+	try:
+		with open(filename) as fh:
+			table = json.load(fh)
+		if table.get('signature') == current:
+			return table
+	except (OSError,ValueError):
+		pass
+
+	table = build_table(handler)
+
+	directory = os.path.dirname(os.path.abspath(filename))
+	try:
+		os.makedirs(directory,exist_ok=True)
+		fd, temporary = tempfile.mkstemp(dir=directory,prefix='.completion.')
+		with os.fdopen(fd,'w') as fh:
+			json.dump(table,fh)
+		os.replace(temporary,filename)
+	except OSError:
+		# an unwritable cache only costs speed
+		pass
+
+	return table
+
+def _split(line):
+	try:
+		words = shlex.split(line)
+	except ValueError:
+		# an unterminated quote in the word being completed
+		words = line.split()
+	if line and line[-1].isspace():
+		words.append('')
+	elif not words:
+		words = ['']
+	return words
+
+def complete(table,line):
+	"""
+	The completions for the command line `line` (up to the cursor).
+	"""
+	words = _split(line)[1:]
+	prefix = words.pop() if words else ''
+
+	global_options = dict((option,takes_value) for option, takes_value in table['global'])
+	subcommand = None
+	index = 0
+	while index < len(words):
+		word = words[index]
+		if word.startswith('-'):
+			if global_options.get(word.split('=',1)[0]) and '=' not in word:
+				index += 1
+		else:
+			subcommand = word
+			break
+		index += 1
+
+	if subcommand is None:
+		if prefix.startswith('-'):
+			candidates = sorted(global_options)
+		else:
+			candidates = sorted(table['subcommands'])
+	else:
+		options = table['subcommands'].get(subcommand,[])
+		if not prefix.startswith('-'):
+			return []
+		candidates = sorted(option for option, _ in options)
+
+	return [candidate for candidate in candidates if candidate.startswith(prefix)]
+
+def autocomplete(handler,filename):
+	"""
+	Answer an argcomplete completion request from the cached table and exit.
+	Does nothing unless the process was started by the completion hook.
+	"""
+	if '_ARGCOMPLETE' not in os.environ:
+		return
+
+	line = os.environ.get('COMP_LINE','')
+	point = int(os.environ.get('COMP_POINT',len(line)))
+	separator = os.environ.get('_ARGCOMPLETE_IFS','\013')
+
+	completions = complete(load_table(handler,filename),line[:point])
+	output = separator.join(completion + ' ' for completion in completions)
+
+	try:
+		stream = os.fdopen(8,'w')
+	except OSError:
+		stream = sys.stdout
+	stream.write(output)
+	stream.flush()
+	os._exit(0)
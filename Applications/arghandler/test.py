@@ -17,6 +17,9 @@ limitations under the License.
 import unittest
 
 from arghandler.tests.base import *
+from arghandler.tests.profiling import *
+from arghandler.tests.lazy import *
+from arghandler.tests.batch import *
 from arghandler.tests.subcmds import *
 
 if __name__ == '__main__':
@@ -0,0 +1,82 @@
+"""
+Copyright 2015 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import io
+import sys
+import unittest
+from arghandler import *
+
+class BatchTestCase(unittest.TestCase):
+
+	def setUp(self):
+		reset_registered_subcommands()
+		self.calls = []
+
+		def add(parser,context,args):
+			parser.add_argument('a',type=int)
+			parser.add_argument('b',type=int)
+			args = parser.parse_args(args)
+			self.calls.append((context,args.a + args.b))
+
+		def fail(parser,context,args):
+			raise RuntimeError('failed on purpose')
+
+		def quit(parser,context,args):
+			sys.exit(int(args[0]))
+
+		self.handler = ArgumentHandler()
+		self.handler.add_argument('-c','--context',default='none')
+		self.handler.set_subcommands({'add':add,'fail':fail,'quit':quit})
+
+	def run_batch(self,lines,**kwargs):
+		report = io.StringIO()
+		original_stderr = sys.stderr
+		sys.stderr = io.StringIO()
+		try:
+			results = self.handler.run_batch(lines,context_fxn=lambda args: args.context,
+											 report=report,**kwargs)
+		finally:
+			sys.stderr = original_stderr
+		return results, report.getvalue()
+
+	def test_statuses(self):
+		lines = ['# comment','add 1 2','','-c other add 3 4','add x','fail','quit 3','quit 0']
+		results, report = self.run_batch(lines)
+
+		self.assertEqual(self.calls,[('none',3),('other',7)])
+		self.assertEqual([status for _, status in results],[0,0,2,1,3,0])
+		self.assertTrue('line 6: exit 1' in report)
+		self.assertTrue('6 commands, 3 failed' in report)
+
+	def test_stop_on_error(self):
+		results, report = self.run_batch(['add 1 1','fail','add 2 2'],stop_on_error=True)
+
+		self.assertEqual(self.calls,[('none',2)])
+		self.assertEqual(len(results),2)
+
+	def test_subcommand(self):
+		original_stdin = sys.stdin
+		original_stderr = sys.stderr
+		sys.stdin = io.StringIO('add 1 2\nadd 2 3\nbatch\n')
+		sys.stderr = io.StringIO()
+		try:
+			self.assertRaises(SystemExit,self.handler.run,['batch'],lambda args: args.context)
+			report = sys.stderr.getvalue()
+		finally:
+			sys.stdin = original_stdin
+			sys.stderr = original_stderr
+
+		self.assertEqual(self.calls,[('none',3),('none',5)])
+		self.assertTrue('batch cannot be nested' in report)
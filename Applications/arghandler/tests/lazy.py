@@ -0,0 +1,88 @@
+"""
+Copyright 2015 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from arghandler import *
+from arghandler import completion
+
+TARGET = 'arghandler.tests.lazycmds:greet'
+
+def forget_target():
+	sys.modules.pop('arghandler.tests.lazycmds',None)
+
+class LazySubcommandTestCase(unittest.TestCase):
+
+	def setUp(self):
+		reset_registered_subcommands()
+		forget_target()
+
+	def test_not_imported_until_run(self):
+		register_subcommand('greet',TARGET,help='say hello')
+
+		handler = ArgumentHandler()
+		handler.parse_args(['greet'])
+		self.assertFalse('arghandler.tests.lazycmds' in sys.modules)
+
+		handler = ArgumentHandler()
+		handler.run(['greet','--name','lazy'])
+		self.assertEqual(sys.modules['arghandler.tests.lazycmds'].ran,['lazy'])
+
+	def test_set_subcommands(self):
+		handler = ArgumentHandler()
+		handler.set_subcommands({'greet':('arghandler.tests.lazycmds.greet','say hello')})
+		handler.run(['greet'])
+
+		self.assertEqual(sys.modules['arghandler.tests.lazycmds'].ran,['world'])
+
+	def test_bad_path(self):
+		self.assertRaises(ValueError,register_subcommand,'greet','lazycmds')
+
+class CompletionTestCase(unittest.TestCase):
+
+	def setUp(self):
+		reset_registered_subcommands()
+		forget_target()
+		self.directory = tempfile.mkdtemp()
+		self.filename = os.path.join(self.directory,'completion.json')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def make_handler(self):
+		handler = ArgumentHandler()
+		handler.set_subcommands({'greet':TARGET,'other':TARGET})
+		handler.parse_args(['greet'])
+		return handler
+
+	def test_table(self):
+		completion.load_table(self.make_handler(),self.filename)
+		self.assertTrue(os.path.exists(self.filename))
+
+		# a warm table is used without importing the subcommands
+		forget_target()
+		table = completion.load_table(self.make_handler(),self.filename)
+		self.assertFalse('arghandler.tests.lazycmds' in sys.modules)
+
+		self.assertEqual(completion.complete(table,'prog '),['batch','greet','other'])
+		self.assertEqual(completion.complete(table,'prog gr'),['greet'])
+		self.assertEqual(completion.complete(table,'prog --prof'),['--profile','--profile-format'])
+		self.assertEqual(completion.complete(table,'prog --profile out greet --'),
+						 ['--help','--loud','--name'])
+		self.assertEqual(completion.complete(table,'prog greet --n'),['--name'])
+		self.assertEqual(completion.complete(table,'prog greet x'),[])
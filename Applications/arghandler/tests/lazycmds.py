@@ -0,0 +1,24 @@
+"""
+Copyright 2015 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+# Subcommands for arghandler.tests.lazy, which must only be imported when run
+
+ran = []
+
+def greet(parser,context,args):
+	parser.add_argument('-n','--name',default='world')
+	parser.add_argument('--loud',action='store_true')
+	args = parser.parse_args(args)
+	ran.append(args.name)
@@ -0,0 +1,90 @@
+"""
+Copyright 2015 Derek Ruths
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import io
+import os
+import pstats
+import sys
+import tempfile
+import unittest
+from arghandler import *
+
+def busy_subcommand(parser,context,args):
+	parser.add_argument('n',type=int)
+	args = parser.parse_args(args)
+	return [str(i) * 10 for i in range(args.n)]
+
+class ProfileTestCase(unittest.TestCase):
+
+	def setUp(self):
+		reset_registered_subcommands()
+		fd, self.filename = tempfile.mkstemp()
+		os.close(fd)
+
+	def tearDown(self):
+		os.unlink(self.filename)
+
+	def run_handler(self,argv):
+		original_stderr = sys.stderr
+		sys.stderr = io.StringIO()
+		try:
+			handler = ArgumentHandler()
+			handler.set_subcommands({'busy':busy_subcommand})
+			handler.run(argv)
+			return sys.stderr.getvalue()
+		finally:
+			sys.stderr = original_stderr
+
+	def test_pstats(self):
+		self.run_handler(['--profile',self.filename,'busy','1000'])
+
+		stats = pstats.Stats(self.filename)
+		names = [function[2] for function in stats.stats]
+		self.assertTrue('busy_subcommand' in names)
+
+	def test_collapsed(self):
+		self.run_handler(['--profile',self.filename,'--profile-format','collapsed','busy','100000'])
+
+		lines = open(self.filename).read().splitlines()
+		self.assertTrue(len(lines) > 0)
+		for line in lines:
+			stack, weight = line.rsplit(' ',1)
+			self.assertTrue(int(weight) > 0)
+		self.assertTrue(any('(busy_subcommand)' in line for line in lines))
+
+	def test_tracemalloc(self):
+		output = self.run_handler(['--tracemalloc','3','busy','10000'])
+
+		self.assertTrue('top 3 allocation sites' in output)
+		self.assertEqual(len(output.splitlines()),4)
+
+	def test_not_profiled(self):
+		self.run_handler(['busy','10'])
+
+		self.assertEqual(os.path.getsize(self.filename),0)
+
+	def test_disabled(self):
+		handler = ArgumentHandler(enable_profiling=False)
+		handler.set_subcommands({'busy':busy_subcommand})
+
+		self.assertRaises(SystemExit,self.run_handler_quietly,handler,['--profile',self.filename,'busy','1'])
+
+	def run_handler_quietly(self,handler,argv):
+		original_stderr = sys.stderr
+		sys.stderr = io.StringIO()
+		try:
+			handler.run(argv)
+		finally:
+			sys.stderr = original_stderr
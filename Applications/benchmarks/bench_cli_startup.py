@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Measure the startup time of the command line tools.
+
+Usage: bench_cli_startup.py [-n RUNS] [-o RESULTS.json]
+
+Times, as separate processes: a bare interpreter, --help of
+update_applications.py (which imports everything) and of kde_obs.py
+(lazy subcommands), and shell completion through kde_obs.py with a
+cold and a warm completion table.
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APPLICATIONS_DIR = Path(__file__).resolve().parent.parent
+
+
+def completion_environment(line, cache_home):
+
+    environment = dict(os.environ)
+    environment.update({"_ARGCOMPLETE": "1", "COMP_LINE": line,
+                        "COMP_POINT": str(len(line)),
+                        "XDG_CACHE_HOME": cache_home})
+    return environment
+
+
+def run(command, environment=None, prepare=None):
+
+    if prepare is not None:
+        prepare()
+
+    # Completions are written to file descriptor 8, as by the shell hook
+    read_fd, write_fd = os.pipe()
+    started = time.perf_counter()
+    subprocess.run(command, cwd=str(APPLICATIONS_DIR), env=environment,
+                   stdout=subprocess.DEVNULL, check=True,
+                   pass_fds=(write_fd,),
+                   preexec_fn=lambda: os.dup2(write_fd, 8))
+    seconds = time.perf_counter() - started
+    os.close(write_fd)
+    os.close(read_fd)
+
+    return seconds
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--runs", type=int, default=20)
+    parser.add_argument("-o", "--output", help="Write the results as JSON")
+    options = parser.parse_args()
+
+    python = sys.executable
+    cache_home = tempfile.mkdtemp(prefix="bench-cli-")
+    table = Path(cache_home) / "kde-obs" / "completion.json"
+    line = "kde_obs.py update_packages --osc-"
+
+    def remove_table():
+        if table.exists():
+            table.unlink()
+
+    cases = [
+        ("python -c pass", [python, "-c", "pass"], None, None),
+        ("update_applications.py -h",
+         [python, "update_applications.py", "-h"], None, None),
+        ("kde_obs.py -h", [python, "kde_obs.py", "-h"], None, None),
+        ("completion (cold table)", [python, "kde_obs.py"],
+         completion_environment(line, cache_home), remove_table),
+        ("completion (warm table)", [python, "kde_obs.py"],
+         completion_environment(line, cache_home), None),
+    ]
+
+    results = list()
+    print("{:<28} {:>9} {:>9}".format("case", "min (ms)", "median"))
+    for name, command, environment, prepare in cases:
+        times = [run(command, environment, prepare)
+                 for _ in range(options.runs)]
+        results.append({"case": name, "min": min(times),
+                        "median": statistics.median(times)})
+        print("{:<28} {:>9.1f} {:>9.1f}".format(
+            name, min(times) * 1000, statistics.median(times) * 1000))
+
+    remove_table()
+    os.rmdir(str(table.parent))
+    os.rmdir(cache_home)
+
+    if options.output:
+        with open(options.output, "w") as handle:
+            json.dump({"python": sys.version.split()[0], "runs": options.runs,
+                       "results": results}, handle, indent=2)
+            handle.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Compare the per-line cost of pyrpm.spec's parser with the old regex one.
+
+Usage: bench_spec_parser.py [-n ROUNDS] [SPECFILE ...]
+
+Without spec files, a synthetic spec of about 600 lines is used. The old
+parser tried every tag regex against every line; it is kept here only as
+the baseline for the comparison.
+"""
+
+import argparse
+from pathlib import Path
+import re
+import sys
+import timeit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pyrpm import spec as pyrpm_spec  # noqa: E402
+
+
+_legacy_tags = {
+    'name': (str, re.compile(r'^Name:\s*(\S+)')),
+    'version': (str, re.compile(r'^Version:\s*(\S+)')),
+    'epoch': (int, re.compile(r'^Epoch:\s*(\S+)')),
+    'release': (str, re.compile(r'^Release:\s*(\S+)')),
+    'summary': (str, re.compile(r'^Summary:\s*(.+)')),
+    'license': (str, re.compile(r'^License:\s*(.+)')),
+    'group': (str, re.compile(r'^Group:\s*(\S+)')),
+    'url': (str, re.compile(r'^URL:\s*(\S+)')),
+    'buildroot': (str, re.compile(r'^BuildRoot:\s*(\S+)')),
+    'buildarch': (str, re.compile(r'^BuildArch:\s*(\S+)')),
+    'sources': (list, re.compile(r'^Source\d*:\s*(\S+)')),
+    'patches': (list, re.compile(r'^Patch\d*:\s*(\S+)')),
+    'build_requires': (list, re.compile(r'^BuildRequires:\s*(.+)')),
+    'requires': (list, re.compile(r'^Requires:\s*(.+)')),
+    'packages': (list, re.compile(r'^%package\s+(\S+)'))
+}
+
+
+def legacy_parse(spec_obj, context, line):
+    for name, value in _legacy_tags.items():
+        attr_type, regex = value
+        match = re.search(regex, line)
+        if match:
+            tag_value = match.group(1)
+
+            if name == 'name':
+                spec_obj.packages = []
+                spec_obj.packages.append(pyrpm_spec.Package(tag_value))
+
+            target_obj = spec_obj
+            if context['current_subpackage'] is not None:
+                target_obj = context['current_subpackage']
+
+            if attr_type is list:
+                if not hasattr(target_obj, name):
+                    setattr(target_obj, name, list())
+
+                if name == 'packages':
+                    if tag_value == '-n':
+                        subpackage_name = line.rsplit(' ', 1)[-1].rstrip()
+                    else:
+                        subpackage_name = '{}-{}'.format(spec_obj.name, tag_value)
+                    package = pyrpm_spec.Package(subpackage_name)
+                    context['current_subpackage'] = package
+                    package.is_subpackage = True
+                    spec_obj.packages.append(package)
+                else:
+                    getattr(target_obj, name).append(tag_value)
+            else:
+                setattr(target_obj, name, attr_type(tag_value))
+    return spec_obj, context
+
+
+def synthetic_spec(subpackages=12, files_per_package=30):
+
+    lines = ["Name:           foo",
+             "Version:        19.08.1",
+             "Release:        0",
+             "Summary:        A synthetic package",
+             "License:        GPL-2.0-or-later",
+             "Group:          System/GUI/KDE",
+             "URL:            https://www.kde.org",
+             "Source0:        https://download.kde.org/%{name}-%{version}.tar.xz",
+             "Source1:        baselibs.conf"]
+    lines += ["Patch{}:        patch-{}.patch".format(i, i) for i in range(10)]
+    lines += ["BuildRequires:  cmake(KF5Dep{}) >= 5.60".format(i)
+              for i in range(60)]
+    lines += ["", "%description", "A package used for benchmarking.", ""]
+    for i in range(subpackages):
+        lines += ["%package sub{}".format(i),
+                  "Summary:        Subpackage {}".format(i),
+                  "Requires:       %{name} = %{version}", "",
+                  "%description sub{}".format(i),
+                  "Subpackage {} of foo.".format(i), ""]
+    lines += ["%prep", "%setup -q"]
+    lines += ["%patch{} -p1".format(i) for i in range(10)]
+    lines += ["", "%build", "%cmake_kf5 -d build", "%make_jobs", "",
+              "%install", "%kf5_makeinstall -C build", ""]
+    for i in range(subpackages):
+        lines += ["%files sub{}".format(i)]
+        lines += ["%{{_kf5_libdir}}/sub{}/file{}.so".format(i, j)
+                  for j in range(files_per_package)]
+        lines += [""]
+    lines += ["%changelog"]
+
+    return [line + "\n" for line in lines]
+
+
+def parse_lines(parse, lines):
+
+    spec_obj = pyrpm_spec.Spec()
+    context = {'current_subpackage': None, 'in_body': False}
+    for line in lines:
+        spec_obj, context = parse(spec_obj, context, line)
+
+    return spec_obj
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--rounds", type=int, default=200)
+    parser.add_argument("specfile", nargs="*")
+    options = parser.parse_args()
+
+    if options.specfile:
+        lines = list()
+        for filename in options.specfile:
+            with open(filename, encoding="utf-8") as handle:
+                lines += handle.readlines()
+    else:
+        lines = synthetic_spec()
+
+    for name in ("name", "version", "sources", "patches"):
+        legacy = getattr(parse_lines(legacy_parse, lines), name, None)
+        current = getattr(parse_lines(pyrpm_spec._parse, lines), name, None)
+        if not options.specfile and legacy != current:
+            sys.exit("Parsers disagree on {}: {!r} != {!r}".format(
+                name, legacy, current))
+
+    print("{} lines, {} rounds".format(len(lines), options.rounds))
+    results = dict()
+    for label, parse in (("legacy regex", legacy_parse),
+                         ("dispatch", pyrpm_spec._parse)):
+        seconds = min(timeit.repeat(lambda: parse_lines(parse, lines),
+                                    number=options.rounds, repeat=3))
+        results[label] = seconds / options.rounds / len(lines) * 1e9
+        print("{:<14} {:8.0f} ns/line".format(label, results[label]))
+
+    print("speedup        {:8.1f}x".format(
+        results["legacy regex"] / results["dispatch"]))
+
+
+if __name__ == "__main__":
+    main()
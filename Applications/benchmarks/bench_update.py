@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""End-to-end benchmarks of update_applications on synthetic trees.
+
+Usage: bench_update.py [--sizes 10,100,1000] [-o RESULTS.json]
+                       [--compare OLD.json] [...]
+
+For every size, a tree is generated with fixtures.py (in a temporary
+directory unless --workdir is given) and timed:
+
+- format_log_entries: the changelog of every upstream repository
+- Spec.from_file: parsing every spec file
+- prepend_entry: prepending an entry to every .changes file
+- update_packages: the whole subcommand, in a subprocess with the stub
+  osc first on PATH, once per --mode
+
+Each measurement is the best of --repeat runs on a fresh copy of the
+tree. Timings are printed as they are taken and written as JSON to -o,
+by default results/bench_update-<timestamp>.json; --compare prints the
+ratios against an earlier results file, so that regressions stand out.
+"""
+
+import argparse
+import datetime
+import json
+import os
+from pathlib import Path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+APPLICATIONS_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(APPLICATIONS_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fixtures  # noqa: E402
+from pyrpm.spec import Spec  # noqa: E402
+import update_applications  # noqa: E402
+
+# Extra update_packages arguments of each --mode
+UPDATE_MODES = {
+    "serial": [],
+    "jobs": ["-j", "8"],
+    "pipeline": ["--pipeline"],
+}
+
+
+def timed(function):
+
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def best_of(repeat, prepare, function):
+    """The shortest of repeat runs of function, each after prepare()."""
+    times = list()
+    for _ in range(repeat):
+        prepare()
+        times.append(timed(function))
+
+    return min(times)
+
+
+def bench_format_log_entries(tree, names):
+
+    for name in names:
+        list(update_applications.format_log_entries(
+            "v" + fixtures.VERSION_FROM, "v" + fixtures.VERSION_TO,
+            cwd=tree / "src" / name))
+
+
+def bench_spec_from_file(tree, names):
+
+    for name in names:
+        Spec.from_file(str(tree / "obs" / name / (name + ".spec")))
+
+
+def bench_prepend_entry(tree, names):
+
+    entry = update_applications.CHANGES_TEMPLATE.format(
+        date="Thu Sep 12 10:00:00 UTC 2019", committer="bench@example.com",
+        contents="- Update to {}".format(fixtures.VERSION_TO)).lstrip()
+    for name in names:
+        update_applications.prepend_entry(
+            tree / "obs" / name / (name + ".changes"), entry)
+
+
+def bench_update_packages(tree, mode):
+
+    script = APPLICATIONS_DIR / "update_applications.py"
+    command = [sys.executable, str(script), "update_packages",
+               "-p", str(tree / "obs"), "--tarball-dir", str(tree / "tarballs"),
+               "-s", str(tree / "src"), "--version-to", fixtures.VERSION_TO,
+               "-e", "bench@example.com"]
+    command += UPDATE_MODES[mode] + [str(tree / "packages")]
+
+    environment = dict(os.environ)
+    environment["PATH"] = str(tree / "bin") + os.pathsep + environment["PATH"]
+    subprocess.run(command, env=environment, check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+def run_size(workdir, size, options):
+
+    pristine = workdir / "pristine-{}".format(size)
+    tree = workdir / "run-{}".format(size)
+
+    if pristine.exists():
+        shutil.rmtree(str(pristine))
+
+    started = time.perf_counter()
+    names = fixtures.create_tree(pristine, size, options.depth,
+                                 options.changes, options.changes_entries,
+                                 options.tarball_size)
+    print("{} packages: tree generated in {:.1f}s".format(
+        size, time.perf_counter() - started), file=sys.stderr)
+
+    def fresh_copy():
+        fixtures.copy_tree(pristine, tree)
+
+    benchmarks = [
+        ("format_log_entries", lambda: None,
+         lambda: bench_format_log_entries(pristine, names)),
+        ("Spec.from_file", lambda: None,
+         lambda: bench_spec_from_file(pristine, names)),
+        ("prepend_entry", fresh_copy,
+         lambda: bench_prepend_entry(tree, names)),
+    ]
+    for mode in options.modes:
+        benchmarks.append(("update_packages ({})".format(mode), fresh_copy,
+                           lambda mode=mode: bench_update_packages(tree,
+                                                                   mode)))
+
+    results = list()
+    for name, prepare, function in benchmarks:
+        seconds = best_of(options.repeat, prepare, function)
+        results.append({"benchmark": name, "packages": size,
+                        "seconds": seconds, "per_package": seconds / size})
+        print("{:>6} {:<28} {:9.3f}s {:9.2f}ms/package".format(
+            size, name, seconds, seconds / size * 1000), file=sys.stderr)
+
+    return results
+
+
+def compare(results, filename):
+
+    with open(filename) as handle:
+        previous = {(result["benchmark"], result["packages"]):
+                    result["seconds"]
+                    for result in json.load(handle)["results"]}
+
+    print("{:<28} {:>6} {:>10} {:>10} {:>7}".format(
+        "benchmark", "size", "before", "after", "ratio"))
+    for result in results:
+        key = (result["benchmark"], result["packages"])
+        if key not in previous:
+            continue
+        print("{:<28} {:>6} {:>9.3f}s {:>9.3f}s {:>6.2f}x".format(
+            key[0], key[1], previous[key], result["seconds"],
+            result["seconds"] / previous[key]))
+
+
+def parse_list(value):
+
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=parse_list, default="10,100,1000",
+                        help="Comma separated numbers of packages")
+    parser.add_argument("--modes", type=parse_list, default="serial,jobs",
+                        help="update_packages variants to time, of: " +
+                        ", ".join(UPDATE_MODES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--depth", type=int, default=50,
+                        help="Number of commits per repository")
+    parser.add_argument("--changes", type=int, default=20,
+                        help="Number of commits between the release tags")
+    parser.add_argument("--changes-entries", type=int, default=300,
+                        help="Number of old entries per .changes file")
+    parser.add_argument("--tarball-size", type=int, default=64 * 1024)
+    parser.add_argument("--workdir",
+                        help="Where to generate the trees (default: a "
+                        "temporary directory, removed afterwards)")
+    parser.add_argument("-o", "--output",
+                        help="Write the results as JSON to this file "
+                        "(default: results/bench_update-<timestamp>.json)")
+    parser.add_argument("--compare", metavar="OLD_RESULTS",
+                        help="Compare with an earlier results file")
+    options = parser.parse_args()
+
+    unknown = set(options.modes) - set(UPDATE_MODES)
+    if unknown:
+        parser.error("unknown modes: {}".format(", ".join(sorted(unknown))))
+
+    results = list()
+    with tempfile.TemporaryDirectory(prefix="bench-update-") as temporary:
+        workdir = Path(options.workdir or temporary)
+        for size in options.sizes:
+            results += run_size(workdir, int(size), options)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    git_version = subprocess.run(["git", "--version"], check=True,
+                                 stdout=subprocess.PIPE,
+                                 universal_newlines=True).stdout.strip()
+    report = {
+        "date": now.isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "git": git_version,
+        "parameters": {"depth": options.depth, "changes": options.changes,
+                       "changes_entries": options.changes_entries,
+                       "tarball_size": options.tarball_size,
+                       "repeat": options.repeat},
+        "results": results,
+    }
+    output = Path(options.output or "results/bench_update-{}.json".format(
+        now.strftime("%Y%m%dT%H%M%SZ")))
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open("w") as handle:
+        json.dump(report, handle, indent=2)
+        handle.write("\n")
+    print("Results written to {}".format(output))
+
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == "__main__":
+    main()
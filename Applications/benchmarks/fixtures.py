@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""Generate a synthetic OBS project and upstream checkout for benchmarks.
+
+Usage: fixtures.py [-n PACKAGES] [--depth COMMITS] [...] DIRECTORY
+
+The tree looks like what update_packages works on::
+
+    DIRECTORY/obs/pkgN/           OBS package: spec, .changes, patches
+    DIRECTORY/tarballs/           pkgN-<new version>.tar.xz
+    DIRECTORY/src/pkgN/           git repository with tagged history
+    DIRECTORY/bin/osc             stub osc, to put first on PATH
+
+The git history is written with a single "git fast-import" per repository,
+so that even thousands of repositories are created in reasonable time.
+"""
+
+import argparse
+import os
+from pathlib import Path
+import random
+import shutil
+import subprocess
+import sys
+
+VERSION_FROM = "19.08.0"
+VERSION_TO = "19.08.1"
+STABLE_BRANCH = "Applications/19.08"
+
+SEPARATOR = "-" * 67
+
+OSC_STUB = """#!/bin/sh
+# Stub osc for benchmarks: "osc co NAME" creates NAME/.osc, all else passes
+[ -n "$OSC_STUB_LATENCY" ] && sleep "$OSC_STUB_LATENCY"
+if [ "$1" = "co" ]; then mkdir -p "$2/.osc"; fi
+exit 0
+"""
+
+PATCH = "--- a/file\n+++ b/file\n@@ -1 +1 @@\n-old\n+new {}\n"
+
+SPEC_HEADER = """\
+#
+# spec file for package {name}
+#
+# Copyright (c) 2019 SUSE LINUX GmbH, Nuernberg, Germany.
+#
+# All modifications and additions to the file contributed by third parties
+# remain the property of their copyright owners, unless otherwise agreed
+# upon.
+#
+
+
+%define kf5_version 5.60.0
+%bcond_without lang
+Name:           {name}
+Version:        {version}
+Release:        0
+Summary:        Synthetic benchmark package {name}
+License:        GPL-2.0-or-later AND LGPL-2.1-or-later
+Group:          System/GUI/KDE
+URL:            https://www.kde.org
+Source0:        https://download.kde.org/stable/applications/%{{version}}/src/%{{name}}-%{{version}}.tar.xz
+Source1:        baselibs.conf
+"""
+
+
+def spec_text(name, version=VERSION_FROM, subpackages=4, patches=3,
+              build_requires=40, files=25):
+    """A spec file shaped like those of KDE Applications packages."""
+    lines = [SPEC_HEADER.format(name=name, version=version)]
+    lines += ["Patch{}:         {:04d}-fix-{}.patch".format(i, i, i)
+              for i in range(patches)]
+    lines += ["BuildRequires:  cmake(KF5Dep{}) >= %{{kf5_version}}".format(i)
+              for i in range(build_requires)]
+    lines += ["Requires:       kf5-filesystem", "",
+              "%description", "{} is a synthetic package.".format(name), ""]
+
+    for i in range(subpackages):
+        lines += ["%package sub{}".format(i),
+                  "Summary:        Subpackage {} of {}".format(i, name),
+                  "Group:          Development/Libraries/KDE",
+                  "Requires:       %{name} = %{version}", "",
+                  "%description sub{}".format(i),
+                  "Subpackage {} of {}.".format(i, name), ""]
+
+    lines += ["%lang_package", "", "%prep", "%setup -q"]
+    lines += ["%patch{} -p1".format(i) for i in range(patches)]
+    lines += ["", "%build", "%cmake_kf5 -d build", "%make_jobs", "",
+              "%install", "%kf5_makeinstall -C build",
+              "%fdupes %{buildroot}", "",
+              "%post -p /sbin/ldconfig", "%postun -p /sbin/ldconfig", "",
+              "%files", "%license COPYING",
+              "%{_kf5_bindir}/%{name}"]
+    for i in range(subpackages):
+        lines += ["", "%files sub{}".format(i)]
+        lines += ["%{{_kf5_libdir}}/sub{}/file{}.so".format(i, j)
+                  for j in range(files)]
+    lines += ["", "%changelog", ""]
+
+    return "\n".join(lines)
+
+
+def changes_text(entries, rng):
+    """A .changes file with entries for older versions, newest first."""
+    parts = list()
+    for i in range(entries):
+        major, minor = 19 - i // 36, (i // 12) % 3 * 4 + 4
+        version = "{}.{:02d}.{}".format(major, minor, 11 - i % 12)
+        parts.append(
+            "{}\n"
+            "Thu Sep  5 10:{:02d}:00 UTC {} - packager{}@suse.com\n\n"
+            "- Update to {}\n"
+            "  * New bugfix release\n"
+            "  * For more details please see:\n"
+            "  * https://www.kde.org/announcements/"
+            "announce-applications-{}.php\n"
+            "- Changes since the previous version:\n".format(
+                SEPARATOR, i % 60, 2019 - i // 36, i % 7, version, version))
+        parts.extend("  * Fix issue number {} (kde#{})\n".format(
+            rng.randrange(100000), rng.randrange(300000, 420000))
+            for _ in range(rng.randrange(2, 12)))
+        parts.append("\n")
+
+    return "".join(parts)
+
+
+def _blob(data):
+
+    data = data.encode("utf-8")
+    return b"data %d\n%s\n" % (len(data), data)
+
+
+def fast_import_stream(name, depth, changes, rng):
+    """A "git fast-import" stream of depth commits on master.
+
+    The last changes commits lie between the v<VERSION_FROM> and
+    v<VERSION_TO> tags; the stable branch points at the last commit.
+    """
+    stream = [b"reset refs/heads/master\n"]
+    tag_from = max(depth - changes, 1)
+
+    for mark in range(1, depth + 1):
+        timestamp = 1500000000 + mark * 3600
+        message = "Fix issue {} in {}\n".format(mark, name)
+        if mark % 3 == 0:
+            message += "\nBUG: {}\n".format(rng.randrange(300000, 420000))
+        if mark % 10 == 0:
+            message = "SVN_SILENT made messages (.desktop file)\n"
+        stream.append(b"commit refs/heads/master\nmark :%d\n" % mark)
+        stream.append(b"author Dev <dev@kde.org> %d +0000\n" % timestamp)
+        stream.append(b"committer Dev <dev@kde.org> %d +0000\n" % timestamp)
+        stream.append(_blob(message))
+        stream.append(b"M 644 inline src/file%d.cpp\n" % (mark % 50))
+        stream.append(_blob("// revision {}\n".format(mark)))
+        stream.append(b"\n")
+
+    for tag, mark in (("v" + VERSION_FROM, tag_from),
+                      ("v" + VERSION_TO, depth)):
+        stream.append("reset refs/tags/{}\nfrom :{}\n\n".format(
+            tag, mark).encode())
+    stream.append("reset refs/heads/{}\nfrom :{}\n\n".format(
+        STABLE_BRANCH, depth).encode())
+
+    return b"".join(stream)
+
+
+def create_repository(path, name, depth, changes, rng):
+
+    path.mkdir(parents=True)
+    subprocess.run(["git", "init", "-q"], cwd=str(path), check=True)
+    subprocess.run(["git", "fast-import", "--quiet"], cwd=str(path),
+                   input=fast_import_stream(name, depth, changes, rng),
+                   check=True)
+
+
+def create_tree(root, packages=10, depth=50, changes=20, changes_entries=300,
+                tarball_size=64 * 1024, seed=0):
+    """Create the synthetic tree below root and return the package names."""
+    root = Path(root)
+    rng = random.Random(seed)
+
+    for directory in ("obs", "tarballs", "src", "bin"):
+        (root / directory).mkdir(parents=True, exist_ok=True)
+
+    osc = root / "bin" / "osc"
+    osc.write_text(OSC_STUB)
+    osc.chmod(0o755)
+
+    names = ["pkg{:04d}".format(i) for i in range(packages)]
+    for name in names:
+        package_dir = root / "obs" / name
+        (package_dir / ".osc").mkdir(parents=True)
+        (package_dir / (name + ".spec")).write_text(spec_text(name))
+        (package_dir / (name + ".changes")).write_text(
+            changes_text(changes_entries, rng))
+        for i in range(3):
+            (package_dir / "{:04d}-fix-{}.patch".format(i, i)).write_text(
+                PATCH.format(i))
+
+        tarball = root / "tarballs" / "{}-{}.tar.xz".format(name, VERSION_TO)
+        tarball.write_bytes(rng.getrandbits(8 * tarball_size).to_bytes(
+            tarball_size, "little") if tarball_size else b"")
+
+        create_repository(root / "src" / name, name, depth, changes, rng)
+
+    with open(str(root / "packages"), "w") as handle:
+        handle.write("\n".join(names) + "\n")
+
+    return names
+
+
+def copy_tree(source, destination):
+    """Copy the mutable parts of a tree (obs, tarballs) for one run.
+
+    The git repositories and the osc stub are shared by symlinks.
+    """
+    source, destination = Path(source), Path(destination)
+    if destination.exists():
+        shutil.rmtree(str(destination))
+    destination.mkdir(parents=True)
+
+    for directory in ("obs", "tarballs"):
+        shutil.copytree(str(source / directory), str(destination / directory),
+                        symlinks=True)
+    for name in ("src", "bin", "packages"):
+        os.symlink(str((source / name).resolve()), str(destination / name))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--packages", type=int, default=10)
+    parser.add_argument("--depth", type=int, default=50,
+                        help="Number of commits per repository")
+    parser.add_argument("--changes", type=int, default=20,
+                        help="Number of commits between the two release tags")
+    parser.add_argument("--changes-entries", type=int, default=300,
+                        help="Number of old entries per .changes file")
+    parser.add_argument("--tarball-size", type=int, default=64 * 1024)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("directory")
+    options = parser.parse_args()
+
+    if Path(options.directory).exists():
+        sys.exit("{} exists already".format(options.directory))
+
+    create_tree(options.directory, options.packages, options.depth,
+                options.changes, options.changes_entries,
+                options.tarball_size, options.seed)
+
+
+if __name__ == "__main__":
+    main()
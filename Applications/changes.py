@@ -0,0 +1,373 @@
+"""Parsing and merging of .changes files.
+
+A .changes file lists the entries of a package's changelog, newest first.
+Each entry starts with a line of dashes and a header with its date and
+author::
+
+    -------------------------------------------------------------------
+    Thu Sep  5 10:00:00 UTC 2019 - someone@suse.com
+
+    - Update to 19.08.0
+
+Entries are identified by their timestamp, author and a hash of their
+text, so that the same entry found in two files is recognized whatever
+whitespace it was saved with. Merging two files sorts the union of their
+entries by timestamp, newest first.
+
+Questions about the newest entries only need the start of a file::
+
+    for entry in iter_entries("foo.changes", limit=5):
+        ...
+    last_version("foo.changes")     # e.g. "19.08.1"
+
+iter_entries() maps the file and stops at the delimiter after the last
+entry asked for, so the size of the file does not matter.
+"""
+
+import calendar
+import hashlib
+import mmap
+import os
+from pathlib import Path
+import re
+
+from fileops import write_file
+
+__all__ = ["ChangesEntry", "ChangesFile", "DELIMITER", "MergeResult",
+           "iter_entries", "last_version", "merge_entries", "merge_files",
+           "merge_projects", "parse_changes", "parse_timestamp",
+           "render_entries"]
+
+DELIMITER = "-" * 67
+_DELIMITER_LINE = (DELIMITER + "\n").encode()
+
+# Read size when a file cannot be mapped
+_BLOCK_SIZE = 64 * 1024
+
+# "- Update to 19.08.1", "  * Update to version 5.17.0:"
+_UPDATE_RE = re.compile(r"^[-*\s]*Update to (?:version )?(\S+?)[:.,]?\s*$",
+                        re.MULTILINE | re.IGNORECASE)
+
+# "Thu Sep  5 10:00:00 UTC 2019", and "Thu 05 Sep 10.00.00 UTC 2019" as
+# written by update_applications
+_DATE_RE = re.compile(
+    r"^\s*[A-Za-z]{3}\s+(?:(?P<month>[A-Za-z]{3})\s+(?P<day>\d{1,2})|"
+    r"(?P<day2>\d{1,2})\s+(?P<month2>[A-Za-z]{3}))\s+"
+    r"(?P<hour>\d{1,2})[:.](?P<minute>\d\d)[:.](?P<second>\d\d)\s+"
+    r"(?:(?P<zone>[A-Za-z]{1,5}|[+-]\d{4})\s+)?(?P<year>\d{4})\s*$")
+
+_MONTHS = {name: number for number, name in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct",
+     "Nov", "Dec"), 1)}
+
+# Offsets in hours of the zone names found in openSUSE changelogs
+_ZONES = {"UTC": 0, "GMT": 0, "Z": 0, "WET": 0, "WEST": 1, "BST": 1,
+          "CET": 1, "CEST": 2, "MET": 1, "MEST": 2, "EET": 2, "EEST": 3,
+          "MSK": 3, "IST": 5.5, "CST": -6, "CDT": -5, "EST": -5, "EDT": -4,
+          "MST": -7, "MDT": -6, "PST": -8, "PDT": -7, "JST": 9, "KST": 9,
+          "AEST": 10, "AEDT": 11}
+
+
+def parse_timestamp(date):
+    """Return the Unix time of a changelog date, or None if it cannot be
+    parsed. Dates without a zone are taken as UTC."""
+
+    match = _DATE_RE.match(date)
+    if match is None:
+        return None
+
+    month = _MONTHS.get((match.group("month") or
+                         match.group("month2")).capitalize())
+    zone = match.group("zone") or "UTC"
+    if zone[0] in "+-":
+        offset = int(zone[0] + "1") * (int(zone[1:3]) * 3600 +
+                                       int(zone[3:]) * 60)
+    elif zone.upper() in _ZONES:
+        offset = int(_ZONES[zone.upper()] * 3600)
+    else:
+        return None
+    if month is None:
+        return None
+
+    try:
+        return calendar.timegm((int(match.group("year")), month,
+                                int(match.group("day") or
+                                    match.group("day2")),
+                                int(match.group("hour")),
+                                int(match.group("minute")),
+                                int(match.group("second")))) - offset
+    except (OverflowError, ValueError):
+        return None
+
+
+class ChangesEntry:
+    """One entry of a .changes file.
+
+    text is the entry as found in the file, from its header up to the next
+    delimiter line.
+    """
+
+    def __init__(self, timestamp, author, body_hash, text):
+        self.timestamp = timestamp
+        self.author = author
+        self.body_hash = body_hash
+        self.text = text
+
+    @property
+    def key(self):
+        return self.timestamp, self.author, self.body_hash
+
+    @property
+    def header(self):
+        return self.text.split("\n", 1)[0]
+
+    def __repr__(self):
+        return "ChangesEntry({!r})".format(self.header)
+
+
+class ChangesFile:
+    """The entries of a .changes file, and the headers of those that could
+    not be parsed."""
+
+    def __init__(self, entries, invalid):
+        self.entries = entries
+        self.invalid = invalid
+
+    @staticmethod
+    def from_file(filename):
+        with open(str(filename), encoding="utf-8", newline="") as handle:
+            return parse_changes(handle.read())
+
+
+def _body_hash(body):
+
+    lines = [line.rstrip() for line in body.strip("\n").splitlines()]
+    return hashlib.sha1("\n".join(lines).strip().encode()).hexdigest()
+
+
+def _parse_entry(chunk):
+
+    header, _, body = chunk.partition("\n")
+    date, separator, author = header.partition(" - ")
+    timestamp = parse_timestamp(date) if separator else None
+    if timestamp is None:
+        return None
+
+    return ChangesEntry(timestamp, author.strip(), _body_hash(body), chunk)
+
+
+def parse_changes(text):
+    """Split the text of a .changes file into ChangesEntry objects."""
+
+    entries = list()
+    invalid = list()
+    chunks = text.split(DELIMITER + "\n")
+    if chunks[0].strip():
+        invalid.append(chunks[0].split("\n", 1)[0])
+
+    for chunk in chunks[1:]:
+        entry = _parse_entry(chunk)
+        if entry is None:
+            invalid.append(chunk.split("\n", 1)[0])
+        else:
+            entries.append(entry)
+
+    return ChangesFile(entries, invalid)
+
+
+def _mapped_chunks(data):
+
+    start = data.find(_DELIMITER_LINE)
+    while start >= 0:
+        start += len(_DELIMITER_LINE)
+        end = data.find(_DELIMITER_LINE, start)
+        yield data[start:end if end >= 0 else len(data)]
+        start = end
+
+
+def _read_chunks(handle):
+
+    buffer = b""
+    started = False
+    while True:
+        block = handle.read(_BLOCK_SIZE)
+        buffer += block
+        while True:
+            end = buffer.find(_DELIMITER_LINE)
+            if end < 0:
+                break
+            if started:
+                yield buffer[:end]
+            started = True
+            buffer = buffer[end + len(_DELIMITER_LINE):]
+        if not block:
+            break
+        if not started:
+            # Keep what may be the start of the first delimiter only
+            buffer = buffer[-len(_DELIMITER_LINE):]
+
+    if started:
+        yield buffer
+
+
+def iter_entries(filename, limit=None):
+    """Yield the entries of a .changes file, newest first, reading no
+    further than the delimiter after the last one needed.
+
+    Entries that cannot be parsed are skipped. With limit, at most that
+    many entries are yielded.
+    """
+    if limit is not None and limit <= 0:
+        return
+
+    with open(str(filename), "rb") as handle:
+        try:
+            data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Empty files, or file systems that cannot map files
+            data = None
+
+        try:
+            chunks = (_mapped_chunks(data) if data is not None
+                      else _read_chunks(handle))
+            count = 0
+            for chunk in chunks:
+                entry = _parse_entry(chunk.decode("utf-8", "replace"))
+                if entry is None:
+                    continue
+                yield entry
+                count += 1
+                if count == limit:
+                    return
+        finally:
+            if data is not None:
+                data.close()
+
+
+def last_version(filename, search=10):
+    """Return the version of the newest "Update to" entry among the first
+    search entries of a .changes file, or None."""
+
+    try:
+        for entry in iter_entries(filename, search):
+            match = _UPDATE_RE.search(entry.text)
+            if match is not None:
+                return match.group(1)
+    except FileNotFoundError:
+        pass
+
+    return None
+
+
+def merge_entries(*entry_lists):
+    """Return the entries of all lists, newest first and each only once.
+
+    Entries with the same timestamp keep the order they were given in.
+    """
+    seen = set()
+    merged = list()
+    for entries in entry_lists:
+        for entry in entries:
+            if entry.key not in seen:
+                seen.add(entry.key)
+                merged.append(entry)
+
+    merged.sort(key=lambda entry: -entry.timestamp)
+
+    return merged
+
+
+def render_entries(entries):
+    """Return the text of a .changes file with the given entries."""
+
+    parts = list()
+    for index, entry in enumerate(entries):
+        text = entry.text
+        if index < len(entries) - 1:
+            # Entries from the end of a file may lack the blank line
+            text = text.rstrip("\n") + "\n\n"
+        elif not text.endswith("\n"):
+            text += "\n"
+        parts.append(DELIMITER + "\n" + text)
+
+    return "".join(parts)
+
+
+class MergeResult:
+    """The outcome of merge_files(): the files written, or the invalid
+    headers that kept the files from being merged."""
+
+    def __init__(self, name, written=(), invalid=()):
+        self.name = name
+        self.written = list(written)
+        self.invalid = list(invalid)
+
+    def describe(self):
+
+        if self.invalid:
+            return ["Invalid entries were found in {}:".format(self.name)] + [
+                "-> {}".format(header) for header in self.invalid]
+        if not self.written:
+            return ["{}: unchanged".format(self.name)]
+
+        return ["{}: updated {}".format(
+            self.name, ", ".join(str(filename) for filename in self.written))]
+
+
+def merge_files(first, second, oneway=False, name=None):
+    """Merge the entries of two .changes files into both of them.
+
+    With oneway, only second is changed. Files that already have all
+    entries are not written, and neither file is if one has entries that
+    cannot be parsed.
+    """
+    files = [ChangesFile.from_file(first), ChangesFile.from_file(second)]
+    result = MergeResult(name or str(second))
+    for changes in files:
+        result.invalid.extend(changes.invalid)
+    if result.invalid:
+        return result
+
+    merged = merge_entries(files[0].entries, files[1].entries)
+    keys = set(entry.key for entry in merged)
+
+    targets = [(second, files[1])]
+    if not oneway:
+        targets.append((first, files[0]))
+
+    text = None
+    for filename, changes in targets:
+        if set(entry.key for entry in changes.entries) == keys:
+            continue
+        if text is None:
+            text = render_entries(merged)
+        write_file(filename, text)
+        result.written.append(filename)
+
+    return result
+
+
+def _merge_pair(arguments):
+
+    return merge_files(*arguments)
+
+
+def merge_projects(first, second, oneway=False, jobs=None):
+    """Merge the .changes files of all packages found in both project
+    directories, jobs packages at a time in separate processes.
+
+    Yields a MergeResult per package as it is done.
+    """
+    from multiprocessing import Pool
+
+    first, second = Path(first), Path(second)
+    names = sorted(set(path.relative_to(first)
+                       for path in first.glob("*/*.changes")) &
+                   set(path.relative_to(second)
+                       for path in second.glob("*/*.changes")))
+    pairs = [(first / name, second / name, oneway, str(name))
+             for name in names]
+
+    with Pool(max(jobs or os.cpu_count(), 1)) as pool:
+        for result in pool.imap_unordered(_merge_pair, pairs, chunksize=8):
+            yield result
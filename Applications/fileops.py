@@ -0,0 +1,351 @@
+"""File operations on OBS package checkouts.
+
+Everything here replaces files atomically: new contents are written to a
+temporary file in the target directory, which is then renamed over the
+target. An interrupted run therefore never leaves half-written files.
+"""
+
+import fcntl
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+
+__all__ = ["DirectoryIndex", "FileTransaction", "copy_contents",
+           "directory_digests", "file_digest", "place_file", "prepend_files",
+           "write_file"]
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# ioctl sharing the extents of another file (btrfs, XFS), from linux/fs.h
+FICLONE = 0x40049409
+
+
+def copy_contents(source_fd, destination_fd):
+    """Copy everything from source_fd to destination_fd, at their offsets.
+
+    The copy happens in the kernel with copy_file_range() or sendfile()
+    where possible, and falls back to a plain buffered copy.
+    """
+    copy_functions = list()
+    if hasattr(os, "copy_file_range"):
+        copy_functions.append(os.copy_file_range)
+    if hasattr(os, "sendfile"):
+        copy_functions.append(_sendfile)
+
+    for copy_function in copy_functions:
+        try:
+            while copy_function(source_fd, destination_fd, COPY_BUFFER_SIZE):
+                pass
+            return
+        except OSError:
+            # Not supported for these files, e.g. across file systems on
+            # older kernels. Both calls advance the file offsets, so the
+            # next method continues where this one stopped.
+            continue
+
+    while True:
+        block = os.read(source_fd, COPY_BUFFER_SIZE)
+        if not block:
+            break
+        view = memoryview(block)
+        while view:
+            view = view[os.write(destination_fd, view):]
+
+
+def _sendfile(source_fd, destination_fd, count):
+    return os.sendfile(destination_fd, source_fd, None, count)
+
+
+def _temporary_for(filename):
+
+    directory, basename = os.path.split(os.path.abspath(filename))
+
+    return tempfile.mkstemp(prefix="." + basename + ".", dir=directory)
+
+
+def prepend_files(filenames, header):
+    """Prepend header to each of filenames in one operation.
+
+    The header is written to a temporary file, followed by the unchanged
+    old contents, copied in large blocks. Only when all temporary files
+    are complete are they renamed over the originals, so a failure leaves
+    all files untouched. Missing files are created with just the header.
+    """
+    if isinstance(header, str):
+        header = header.encode()
+
+    prepared = list()
+    try:
+        for filename in filenames:
+            filename = str(filename)
+            fd, temporary = _temporary_for(filename)
+            prepared.append((temporary, filename))
+            with os.fdopen(fd, "wb") as destination:
+                destination.write(header)
+                destination.flush()
+                try:
+                    with open(filename, "rb") as source:
+                        copy_contents(source.fileno(), destination.fileno())
+                        mode = stat.S_IMODE(os.fstat(source.fileno()).st_mode)
+                    os.chmod(temporary, mode)
+                except FileNotFoundError:
+                    pass
+                os.fsync(destination.fileno())
+
+        for temporary, filename in prepared:
+            os.replace(temporary, filename)
+    except BaseException:
+        for temporary, _ in prepared:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+        raise
+
+
+def write_file(filename, text):
+    """Replace the contents of filename with text, keeping its
+    permissions."""
+
+    filename = str(filename)
+    fd, temporary = _temporary_for(filename)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as handle:
+            handle.write(text)
+            handle.flush()
+            os.fsync(handle.fileno())
+        try:
+            os.chmod(temporary, stat.S_IMODE(os.stat(filename).st_mode))
+        except FileNotFoundError:
+            pass
+        os.replace(temporary, filename)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+
+
+def _reflink(source, temporary):
+
+    with open(source, "rb") as source_file, open(temporary, "wb") as target:
+        fcntl.ioctl(target.fileno(), FICLONE, source_file.fileno())
+
+
+def _hardlink(source, temporary):
+
+    os.unlink(temporary)
+    os.link(source, temporary)
+
+
+def _copy(source, temporary):
+
+    with open(source, "rb") as source_file, open(temporary, "wb") as target:
+        copy_contents(source_file.fileno(), target.fileno())
+
+
+_PLACE_METHODS = (("reflink", _reflink), ("hardlink", _hardlink),
+                  ("copy", _copy))
+
+
+def place_file(source, destination, hardlink=True):
+    """Make destination a copy of source, as cheaply as possible.
+
+    A reflink (shared extents) is tried first, then a hard link (unless
+    hardlink is false), then a kernel side copy; a buffered copy is the
+    last resort. The result is renamed over destination. Returns the name
+    of the method that worked.
+    """
+    source, destination = str(source), str(destination)
+    mode = stat.S_IMODE(os.stat(source).st_mode)
+
+    fd, temporary = _temporary_for(destination)
+    os.close(fd)
+    try:
+        for method, place in _PLACE_METHODS:
+            if method == "hardlink" and not hardlink:
+                continue
+            try:
+                place(source, temporary)
+                break
+            except OSError:
+                if method == "copy":
+                    raise
+                if not os.path.exists(temporary):
+                    open(temporary, "wb").close()
+        if method != "hardlink":
+            os.chmod(temporary, mode)
+        os.replace(temporary, destination)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+
+    return method
+
+
+def file_digest(filename, algorithm="sha256"):
+    """Return the digest of the contents of filename, or None if it does
+    not exist."""
+
+    digest = hashlib.new(algorithm)
+    try:
+        with open(str(filename), "rb") as handle:
+            for block in iter(lambda: handle.read(COPY_BUFFER_SIZE), b""):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+
+    return digest.hexdigest()
+
+
+def directory_digests(directory, known=None, algorithm="md5"):
+    """Return {name: digest} of the regular files in directory, without
+    hidden ones, and how many files had to be read.
+
+    known maps names to (size, mtime, digest) as recorded when the files
+    were last written, e.g. by oscpool.read_file_list(). Files whose size
+    and mtime still match take their digest from there instead of being
+    read.
+    """
+    known = known or dict()
+    digests = dict()
+    read = 0
+    with os.scandir(str(directory)) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            info = entry.stat()
+            recorded = known.get(entry.name)
+            if (recorded is not None and recorded[0] == info.st_size and
+                    recorded[1] == int(info.st_mtime)):
+                digests[entry.name] = recorded[2]
+            else:
+                digests[entry.name] = file_digest(entry.path, algorithm)
+                read += 1
+
+    return digests, read
+
+
+class FileTransaction:
+    """Replace and remove several files of one directory, all or nothing.
+
+    Changes are prepared in a private staging directory inside the target
+    directory and only carried out when the with block is left without an
+    exception::
+
+        with FileTransaction(package_dir) as transaction:
+            transaction.copy(new_patch, "fix-build.patch")
+            transaction.remove("old.patch")
+            transaction.write("foo.spec", text)
+
+    Files that are replaced or removed are first moved aside, so a failure
+    while committing puts them back. Transactions on different directories,
+    or with different files, can run at the same time.
+    """
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        self.staging = None
+        self._staged = list()
+        self._removed = list()
+
+    def __enter__(self):
+        self.staging = tempfile.mkdtemp(prefix=".transaction.",
+                                        dir=self.directory)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            shutil.rmtree(self.staging, ignore_errors=True)
+
+    def _stage_path(self, name):
+        """Return where name is staged; it must be a plain file name."""
+        if os.path.basename(name) != name or name in ("", ".", ".."):
+            raise ValueError("Not a file name: {!r}".format(name))
+        return os.path.join(self.staging, "new", name)
+
+    def copy(self, source, name):
+        """Make name a copy of source, as cheaply as possible.
+
+        The copy is never a hard link, as files in package checkouts are
+        edited in place.
+        """
+        staged = self._stage_path(name)
+        os.makedirs(os.path.dirname(staged), exist_ok=True)
+        place_file(source, staged, hardlink=False)
+        self._staged.append(name)
+
+    def write(self, name, text):
+        """Make text the new contents of name, keeping its permissions."""
+        staged = self._stage_path(name)
+        os.makedirs(os.path.dirname(staged), exist_ok=True)
+        with open(staged, "w", encoding="utf-8", newline="") as handle:
+            handle.write(text)
+            handle.flush()
+            os.fsync(handle.fileno())
+        try:
+            mode = os.stat(os.path.join(self.directory, name)).st_mode
+            os.chmod(staged, stat.S_IMODE(mode))
+        except FileNotFoundError:
+            pass
+        self._staged.append(name)
+
+    def remove(self, name):
+        """Remove name, if it exists."""
+        self._stage_path(name)
+        self._removed.append(name)
+
+    def commit(self):
+
+        backup = os.path.join(self.staging, "old")
+        os.makedirs(backup, exist_ok=True)
+        moved_aside = list()
+        placed = list()
+        try:
+            for name in dict.fromkeys(self._staged + self._removed):
+                target = os.path.join(self.directory, name)
+                try:
+                    os.replace(target, os.path.join(backup, name))
+                except FileNotFoundError:
+                    continue
+                moved_aside.append(name)
+            for name in dict.fromkeys(self._staged):
+                os.replace(os.path.join(self.staging, "new", name),
+                           os.path.join(self.directory, name))
+                placed.append(name)
+        except BaseException:
+            for name in placed:
+                os.unlink(os.path.join(self.directory, name))
+            for name in moved_aside:
+                os.replace(os.path.join(backup, name),
+                           os.path.join(self.directory, name))
+            raise
+
+
+class DirectoryIndex:
+    """The names of the entries of a directory, read with one scandir().
+
+    Lookups are set membership tests instead of stat() calls. The index
+    is not refreshed; changes made through this program have to be
+    recorded with add() and discard().
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        try:
+            with os.scandir(self.path) as entries:
+                self.names = set(entry.name for entry in entries)
+        except FileNotFoundError:
+            self.names = set()
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def add(self, name):
+        self.names.add(name)
+
+    def discard(self, name):
+        self.names.discard(name)
@@ -0,0 +1,520 @@
+"""Reading and indexing the history of upstream KDE git checkouts.
+
+read_log_records() streams "git log" output without spawning a process per
+commit. RefIndex answers tag and branch lookups from a single
+"git for-each-ref" per repository and run. CommitIndex keeps the commits,
+BUG: references and refs of every checkout in an SQLite database, so that
+changelogs for a tag range can be generated without walking the history
+again each release.
+"""
+
+import heapq
+import os
+from pathlib import Path
+import re
+import subprocess
+import threading
+
+import instrument
+
+__all__ = ["CommitIndex", "RefIndex", "parse_bugs", "read_log_records"]
+
+# git log output: one record per commit, fields separated by FIELD_SEPARATOR
+RECORD_SEPARATOR = b"\x1e"
+FIELD_SEPARATOR = "\x1f"
+LOG_FIELDS = ("%H", "%s", "%b")
+LOG_CHUNK_SIZE = 64 * 1024
+
+BUG_RE = re.compile(r"^\s*(?:BUG|FEATURE):\s*"
+                    r"(?:https?://bugs\.kde\.org/\S*?)?(\d+)\s*$",
+                    re.MULTILINE)
+
+INDEX_FILENAME = ".commit-index.sqlite"
+
+# Bumped when the schema or the parsing of commits changes; older indexes
+# are rebuilt from scratch
+_SCHEMA_VERSION = 3
+
+_DROP_SCHEMA = """
+DROP TABLE IF EXISTS repos;
+DROP TABLE IF EXISTS commits;
+DROP TABLE IF EXISTS parents;
+DROP TABLE IF EXISTS refs;
+"""
+
+# generation is 1 for root commits and one more than the highest
+# generation of the parents otherwise, so ancestors always have a lower
+# generation than their descendants
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS repos (
+    name TEXT PRIMARY KEY,
+    heads TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS commits (
+    repo TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    generation INTEGER NOT NULL,
+    merge INTEGER NOT NULL,
+    subject TEXT NOT NULL,
+    bugs TEXT NOT NULL,
+    PRIMARY KEY (repo, hash)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS parents (
+    repo TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    PRIMARY KEY (repo, hash, parent)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS parents_by_parent ON parents (repo, parent);
+CREATE TABLE IF NOT EXISTS refs (
+    repo TEXT NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (repo, kind, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS refs_by_hash ON refs (repo, hash);
+"""
+
+_DESCENDANTS_SQL = """
+WITH RECURSIVE descendants(hash) AS (
+    SELECT :start
+    UNION
+    SELECT parents.hash FROM parents JOIN descendants
+    ON parents.repo = :repo AND parents.parent = descendants.hash
+)
+SELECT refs.name FROM refs JOIN descendants
+ON refs.repo = :repo AND refs.hash = descendants.hash
+WHERE refs.kind != 'tag'
+ORDER BY refs.name
+"""
+
+
+def parse_bugs(body):
+    """Return the bug numbers closed by BUG: and FEATURE: lines of a
+    commit message."""
+    return BUG_RE.findall(body)
+
+
+def read_log_records(revisions, cwd=None, limit=None, fields=LOG_FIELDS):
+    """Yield one tuple of fields for each commit "git log revisions" lists.
+
+    The history is read from a single streaming git process and parsed as
+    it arrives. When limit is given, at most limit records are read before
+    git is terminated. Only the last field may contain newlines.
+    """
+    log_format = "%x1e" + "%x1f".join(fields)
+    command = ["git", "log", "--pretty=format:" + log_format] + revisions
+    with instrument.span("subprocess", "git log", cwd=cwd) as span:
+        process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE)
+
+        count = 0
+        pending = b""
+        try:
+            while True:
+                chunk = process.stdout.read1(LOG_CHUNK_SIZE)
+                span.bytes += len(chunk)
+                records = (pending + chunk).split(RECORD_SEPARATOR)
+                # The last record may still be incomplete until git is done
+                pending = records.pop() if chunk else b""
+                for record in records:
+                    if not record:
+                        continue
+                    record = record.decode(errors="replace")
+                    yield tuple(record.split(FIELD_SEPARATOR,
+                                             len(fields) - 1))
+                    count += 1
+                    if limit is not None and count >= limit:
+                        return
+                if not chunk:
+                    break
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            returncode = process.wait()
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+
+def read_refs(cwd=None):
+    """Return (refname, commit) pairs for all branches and tags of a repo.
+
+    Annotated tags are peeled to the commit they point to.
+    """
+    command = ["git", "for-each-ref",
+               "--format=%(refname) %(objectname) %(*objectname)",
+               "refs/heads", "refs/remotes", "refs/tags"]
+    with instrument.span("subprocess", "git for-each-ref",
+                         cwd=cwd) as span:
+        output = subprocess.check_output(command, cwd=cwd,
+                                         universal_newlines=True)
+        span.bytes = len(output)
+
+    refs = list()
+    for line in output.splitlines():
+        refname, objectname, peeled = (line.split(" ") + [""])[:3]
+        refs.append((refname, peeled or objectname))
+
+    return refs
+
+
+def _ref_kind_and_name(refname):
+
+    if refname.startswith("refs/tags/"):
+        return "tag", refname[len("refs/tags/"):]
+    if refname.startswith("refs/heads/"):
+        return "branch", refname[len("refs/heads/"):]
+    # refs/remotes/<remote>/<branch>
+    return "remote", refname[len("refs/remotes/"):]
+
+
+def version_key(tag):
+    """Sort key ordering tags like v19.08.2 < v19.08.10 numerically."""
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r"(\d+)", tag)]
+
+
+class RefIndex:
+    """The branches and tags of one repository.
+
+    All refs are read with one "git for-each-ref" call. Instances are
+    cached per repository path for the lifetime of the process, see
+    for_repo().
+    """
+
+    _cache = dict()
+    _cache_lock = threading.Lock()
+
+    def __init__(self, repo_path):
+        self.repo_path = Path(repo_path)
+        self.tags = dict()
+        self.branches = dict()
+        self.remote_branches = dict()
+        self._merged_tags = dict()
+
+        for refname, commit in read_refs(self.repo_path):
+            kind, name = _ref_kind_and_name(refname)
+            if kind == "tag":
+                self.tags[name] = commit
+            elif kind == "branch":
+                self.branches[name] = commit
+            else:
+                # Prefer the first remote, usually the only one (origin)
+                branch = name.split("/", 1)[-1]
+                self.remote_branches.setdefault(branch, name)
+
+    @classmethod
+    def for_repo(cls, repo_path):
+        """Return the (cached) index of the repository at repo_path."""
+        key = str(Path(repo_path).resolve())
+        index = cls._cache.get(key)
+        if index is None:
+            # Read outside the lock, so that one repository's git call does
+            # not hold up threads asking for others. Threads racing for the
+            # same repository all get the index stored first.
+            index = cls(key)
+            with cls._cache_lock:
+                index = cls._cache.setdefault(key, index)
+
+        return index
+
+    @classmethod
+    def clear_cache(cls):
+
+        with cls._cache_lock:
+            cls._cache.clear()
+
+    def has_tag(self, tag):
+        return tag in self.tags
+
+    def branch(self, name):
+        """Return the ref to use for a branch, local or remote, or None."""
+        if name in self.branches:
+            return name
+
+        return self.remote_branches.get(name)
+
+    def latest_tag(self, branch, prefix="v"):
+        """Return the highest prefix* tag reachable from a branch, or None."""
+        ref = self.branch(branch)
+        if ref is None:
+            return None
+
+        if ref not in self._merged_tags:
+            command = ["git", "tag", "--list", prefix + "*", "--merged", ref]
+            with instrument.span("subprocess", "git tag",
+                                 cwd=self.repo_path) as span:
+                output = subprocess.check_output(
+                    command, cwd=str(self.repo_path), universal_newlines=True)
+                span.bytes = len(output)
+            tags = output.split()
+            self._merged_tags[ref] = max(tags, key=version_key, default=None)
+
+        return self._merged_tags[ref]
+
+
+class CommitIndex:
+    """Commit metadata of many upstream repositories in one SQLite file.
+
+    Repositories are identified by the name of their checkout directory,
+    the same name used to look them up below --checkout-dir. Each thread
+    gets its own connection, so an index can be shared by parallel
+    package updates.
+    """
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self._local = threading.local()
+
+        with self._connection() as connection:
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != _SCHEMA_VERSION:
+                connection.executescript(_DROP_SCHEMA)
+                connection.execute(
+                    "PRAGMA user_version = {:d}".format(_SCHEMA_VERSION))
+            connection.executescript(_SCHEMA)
+
+    def _connection(self):
+
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Only needed with an index, refs and logs are read from git
+            import sqlite3
+            connection = sqlite3.connect(self.filename, timeout=60)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+
+        return connection
+
+    def refresh(self, repo_path):
+        """Index the commits of repo_path added since the last refresh.
+
+        Only commits that are not reachable from the heads recorded last
+        time are read from git. Returns the number of new commits.
+        """
+        repo_path = Path(repo_path)
+        repo = repo_path.name
+        connection = self._connection()
+
+        row = connection.execute("SELECT heads FROM repos WHERE name = ?",
+                                 (repo,)).fetchone()
+        known_heads = row[0].split() if row else []
+
+        refs = read_refs(repo_path)
+        heads = sorted(set(commit for _, commit in refs))
+
+        # Parents are listed after all their children
+        revisions = ["--topo-order", "--all", "--not"] + known_heads
+        fields = ("%H", "%P", "%ct", "%s", "%b")
+        try:
+            records = list(read_log_records(revisions, repo_path,
+                                            fields=fields))
+        except subprocess.CalledProcessError:
+            # A previously indexed head is gone (e.g. after a forced push
+            # and gc), read everything again
+            records = list(read_log_records(["--topo-order", "--all"],
+                                            repo_path, fields=fields))
+
+        generations = dict()
+        for commit, parents, _, _, _ in reversed(records):
+            generations[commit] = 1 + max(
+                (generations[parent] if parent in generations
+                 else self._generation(repo, parent)
+                 for parent in parents.split()), default=0)
+
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((repo, commit, int(time), generations[commit],
+                  len(parents.split()) > 1, subject.strip(),
+                  " ".join(parse_bugs(body)))
+                 for commit, parents, time, subject, body in records))
+            connection.executemany(
+                "INSERT OR IGNORE INTO parents VALUES (?, ?, ?)",
+                ((repo, commit, parent)
+                 for commit, parents, _, _, _ in records
+                 for parent in parents.split()))
+            connection.execute("DELETE FROM refs WHERE repo = ?", (repo,))
+            connection.executemany(
+                "INSERT OR REPLACE INTO refs VALUES (?, ?, ?, ?)",
+                ((repo,) + tuple(reversed(_ref_kind_and_name(refname)))
+                 + (commit,) for refname, commit in refs))
+            connection.execute("INSERT OR REPLACE INTO repos VALUES (?, ?)",
+                               (repo, " ".join(heads)))
+
+        return len(records)
+
+    def _generation(self, repo, commit):
+
+        # Parents outside the index (shallow clones) count as roots
+        row = self._connection().execute(
+            "SELECT generation FROM commits WHERE repo = ? AND hash = ?",
+            (repo, commit)).fetchone()
+
+        return row[0] if row else 0
+
+    def _commit(self, repo, commit):
+        """Return (time, generation, parents) of a commit, or None."""
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT time, generation FROM commits WHERE repo = ? AND "
+            "hash = ?", (repo, commit)).fetchone()
+        if row is None:
+            return None
+        parents = [parent for parent, in connection.execute(
+            "SELECT parent FROM parents WHERE repo = ? AND hash = ?",
+            (repo, commit))]
+
+        return row[0], row[1], parents
+
+    def is_indexed(self, repo):
+
+        row = self._connection().execute(
+            "SELECT 1 FROM repos WHERE name = ?", (repo,)).fetchone()
+
+        return row is not None
+
+    def resolve(self, repo, name):
+        """Return the commit a tag or branch name points to, or None.
+
+        Tags take precedence over local branches, which take precedence
+        over remote-tracking branches of the same name.
+        """
+        rows = self._connection().execute(
+            "SELECT kind, name, hash FROM refs WHERE repo = ? AND "
+            "(name = ? OR (kind = 'remote' AND "
+            "substr(name, -length(?) - 1) = '/' || ?))",
+            (repo, name, name, name)).fetchall()
+        for kind in ("tag", "branch", "remote"):
+            for row_kind, _, commit in rows:
+                if row_kind == kind:
+                    return commit
+
+        return None
+
+    def log_records(self, repo, commit_from, commit_to, limit=None):
+        """Return (hash, subject, bugs) for the non-merge commits in a range.
+
+        This is the indexed equivalent of "git log --no-merges from..to",
+        newest first. Returns None if the repo or either end of the range
+        is not in the index, so callers can fall back to git.
+        """
+        if not self.is_indexed(repo):
+            return None
+
+        from_hash = self.resolve(repo, commit_from)
+        to_hash = self.resolve(repo, commit_to)
+        if from_hash is None or to_hash is None:
+            return None
+
+        included = self._range(repo, from_hash, to_hash)
+        if included is None:
+            return None
+
+        connection = self._connection()
+        records = list()
+        for commit in self._log_order(to_hash, included):
+            subject, bugs, merge = connection.execute(
+                "SELECT subject, bugs, merge FROM commits WHERE repo = ? "
+                "AND hash = ?", (repo, commit)).fetchone()
+            if merge:
+                continue
+            records.append((commit, subject, bugs.split()))
+            if limit is not None and len(records) >= limit:
+                break
+
+        return records
+
+    def _range(self, repo, from_hash, to_hash):
+        """Return {commit: (time, parents)} of the commits reachable from
+        to_hash but not from from_hash, or None if the index is incomplete.
+
+        Both ends are walked at once, highest generation first, like git
+        does. Whether a commit is excluded is known when it is taken from
+        the queue, as all its descendants in the walk have higher
+        generations, and the walk ends when only excluded commits are left.
+        """
+        excluded = set([from_hash])
+        info = dict()
+        queue = list()
+        for commit in set((to_hash, from_hash)):
+            info[commit] = self._commit(repo, commit)
+            if info[commit] is None:
+                return None
+            heapq.heappush(queue, (-info[commit][1], commit))
+        # How many queued commits are not excluded (yet), so that the end
+        # of the walk is noticed without scanning the queue
+        interesting = sum(commit not in excluded for _, commit in queue)
+
+        included = dict()
+        while interesting:
+            _, commit = heapq.heappop(queue)
+            time, _, parents = info.pop(commit)
+            if commit in excluded:
+                for parent in parents:
+                    if parent not in excluded:
+                        excluded.add(parent)
+                        interesting -= parent in info
+            else:
+                included[commit] = (time, parents)
+                interesting -= 1
+            for parent in parents:
+                if parent in info or parent in included:
+                    continue
+                info[parent] = self._commit(repo, parent)
+                if info[parent] is None:
+                    # Beyond a shallow clone's boundary
+                    info[parent] = (0, 0, [])
+                heapq.heappush(queue, (-info[parent][1], parent))
+                interesting += parent not in excluded
+
+        return included
+
+    @staticmethod
+    def _log_order(to_hash, included):
+        """Yield the included commits in the order of "git log": walking
+        from to_hash, always the newest queued commit next, commits of equal
+        time in the order they were reached."""
+
+        if to_hash not in included:
+            return
+        queue = [(-included[to_hash][0], 0, to_hash)]
+        queued = set([to_hash])
+        counter = 1
+        while queue:
+            _, _, commit = heapq.heappop(queue)
+            yield commit
+            for parent in included[commit][1]:
+                if parent in included and parent not in queued:
+                    queued.add(parent)
+                    heapq.heappush(queue,
+                                   (-included[parent][0], counter, parent))
+                    counter += 1
+
+    def tags(self, repo, commit):
+        """Return the tags pointing at a commit."""
+        rows = self._connection().execute(
+            "SELECT name FROM refs WHERE repo = ? AND hash = ? AND "
+            "kind = 'tag' ORDER BY name", (repo, commit))
+
+        return [name for name, in rows]
+
+    def branches_containing(self, repo, commit):
+        """Return the local and remote branches containing a commit."""
+        rows = self._connection().execute(
+            _DESCENDANTS_SQL, {"start": commit, "repo": repo})
+
+        return [name for name, in rows]
+
+
+def find_repositories(checkout_dir):
+    """Yield the git checkouts directly below checkout_dir."""
+    with os.scandir(str(checkout_dir)) as entries:
+        for entry in sorted(entries, key=lambda entry: entry.name):
+            if entry.is_dir() and os.path.exists(os.path.join(entry.path,
+                                                              ".git")):
+                yield Path(entry.path)
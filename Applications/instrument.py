@@ -0,0 +1,179 @@
+"""Timing and accounting of subprocesses and update stages.
+
+Code to be measured is wrapped in spans::
+
+    with instrument.span("subprocess", "git log", cwd=path) as span:
+        ...
+        span.bytes += len(chunk)
+
+Spans cost next to nothing until a Recorder is enabled with enable(), and again
+after disable(). The recorder keeps every span as a Chrome trace event
+(viewable with chrome://tracing or https://ui.perfetto.dev) and sums up wall
+time, count and bytes per category and name for a summary table.
+"""
+
+import json
+import os
+import threading
+import time
+
+__all__ = ["Recorder", "command_name", "disable", "enable", "recorder",
+           "span"]
+
+_recorder = None
+
+
+class _NullSpan:
+
+    # Shared by all threads, so updates are dropped
+    bytes = property(lambda self: 0, lambda self, value: None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """One timed piece of work, recorded when the with block is left."""
+
+    def __init__(self, recorder, category, name, args):
+        self.recorder = recorder
+        self.category = category
+        self.name = name
+        self.args = args
+        self.bytes = 0
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        finished = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.recorder.add(self, self.started, finished)
+        return False
+
+
+class _Totals:
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.longest = 0.0
+        self.bytes = 0
+
+
+class Recorder:
+    """Collects spans from all threads of a run."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._events = list()
+        self._totals = dict()
+        self._threads = dict()
+
+    def span(self, category, name, **args):
+        return Span(self, category, name, args)
+
+    def add(self, span, started, finished):
+
+        seconds = finished - started
+        thread = threading.current_thread()
+        with self._lock:
+            if thread.ident not in self._threads:
+                self._threads[thread.ident] = (len(self._threads) + 1,
+                                               thread.name)
+            args = dict(span.args)
+            if span.bytes:
+                args["bytes"] = span.bytes
+            self._events.append({
+                "name": span.name, "cat": span.category, "ph": "X",
+                "ts": (started - self.started) * 1e6, "dur": seconds * 1e6,
+                "pid": os.getpid(), "tid": self._threads[thread.ident][0],
+                "args": {key: str(value) for key, value in args.items()},
+            })
+
+            totals = self._totals.setdefault((span.category, span.name),
+                                             _Totals())
+            totals.count += 1
+            totals.seconds += seconds
+            totals.longest = max(totals.longest, seconds)
+            totals.bytes += span.bytes
+
+    def write_trace(self, filename):
+        """Write all spans as a Chrome trace-event JSON file."""
+        with self._lock:
+            events = [{"name": "thread_name", "ph": "M", "pid": os.getpid(),
+                       "tid": tid, "args": {"name": name}}
+                      for tid, name in self._threads.values()]
+            events += self._events
+
+        with open(filename, "w") as handle:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"},
+                      handle)
+
+    def summary(self, stream=None):
+        """Print wall time, count and bytes per category and name."""
+        with self._lock:
+            totals = sorted(self._totals.items(),
+                            key=lambda item: -item[1].seconds)
+
+        print("{:<10} {:<24} {:>6} {:>10} {:>9} {:>9} {:>10}".format(
+            "category", "name", "count", "total (s)", "mean (ms)",
+            "max (ms)", "bytes"), file=stream)
+        for (category, name), total in totals:
+            print("{:<10} {:<24} {:>6} {:>10.2f} {:>9.1f} {:>9.1f} {:>10}"
+                  .format(category, name, total.count, total.seconds,
+                          total.seconds / total.count * 1000,
+                          total.longest * 1000, total.bytes), file=stream)
+        print("wall time {:.2f}s".format(time.perf_counter() - self.started),
+              file=stream)
+
+
+def enable():
+    """Start recording spans, returning the Recorder."""
+    global _recorder
+    _recorder = Recorder()
+
+    return _recorder
+
+
+def disable():
+    """Stop recording spans, returning the Recorder that was enabled."""
+    global _recorder
+    previous, _recorder = _recorder, None
+
+    return previous
+
+
+def recorder():
+    """The enabled Recorder, or None."""
+    return _recorder
+
+
+def span(category, name, **args):
+    """A context manager timing its block, if recording is enabled."""
+    if _recorder is None:
+        return _NULL_SPAN
+
+    return _recorder.span(category, name, **args)
+
+
+def command_name(command):
+    """A short name for a command line: "osc up", "git log", ..."""
+    if isinstance(command, str):
+        command = command.split()
+
+    words = [os.path.basename(str(command[0]))] if command else []
+    if len(command) > 1 and not str(command[1]).startswith("-"):
+        words.append(str(command[1]))
+
+    return " ".join(words)
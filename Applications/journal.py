@@ -0,0 +1,94 @@
+"""A journal of completed package update stages.
+
+The journal is a file of JSON lines, one per stage a package completed
+for a version::
+
+    {"package": "kate", "version": "19.08.1", "stage": "spec", ...}
+
+Lines are only ever appended, each with a single write() followed by
+fsync(), so a run that dies halfway leaves all stages completed before
+in the journal. A truncated last line (from a crash during the write)
+is ignored when the journal is read back.
+"""
+
+import json
+import os
+import threading
+import time
+
+__all__ = ["UpdateJournal"]
+
+
+class UpdateJournal:
+    """The stages completed per package and version, backed by a file.
+
+    The whole file is read when the journal is opened; lookups after
+    that are dictionary lookups. Instances can be shared between threads.
+    """
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self._lock = threading.Lock()
+        self._completed = dict()
+        line = ""
+
+        try:
+            with open(self.filename, encoding="utf-8") as handle:
+                for line in handle:
+                    self._load(line)
+        except FileNotFoundError:
+            pass
+
+        self._fd = os.open(self.filename,
+                           os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if line and not line.endswith("\n"):
+            # Terminate a truncated line, so it does not swallow the next
+            os.write(self._fd, b"\n")
+
+    def _load(self, line):
+
+        try:
+            entry = json.loads(line)
+            key = (entry["package"], entry["version"])
+            stage = entry["stage"]
+        except (ValueError, KeyError, TypeError):
+            return
+
+        stages = self._completed.setdefault(key, dict())
+        stages[stage] = entry.get("data", {})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def completed(self, package, version):
+        """Return a dict of the completed stages and the data recorded."""
+        with self._lock:
+            return dict(self._completed.get((package, version), {}))
+
+    def is_done(self, package, version, stage):
+
+        with self._lock:
+            return stage in self._completed.get((package, version), {})
+
+    def record(self, package, version, stage, data=None):
+        """Durably record that package completed stage for version."""
+        data = data or {}
+        entry = {"package": package, "version": version, "stage": stage,
+                 "time": time.time(), "data": data}
+        line = (json.dumps(entry, sort_keys=True) + "\n").encode("utf-8")
+
+        with self._lock:
+            os.write(self._fd, line)
+            os.fsync(self._fd)
+            stages = self._completed.setdefault((package, version), dict())
+            stages[stage] = data
+
+    def close(self):
+
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
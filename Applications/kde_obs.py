@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# PYTHON_ARGCOMPLETE_OK
+"""Command line entry point for the KDE OBS tools.
+
+Subcommands are registered by dotted path and only imported when one of
+them runs, so --help and shell completion do not pay for importing the
+tools. Completion is answered from a table cached in
+$XDG_CACHE_HOME/kde-obs/completion.json; enable it in bash with
+
+    eval "$(register-python-argcomplete kde_obs.py)"
+"""
+
+import os
+
+from arghandler import ArgumentHandler
+from subcommands import register_subcommands
+
+
+def completion_cache_path():
+
+    cache_home = (os.environ.get("XDG_CACHE_HOME") or
+                  os.path.expanduser("~/.cache"))
+
+    return os.path.join(cache_home, "kde-obs", "completion.json")
+
+
+def main():
+
+    register_subcommands()
+
+    handler = ArgumentHandler(use_subcommand_help=True,
+                              enable_autocompletion=True,
+                              completion_cache=completion_cache_path())
+    handler.run()
+
+
+if __name__ == "__main__":
+    main()
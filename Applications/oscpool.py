@@ -0,0 +1,169 @@
+"""Concurrent checkout and update of OBS packages with osc.
+
+A CheckoutPool runs "osc co" or "osc up" for many packages of a project
+checkout at once, limited both in total and per OBS API host, and retries
+failed commands with exponential backoff. Packages it has brought up to
+date are remembered, so that checking them out again later in the same
+run is a no-op.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import io
+from pathlib import Path
+import random
+import subprocess
+import threading
+import time
+from urllib.parse import urlparse
+import xml.etree.ElementTree as ElementTree
+
+__all__ = ["CheckoutPool", "checkout_command", "read_file_list"]
+
+DEFAULT_APIURL = "https://api.opensuse.org"
+
+
+def checkout_command(package_dir, osc="osc"):
+    """Return the command and working directory updating package_dir."""
+    package_dir = Path(package_dir)
+    if package_dir.exists():
+        return [osc, "up"], package_dir
+
+    return [osc, "co", package_dir.name], package_dir.parent
+
+
+def read_apiurl(directory):
+    """Return the API URL osc stored for a checkout, or None."""
+    try:
+        return (Path(directory) / ".osc" / "_apiurl").read_text().strip()
+    except OSError:
+        return None
+
+
+def read_file_list(directory):
+    """Return {name: (size, mtime, md5)} of the files osc checked out in
+    directory, as recorded in .osc/_files, or an empty dict."""
+    try:
+        root = ElementTree.parse(str(Path(directory) / ".osc" / "_files"))
+    except (OSError, ElementTree.ParseError):
+        return dict()
+
+    files = dict()
+    for entry in root.getroot().iter("entry"):
+        try:
+            files[entry.get("name")] = (int(entry.get("size")),
+                                        int(entry.get("mtime")),
+                                        entry.get("md5"))
+        except (TypeError, ValueError):
+            continue
+
+    return files
+
+
+class CheckoutPool:
+    """Check out or update the packages of one OBS project checkout.
+
+    runner is called as runner(command, cwd=..., output=...) and must
+    raise subprocess.CalledProcessError on failure, like
+    update_applications.run_command. Replacing it (or osc, the command
+    name) allows testing against a fake osc.
+    """
+
+    def __init__(self, project_dir, runner, jobs=4, per_host=2, retries=3,
+                 backoff=2.0, osc="osc"):
+        self.project_dir = Path(project_dir).expanduser()
+        self.runner = runner
+        self.jobs = max(jobs, 1)
+        self.per_host = max(per_host, 1)
+        self.retries = retries
+        self.backoff = backoff
+        self.osc = osc
+
+        self._lock = threading.Lock()
+        self._host_slots = dict()
+        self._fresh = set()
+        self._outputs = dict()
+
+    def host(self, name):
+        """Return the API host serving a package of this project."""
+        apiurl = (read_apiurl(self.project_dir / name) or
+                  read_apiurl(self.project_dir) or DEFAULT_APIURL)
+
+        return urlparse(apiurl).hostname or apiurl
+
+    def _slots(self, host):
+
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(
+                    self.per_host)
+            return self._host_slots[host]
+
+    def is_fresh(self, name):
+
+        with self._lock:
+            return name in self._fresh
+
+    def checkout(self, name, output=None):
+        """Check out or update one package, unless that happened already.
+
+        Failing osc commands are retried up to retries times, waiting
+        backoff, 2 * backoff, 4 * backoff, ... seconds (plus jitter) in
+        between. The last failure is raised.
+        """
+        if self.is_fresh(name):
+            print("{} is up to date".format(name), file=output)
+            return
+
+        package_dir = self.project_dir / name
+        slots = self._slots(self.host(name))
+
+        for attempt in range(self.retries + 1):
+            command, cwd = checkout_command(package_dir, self.osc)
+            try:
+                with slots:
+                    self.runner(command, cwd=cwd, output=output)
+                break
+            except subprocess.CalledProcessError as error:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                delay += random.uniform(0, self.backoff)
+                print("{} failed with exit code {}, retrying in {:.1f}s"
+                      .format(" ".join(command), error.returncode, delay),
+                      file=output)
+                time.sleep(delay)
+
+        with self._lock:
+            self._fresh.add(name)
+
+    def _buffered_checkout(self, name):
+
+        output = io.StringIO()
+        try:
+            self.checkout(name, output)
+        finally:
+            self._outputs[name] = output.getvalue()
+
+    def prefetch(self, names, output=None):
+        """Check out or update all packages up front, jobs at a time.
+
+        Failures are reported but not raised: the package is then checked
+        out again, with the error surfacing, when it is processed.
+        Returns the names of the packages that failed.
+        """
+        failed = list()
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {executor.submit(self._buffered_checkout, name): name
+                       for name in names}
+            for future in as_completed(futures):
+                name = futures[future]
+                if future.exception() is not None:
+                    failed.append(name)
+                    print("Checkout of {} failed:".format(name), file=output)
+                    print(self._outputs.get(name, ""), end="", file=output)
+
+        print("Checked out {} packages, {} failed".format(
+            len(futures) - len(failed), len(failed)), file=output)
+
+        return failed
@@ -0,0 +1,172 @@
+"""A staged asyncio pipeline for package updates.
+
+Jobs move through a fixed sequence of stages. Each stage has its own
+thread pool, sized for the kind of work it does (network bound osc,
+disk bound tarball moves, git bound changelogs, ...), and stages are
+connected by bounded queues. A slow stage for one package therefore no
+longer holds back the other stages for the next packages, and a full
+queue makes the stages before it wait (backpressure).
+
+A job is any object with one method per stage name. A method returns
+True to pass the job on to the next stage or False to finish it early.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import time
+
+__all__ = ["Pipeline", "StageStats"]
+
+
+class StageStats:
+    """Counters for one stage, reported by Pipeline.report()."""
+
+    def __init__(self, name, limit, queue_size):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.processed = 0
+        self.finished_early = 0
+        self.busy_seconds = 0.0
+        # Time spent waiting to hand a job to this stage's full queue
+        self.blocked_seconds = 0.0
+        self.max_depth = 0
+
+
+class Pipeline:
+    """Run jobs through stages, each stage with its own concurrency limit.
+
+    limits maps each stage name to its number of workers. on_done is
+    called in the event loop thread with (job, result, error) once a job
+    has left the pipeline; result is True if it went through all stages.
+    """
+
+    def __init__(self, stages, limits, on_done, queue_size=8,
+                 monitor_interval=None, monitor_stream=sys.stderr):
+        self.stages = list(stages)
+        self.limits = {stage: max(limits[stage], 1) for stage in self.stages}
+        self.on_done = on_done
+        self.queue_size = queue_size
+        self.monitor_interval = monitor_interval
+        self.monitor_stream = monitor_stream
+        self.stats = {stage: StageStats(stage, self.limits[stage], queue_size)
+                      for stage in self.stages}
+        self._queues = dict()
+
+    def run(self, jobs):
+        """Run all jobs through the pipeline and wait for them."""
+        executors = {stage: ThreadPoolExecutor(max_workers=limit,
+                                               thread_name_prefix=stage)
+                     for stage, limit in self.limits.items()}
+        try:
+            asyncio.run(self._run(jobs, executors))
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True)
+
+    def depths(self):
+        """The number of jobs waiting in front of each stage."""
+        return {stage: queue.qsize() for stage, queue in self._queues.items()}
+
+    async def _put(self, stage, job):
+
+        queue = self._queues[stage]
+        stats = self.stats[stage]
+        started = time.monotonic()
+        await queue.put(job)
+        stats.blocked_seconds += time.monotonic() - started
+        stats.max_depth = max(stats.max_depth, queue.qsize())
+
+    async def _feed(self, jobs, workers):
+
+        for job in jobs:
+            await self._put(self.stages[0], job)
+
+        # Shut the stages down in order, once all jobs have passed them
+        for stage in self.stages:
+            for _ in workers[stage]:
+                await self._queues[stage].put(None)
+            await asyncio.wait(workers[stage])
+
+    async def _worker(self, index, executor):
+
+        stage = self.stages[index]
+        queue = self._queues[stage]
+        stats = self.stats[stage]
+        loop = asyncio.get_running_loop()
+
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+
+            started = time.monotonic()
+            try:
+                result = await loop.run_in_executor(executor,
+                                                    getattr(job, stage))
+            except Exception as error:
+                self.on_done(job, False, error)
+                raise
+            finally:
+                stats.busy_seconds += time.monotonic() - started
+                stats.processed += 1
+
+            if not result:
+                stats.finished_early += 1
+                self.on_done(job, False, None)
+            elif index + 1 < len(self.stages):
+                await self._put(self.stages[index + 1], job)
+            else:
+                self.on_done(job, True, None)
+
+    async def _monitor(self):
+
+        while True:
+            await asyncio.sleep(self.monitor_interval)
+            depths = self.depths()
+            print("queues: " + ", ".join(
+                "{} {}/{}".format(stage, depths[stage], self.queue_size)
+                for stage in self.stages), file=self.monitor_stream)
+
+    async def _run(self, jobs, executors):
+
+        self._queues = {stage: asyncio.Queue(self.queue_size)
+                        for stage in self.stages}
+
+        monitor = None
+        if self.monitor_interval:
+            monitor = asyncio.ensure_future(self._monitor())
+
+        workers = {stage: [asyncio.ensure_future(
+                       self._worker(index, executors[stage]))
+                   for _ in range(self.limits[stage])]
+                   for index, stage in enumerate(self.stages)}
+        feeder = asyncio.ensure_future(self._feed(jobs, workers))
+        tasks = [feeder] + [task for tasks in workers.values()
+                            for task in tasks]
+
+        try:
+            # The first failure anywhere stops the whole pipeline, even
+            # while the feeder is waiting on a full queue
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            if monitor is not None:
+                monitor.cancel()
+
+    def report(self, stream=sys.stdout):
+        """Print per stage counters: jobs, busy time, queue use."""
+        print("{:<10} {:>5} {:>7} {:>9} {:>10} {:>9}".format(
+            "stage", "jobs", "workers", "busy (s)", "blocked (s)",
+            "max queue"), file=stream)
+        for stage in self.stages:
+            stats = self.stats[stage]
+            print("{:<10} {:>5} {:>7} {:>9.1f} {:>10.1f} {:>6}/{}".format(
+                stage, stats.processed, stats.limit, stats.busy_seconds,
+                stats.blocked_seconds, stats.max_depth, stats.queue_size),
+                file=stream)
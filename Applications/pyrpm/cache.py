@@ -0,0 +1,202 @@
+"""On-disk cache of parsed spec files.
+
+Parsing the same unchanged spec files over and over is wasteful when surveying a whole project
+checkout. A SpecCache stores parsed Spec objects in a single SQLite file::
+
+    cache = SpecCache(SpecCache.default_path())
+    spec = Spec.from_file('foo.spec', cache=cache)
+    ...
+    cache.close()
+
+Entries are keyed by the absolute path of the spec file and validated by its mtime and size, so a
+warm lookup costs one stat() call. When those do not match, the SHA-256 of the contents is looked
+up before parsing, which covers touched but unchanged files as well as identical copies of a spec
+in several places. The cache is bounded by size; the least recently used entries are evicted.
+
+"""
+
+import hashlib
+import io
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+
+from pyrpm.spec import PARSER_VERSION, Spec
+
+__all__ = ['SpecCache']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    data BLOB NOT NULL,
+    used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_by_digest ON entries (digest);
+CREATE INDEX IF NOT EXISTS entries_by_used ON entries (used);
+"""
+
+# Cache hits are only written back (for LRU bookkeeping) in batches of this size
+_TOUCH_BATCH = 256
+
+
+class SpecCache:
+    """A size-bounded, persistent cache of parsed Spec objects.
+
+    Instances can be shared between threads. Call close() (or use the instance as a context
+    manager) to write back the usage information of cache hits.
+
+    """
+
+    def __init__(self, filename, max_bytes=64 * 1024 * 1024):
+        """Opens or creates the cache.
+
+        :param filename: The path of the cache file.
+        :param max_bytes: The maximal total size of the cached (compressed) parse results.
+        """
+        self.filename = str(filename)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._touched = {}
+        self._connection = sqlite3.connect(self.filename, timeout=60, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            self._connection.executescript(_SCHEMA)
+            row = self._connection.execute(
+                "SELECT value FROM meta WHERE key = 'parser_version'").fetchone()
+            if row is None or row[0] != str(PARSER_VERSION):
+                self._connection.execute("DELETE FROM entries")
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('parser_version', ?)",
+                    (str(PARSER_VERSION),))
+            self._total_bytes = self._connection.execute(
+                "SELECT COALESCE(SUM(LENGTH(data)), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def default_path():
+        """The default cache file, below $XDG_CACHE_HOME (or ~/.cache)."""
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        return os.path.join(cache_home, 'pyrpm', 'specs.sqlite')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def load(self, filename):
+        """Returns the parsed Spec for filename, parsing it only if it is not cached.
+
+        :param filename: The path to the spec file.
+        :return: A new Spec object.
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT mtime_ns, size, data FROM entries WHERE path = ?", (path,)).fetchone()
+            if row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+                self.hits += 1
+                self._touch(path)
+                spec = _loads(row[2])
+                spec.filename = filename
+                return spec
+
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+        if row is not None:
+            self.hits += 1
+            data = row[0]
+            spec = _loads(data)
+        else:
+            self.misses += 1
+            # Decode the way Spec.from_file would, keeping line endings
+            spec = Spec.from_lines(io.TextIOWrapper(io.BytesIO(content), encoding='utf-8',
+                                                    newline=''))
+            data = _dumps(spec)
+
+        with self._lock:
+            self._store(path, stat, digest, data)
+
+        # Sections are read from the file when they are accessed
+        spec.filename = filename
+        return spec
+
+    def close(self):
+        """Writes back pending usage information and closes the cache file."""
+        with self._lock:
+            if self._connection is None:
+                return
+            self._flush_touched()
+            self._connection.close()
+            self._connection = None
+
+    def _touch(self, path):
+        self._touched[path] = time.time()
+        if len(self._touched) >= _TOUCH_BATCH:
+            self._flush_touched()
+
+    def _flush_touched(self):
+        if not self._touched:
+            return
+        with self._connection:
+            self._connection.executemany("UPDATE entries SET used = ? WHERE path = ?",
+                                         [(used, path) for path, used in self._touched.items()])
+        self._touched.clear()
+
+    def _store(self, path, stat, digest, data):
+        with self._connection:
+            row = self._connection.execute(
+                "SELECT LENGTH(data) FROM entries WHERE path = ?", (path,)).fetchone()
+            if row is not None:
+                self._total_bytes -= row[0]
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (path, stat.st_mtime_ns, stat.st_size, digest, data, time.time()))
+            self._total_bytes += len(data)
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        self._flush_touched()
+        with self._connection:
+            rows = self._connection.execute(
+                "SELECT path, LENGTH(data) FROM entries ORDER BY used").fetchall()
+            evicted = []
+            for path, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                evicted.append((path,))
+                self._total_bytes -= size
+            self._connection.executemany("DELETE FROM entries WHERE path = ?", evicted)
+
+
+def _dumps(spec):
+    return zlib.compress(pickle.dumps(spec, pickle.HIGHEST_PROTOCOL))
+
+
+def _loads(data):
+    return pickle.loads(zlib.decompress(data))
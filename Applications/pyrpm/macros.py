@@ -0,0 +1,167 @@
+"""Expansion of RPM macros, as far as possible without running rpm.
+
+A MacroExpander expands a string the way rpmbuild would while parsing a spec file, using the
+definitions it is given (usually the %define and %global lines and the preamble tags of a spec)::
+
+    expander = MacroExpander({'name': 'foo', 'version': '1.2', '_tar_path': '%{version}'})
+    expander.expand('%{name}-%{_tar_path}%{?beta:-beta}.tar.xz')   # 'foo-1.2.tar.xz'
+
+Supported are %name and %{name}, conditionals (%{?name}, %{!?name}, %{?name:text},
+%{!?name:text}), nested macros, %% and the built-ins basename, dirname, suffix, lower and upper.
+Undefined macros, shell expansions %(...) and expressions %[...] are left as they are.
+
+Macro values are expanded recursively; a macro whose expansion needs itself raises
+MacroCycleError. Expanded values and strings are memoized per expander.
+
+"""
+
+__all__ = ['MacroCycleError', 'MacroExpander']
+
+_NAME_START = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_')
+_NAME_CHARS = _NAME_START | frozenset('0123456789')
+
+_BUILTINS = {
+    'basename': lambda value: value.rsplit('/', 1)[-1],
+    'dirname': lambda value: value.rsplit('/', 1)[0] if '/' in value else value,
+    'suffix': lambda value: value.rsplit('.', 1)[1] if '.' in value.rsplit('/', 1)[-1] else '',
+    'lower': lambda value: value.lower(),
+    'upper': lambda value: value.upper(),
+}
+
+
+class MacroCycleError(ValueError):
+    """Raised when the expansion of a macro depends on itself."""
+
+    def __init__(self, names):
+        super().__init__('recursive macro expansion: ' + ' -> '.join(names))
+        self.names = names
+
+
+def _closing(string, start, opening, closing):
+    """Returns the index of the bracket closing the one before start, or -1."""
+    depth = 1
+    for index in range(start, len(string)):
+        char = string[index]
+        if char == opening:
+            depth += 1
+        elif char == closing:
+            depth -= 1
+            if depth == 0:
+                return index
+    return -1
+
+
+class MacroExpander:
+    """Expands macros from a fixed set of definitions.
+
+    :param macros: A mapping of macro names to their unexpanded values.
+    :param fallback: An optional mapping consulted for names not in macros.
+    """
+
+    def __init__(self, macros, fallback=None):
+        self.macros = dict(macros)
+        self.fallback = fallback or {}
+        self._values = {}
+        self._strings = {}
+        self._active = []
+
+    def is_defined(self, name):
+        return name in self.macros or name in self.fallback
+
+    def value(self, name):
+        """Returns the expanded value of a macro, or None if it is not defined."""
+        if name in self._values:
+            return self._values[name]
+        if name in self._active:
+            raise MacroCycleError(self._active[self._active.index(name):] + [name])
+
+        if name in self.macros:
+            raw = self.macros[name]
+        elif name in self.fallback:
+            raw = self.fallback[name]
+        else:
+            return None
+
+        self._active.append(name)
+        try:
+            value = self.expand(str(raw))
+        finally:
+            self._active.pop()
+
+        self._values[name] = value
+        return value
+
+    def expand(self, string):
+        """Returns string with all macros expanded as far as they are known."""
+        if '%' not in string:
+            return string
+        if string in self._strings:
+            return self._strings[string]
+
+        result = []
+        index = 0
+        length = len(string)
+        while index < length:
+            percent = string.find('%', index)
+            if percent < 0 or percent + 1 == length:
+                result.append(string[index:])
+                break
+            result.append(string[index:percent])
+            char = string[percent + 1]
+
+            if char == '%':
+                result.append('%')
+                index = percent + 2
+            elif char == '{':
+                end = _closing(string, percent + 2, '{', '}')
+                if end < 0:
+                    result.append(string[percent:])
+                    break
+                result.append(self._expand_braced(string[percent + 2:end], string[percent:end + 1]))
+                index = end + 1
+            elif char in _NAME_START:
+                end = percent + 2
+                while end < length and string[end] in _NAME_CHARS:
+                    end += 1
+                value = self.value(string[percent + 1:end])
+                result.append(string[percent:end] if value is None else value)
+                index = end
+            else:
+                # %(shell), %[expression] and anything else stays as it is
+                result.append('%')
+                index = percent + 1
+
+        expanded = ''.join(result)
+        if not self._active:
+            # Partial results inside a cycle check must not be reused later
+            self._strings[string] = expanded
+        return expanded
+
+    def _expand_braced(self, body, original):
+        negate = False
+        conditional = False
+        while body[:1] in ('!', '?'):
+            if body[0] == '!':
+                negate = not negate
+            else:
+                conditional = True
+            body = body[1:]
+
+        name, colon, argument = body.partition(':')
+
+        if conditional:
+            defined = self.is_defined(name)
+            if negate:
+                defined = not defined
+            if not defined:
+                return ''
+            if colon:
+                return self.expand(argument)
+            # %{!?name} expands to nothing, %{?name} to the value
+            return '' if negate else self.value(name)
+
+        if colon and name in _BUILTINS and name not in self.macros:
+            return _BUILTINS[name](self.expand(argument))
+
+        value = self.value(name)
+        return original if value is None else value
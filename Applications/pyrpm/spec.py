@@ -10,63 +10,209 @@ add support for the missing pieces.
 
 """
 
+from collections.abc import Mapping
+import os
 import re
+import stat
+import tempfile
 
-__all__ = ['Spec', 'replace_macros', 'Package']
+from pyrpm.macros import MacroCycleError, MacroExpander, _closing
 
+__all__ = ['Spec', 'SpecDocument', 'replace_macros', 'MacroCycleError', 'Package', 'Section',
+           'FileEntry', 'FileList']
+
+# Preamble tags: tag -> (attribute name, attribute type, value is the rest of the line)
+# A value that is not the rest of the line ends at the first whitespace.
 _tags = {
-    'name': (str, re.compile(r'^Name:\s*(\S+)')),
-    'version': (str, re.compile(r'^Version:\s*(\S+)')),
-    'epoch': (int, re.compile(r'^Epoch:\s*(\S+)')),
-    'release': (str, re.compile(r'^Release:\s*(\S+)')),
-    'summary': (str, re.compile(r'^Summary:\s*(.+)')),
-    'license': (str, re.compile(r'^License:\s*(.+)')),
-    'group': (str, re.compile(r'^Group:\s*(\S+)')),
-    'url': (str, re.compile(r'^URL:\s*(\S+)')),
-    'buildroot': (str, re.compile(r'^BuildRoot:\s*(\S+)')),
-    'buildarch': (str, re.compile(r'^BuildArch:\s*(\S+)')),
-    'sources': (list, re.compile(r'^Source\d*:\s*(\S+)')),
-    'patches': (list, re.compile(r'^Patch\d*:\s*(\S+)')),
-    'build_requires': (list, re.compile(r'^BuildRequires:\s*(.+)')),
-    'requires': (list, re.compile(r'^Requires:\s*(.+)')),
-    'packages': (list, re.compile(r'^%package\s+(\S+)'))
+    'Name': ('name', str, False),
+    'Version': ('version', str, False),
+    'Epoch': ('epoch', int, False),
+    'Release': ('release', str, False),
+    'Summary': ('summary', str, True),
+    'License': ('license', str, True),
+    'Group': ('group', str, False),
+    'URL': ('url', str, False),
+    'BuildRoot': ('buildroot', str, False),
+    'BuildArch': ('buildarch', str, False),
+    'Source': ('sources', list, False),
+    'Patch': ('patches', list, False),
+    'BuildRequires': ('build_requires', list, True),
+    'Requires': ('requires', list, True),
 }
 
-_macro_pattern = re.compile(r'%\{(\S+?)\}')
+# Tags that may carry a number, e.g. Source1 or Patch12
+_numbered_tags = ('Source', 'Patch')
+
+# Directives starting a section whose body contains no tags
+_body_sections = frozenset([
+    '%description', '%prep', '%build', '%install', '%check', '%clean', '%files',
+    '%changelog', '%pre', '%post', '%preun', '%postun', '%pretrans', '%posttrans',
+    '%triggerprein', '%triggerin', '%triggerun', '%triggerpostun', '%filetriggerin',
+    '%filetriggerun', '%filetriggerpostun', '%transfiletriggerin', '%transfiletriggerun',
+    '%transfiletriggerpostun', '%verifyscript',
+])
+
+_digits = '0123456789'
+
+# Bumped whenever the attributes of parsed Spec objects change, so that cached parse results of
+# older versions are not used anymore (see pyrpm.cache).
+PARSER_VERSION = 5
+
+
+# A tag line split into: tag, number, separator and leading whitespace, value, rest of the line
+_tag_line_pattern = re.compile(r'^([A-Za-z][A-Za-z0-9()_-]*?)(\d*)(:\s*)(\S*)(.*?)(\r?\n)?$', re.DOTALL)
+
+# %patch directives in %prep: %patch1, %patch 1, %patch -P 1, %patch -p1 -P1, or a bare %patch
+# applying patch 0
+_patch_directive_pattern = re.compile(r'^%patch(\d*)(?=\s|$)')
+_patch_option_pattern = re.compile(r'\s-P\s*(\d+)\b')
+_patch_argument_pattern = re.compile(r'\s+(\d+)\b')
+
+# Words of a %files line: directives with their (possibly spaced) arguments, quoted paths, words
+_files_token_pattern = re.compile(r'%[A-Za-z_]+\([^)]*\)|"[^"]*"|\S+')
+
+# Directives in %files lines that qualify the paths following them
+_file_directives = frozenset([
+    'artifact', 'attr', 'caps', 'config', 'defattr', 'dir', 'doc', 'docdir', 'exclude', 'ghost',
+    'lang', 'license', 'missingok', 'readme', 'verify',
+])
+
+# Conditionals, which are kept in the section text but carry no contents of their own
+_conditional_pattern = re.compile(r'^%(if|else|elif|endif)\w*\b')
+
+
+def _section_package(spec_obj, words):
+    """Returns the package a %package or section directive refers to, e.g. foo-devel for
+    '%files devel' or bar for '%description -n bar'."""
+    package = getattr(spec_obj, 'name', None)
+    index = 1
+    while index < len(words):
+        word = words[index]
+        if word == '--':
+            # Trigger conditions follow
+            break
+        if word == '-n' and index + 1 < len(words):
+            return words[index + 1]
+        if word in ('-f', '-l', '-p') and index + 1 < len(words):
+            index += 2
+            continue
+        if not word.startswith('-'):
+            package = '{}-{}'.format(spec_obj.name, word)
+        index += 1
+    return package
+
+
+def _start_section(spec_obj, context, directive, package, words):
+    offset = context.get('offset')
+    if offset is None:
+        return
+    if not hasattr(spec_obj, '_sections'):
+        spec_obj._sections = []
+    elif spec_obj._sections[-1].end is None:
+        spec_obj._sections[-1].end = offset
+    spec_obj._sections.append(Section(directive, package, words[1:], offset))
+
+
+def _parse_directive(spec_obj, context, line):
+    words = line.split()
+    if not words:
+        return
+    directive = words[0]
+
+    if directive == '%package' and len(words) > 1:
+        subpackage_name = _section_package(spec_obj, words)
+        _start_section(spec_obj, context, directive, subpackage_name, words)
+        package = Package(subpackage_name)
+        package.is_subpackage = True
+        if not hasattr(spec_obj, 'packages'):
+            spec_obj.packages = []
+        spec_obj.packages.append(package)
+        context['current_subpackage'] = package
+        context['in_body'] = False
+    elif directive in _body_sections:
+        context['in_body'] = True
+        _start_section(spec_obj, context, directive, _section_package(spec_obj, words), words)
+    elif directive in ('%define', '%global') and len(words) > 1:
+        # %define name(options) body: only the name is needed for expansion
+        name = words[1].split('(', 1)[0]
+        parts = line.split(None, 2)
+        body = parts[2].rstrip() if len(parts) > 2 else ''
+        if not hasattr(spec_obj, 'macros'):
+            spec_obj.macros = {}
+        spec_obj.macros[name] = body.rstrip('\\').rstrip()
+    elif directive == '%undefine' and len(words) > 1:
+        getattr(spec_obj, 'macros', {}).pop(words[1], None)
+    elif directive.startswith(('%{?', '%{!?')):
+        _parse_conditional_define(spec_obj, context, line.strip())
+
+
+def _parse_conditional_define(spec_obj, context, line):
+    """Follows %{?name: %define ...} and %{!?name: %define ...} (or %global).
+
+    Only macros of the spec itself count as defined, those of the build system are unknown here.
+    """
+    if _closing(line, 2, '{', '}') != len(line) - 1:
+        return
+    condition, colon, body = line[2:-1].partition(':')
+    body = body.strip()
+    if not colon or not body.startswith(('%define', '%global')):
+        return
+
+    name = condition.lstrip('!?')
+    defined = (name in getattr(spec_obj, 'macros', {}) or
+               name in Spec._macro_tags and getattr(spec_obj, name, None) is not None)
+    negated = '!' in condition[:len(condition) - len(name)]
+    if defined != negated:
+        _parse_directive(spec_obj, context, body)
 
 
 def _parse(spec_obj, context, line):
-    for name, value in _tags.items():
-        attr_type, regex = value
-        match = re.search(regex, line)
-        if match:
-            tag_value = match.group(1)
-
-            if name == 'name':
-                spec_obj.packages = []
-                spec_obj.packages.append(Package(tag_value))
-
-            target_obj = spec_obj
-            if context['current_subpackage'] is not None:
-                target_obj = context['current_subpackage']
-
-            if attr_type is list:
-                if not hasattr(target_obj, name):
-                    setattr(target_obj, name, list())
-
-                if name == 'packages':
-                    if tag_value == '-n':
-                        subpackage_name = line.rsplit(' ', 1)[-1].rstrip()
-                    else:
-                        subpackage_name = '{}-{}'.format(spec_obj.name, tag_value)
-                    package = Package(subpackage_name)
-                    context['current_subpackage'] = package
-                    package.is_subpackage = True
-                    spec_obj.packages.append(package)
-                else:
-                    getattr(target_obj, name).append(tag_value)
-            else:
-                setattr(target_obj, name, attr_type(tag_value))
+    """Parse one line of a spec file.
+
+    Instead of trying a regular expression per tag, the line is dispatched on its leading token:
+    '%' directives switch between preamble and body sections, and in a preamble the text before
+    the first colon is looked up in _tags. Lines in body sections are skipped right away.
+
+    """
+    if line[:1] == '%':
+        _parse_directive(spec_obj, context, line)
+        return spec_obj, context
+
+    if context.get('in_body'):
+        return spec_obj, context
+
+    colon = line.find(':')
+    if colon < 1:
+        return spec_obj, context
+
+    tag = line[:colon]
+    entry = _tags.get(tag)
+    if entry is None:
+        tag = tag.rstrip(_digits)
+        if tag not in _numbered_tags:
+            return spec_obj, context
+        entry = _tags[tag]
+
+    name, attr_type, rest_of_line = entry
+    tag_value = line[colon + 1:].strip()
+    if not tag_value:
+        return spec_obj, context
+    if not rest_of_line:
+        tag_value = tag_value.split(None, 1)[0]
+
+    if name == 'name':
+        spec_obj.packages = [Package(tag_value)]
+
+    target_obj = context['current_subpackage'] or spec_obj
+    if attr_type is list:
+        values = getattr(target_obj, name, None)
+        if values is None:
+            values = []
+            setattr(target_obj, name, values)
+        values.append(tag_value)
+    else:
+        setattr(target_obj, name, attr_type(tag_value))
+
     return spec_obj, context
 
 
@@ -121,11 +267,209 @@ class Package:
         return "Package('{}')".format(self.name)
 
 
+class Section:
+    """A section of a spec file: a body section such as %description or %files, or the preamble of
+    a subpackage started by %package.
+
+    start and end are the byte offsets of the section in the spec file. The section starts with
+    its directive line and ends where the next section starts.
+
+    """
+
+    def __init__(self, directive, package, arguments, start, end=None):
+        self.directive = directive
+        self.package = package
+        self.arguments = arguments
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return "Section('{}', '{}')".format(self.directive, self.package)
+
+
+class FileEntry:
+    """A path listed in a %files section, with the directives that apply to it, e.g. ['%doc'] or
+    ['%config(noreplace)', '%attr(0644,root,root)']. Macros in the path are not expanded."""
+
+    def __init__(self, path, directives=()):
+        self.path = path
+        self.directives = list(directives)
+
+    @property
+    def is_dir(self):
+        return '%dir' in self.directives
+
+    def __repr__(self):
+        return "FileEntry('{}', {})".format(self.path, self.directives)
+
+
+class FileList(list):
+    """The FileEntry objects of the %files sections of one package.
+
+    filelists holds the files given with -f, defattr the last %defattr directive (or None).
+
+    """
+
+    def __init__(self, entries=()):
+        super().__init__(entries)
+        self.filelists = []
+        self.defattr = None
+
+
+def _parse_description(sections, bodies):
+    return ''.join(bodies).strip('\n')
+
+
+def _parse_files(sections, bodies):
+    files = FileList()
+    for section, body in zip(sections, bodies):
+        arguments = section.arguments
+        files.filelists.extend(arguments[index + 1] for index, argument in enumerate(arguments[:-1])
+                               if argument == '-f')
+        for line in body.splitlines():
+            line = line.strip()
+            if not line or line[0] == '#' or _conditional_pattern.match(line):
+                continue
+            directives = []
+            paths = []
+            for token in _files_token_pattern.findall(line):
+                if token[0] == '%' and token[1:].split('(', 1)[0] in _file_directives:
+                    directives.append(token)
+                else:
+                    paths.append(token.strip('"'))
+            if directives and directives[0].startswith('%defattr'):
+                files.defattr = directives[0]
+                continue
+            files.extend(FileEntry(path, directives) for path in paths)
+    return files
+
+
+class _SectionMap(Mapping):
+    """The contents of one kind of section by package name, each parsed on first access."""
+
+    def __init__(self, spec, directive, parse):
+        self._spec = spec
+        self._parse = parse
+        self._parsed = {}
+        self._sections = {}
+        for section in spec.sections:
+            if section.directive == directive:
+                self._sections.setdefault(section.package, []).append(section)
+
+    def __getitem__(self, package):
+        if package not in self._parsed:
+            sections = self._sections[package]
+            bodies = [self._spec.section_body(section) for section in sections]
+            self._parsed[package] = self._parse(sections, bodies)
+        return self._parsed[package]
+
+    def __iter__(self):
+        return iter(self._sections)
+
+    def __len__(self):
+        return len(self._sections)
+
+
 class Spec:
     """Represents a single spec file.
 
+    The macros defined with %define and %global are collected in the dictionary macros, with their
+    unexpanded values. Definitions depending on a macro, like %{!?name: %define name value}, are
+    made as if the spec's own macros were the only ones defined.
+
+    Parsing only looks at the preamble tags and notes where each section starts. The contents of
+    sections are parsed when they are first accessed::
+
+        spec = Spec.from_file('foo.spec')
+        spec.version                      # parsed right away
+        spec.descriptions['foo-devel']    # the text of %description devel
+        spec.files['foo-devel']           # a FileList of FileEntry objects
+        spec.script('%install')           # the text of %install
+
     """
 
+    # Tags that define a macro of the same name, like %{version}
+    _macro_tags = ('name', 'version', 'release', 'epoch', 'summary', 'license', 'group', 'url',
+                   'buildarch')
+
+    def __getstate__(self):
+        # Expansion results are cheap to rebuild and not worth caching on disk
+        state = dict(self.__dict__)
+        state.pop('_expanders', None)
+        # Parsed sections are neither; they are read again from filename when needed
+        state.pop('_section_maps', None)
+        return state
+
+    def expander(self, **overrides):
+        """Returns a MacroExpander for the macros of this spec, memoized per set of overrides.
+
+        Macros defined with %define or %global take precedence over the tags, as in rpmbuild.
+        Keyword arguments replace the value of a macro, e.g. version='19.08.1'.
+        """
+        key = tuple(sorted(overrides.items()))
+        expanders = self.__dict__.setdefault('_expanders', {})
+        if key not in expanders:
+            tags = {}
+            for name in self._macro_tags:
+                value = getattr(self, name, None)
+                if isinstance(value, (str, int)):
+                    tags[name] = value
+            macros = dict(getattr(self, 'macros', {}))
+            macros.update(overrides)
+            expanders[key] = MacroExpander(macros, tags)
+        return expanders[key]
+
+    @property
+    def sections(self):
+        """All Section objects, in file order."""
+        return getattr(self, '_sections', [])
+
+    def section_body(self, section):
+        """Returns the text of a section, without its directive line.
+
+        Only the section is read from the file the spec was parsed from; specs created with
+        from_lines() alone have no section text.
+        """
+        filename = getattr(self, 'filename', None)
+        if filename is None:
+            raise ValueError('The text of this spec is not available')
+        with open(filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size != self._length:
+                raise ValueError('{} has changed since it was parsed'.format(filename))
+            f.seek(section.start)
+            data = f.read(section.end - section.start)
+
+        # Translate line endings like a file opened in text mode
+        body = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+        return body.split('\n', 1)[1] if '\n' in body else ''
+
+    def _section_map(self, directive, parse):
+        maps = self.__dict__.setdefault('_section_maps', {})
+        if directive not in maps:
+            maps[directive] = _SectionMap(self, directive, parse)
+        return maps[directive]
+
+    @property
+    def descriptions(self):
+        """The %description texts, by package name."""
+        return self._section_map('%description', _parse_description)
+
+    @property
+    def files(self):
+        """The %files sections as FileList objects, by package name."""
+        return self._section_map('%files', _parse_files)
+
+    def script(self, directive, package=None):
+        """Returns the text of a section like %prep, %install or %post, or None if there is none.
+
+        :param directive: The section directive, e.g. '%build'.
+        :param package: The package the section belongs to, by default the main package.
+        """
+        package = package or getattr(self, 'name', None)
+        bodies = [self.section_body(section) for section in self.sections
+                  if section.directive == directive and section.package == package]
+        return ''.join(bodies) if bodies else None
+
     @property
     def packages_dict(self):
         """All packages in this RPM spec as a dictionary.
@@ -139,43 +483,301 @@ class Spec:
         return dict(zip([package.name for package in self.packages], self.packages))
 
     @staticmethod
-    def from_file(filename):
+    def from_file(filename, cache=None):
         """Creates a new Spec object from a given file.
 
         :param filename: The path to the spec file.
+        :param cache: An optional pyrpm.cache.SpecCache. Unchanged files are then loaded from the
+                      cache instead of being parsed again.
         :return: A new Spec object.
         """
+        if cache is not None:
+            return cache.load(filename)
+
+        # Line endings are kept, so that section offsets match the file
+        with open(filename, 'r', encoding='utf-8', newline='') as f:
+            spec = Spec.from_lines(f)
+        spec.filename = filename
+        return spec
+
+    @staticmethod
+    def from_lines(lines):
+        """Creates a new Spec object from the lines of a spec file.
+
+        Only the byte offsets of the sections are kept, their text is read from filename when it is
+        accessed (see section_body()).
 
+        :param lines: An iterable of lines, including their line endings.
+        :return: A new Spec object.
+        """
         spec = Spec()
-        with open(filename, 'r', encoding='utf-8') as f:
-            parse_context = {
-                'current_subpackage': None
-            }
-            for line in f:
-                spec, parse_context = _parse(spec, parse_context, line)
+        parse_context = {
+            'current_subpackage': None,
+            'in_body': False,
+            'offset': 0,
+        }
+        for line in lines:
+            spec, parse_context = _parse(spec, parse_context, line)
+            parse_context['offset'] += len(line) if line.isascii() else len(line.encode('utf-8'))
+
+        spec._length = parse_context['offset']
+        if spec.sections:
+            spec._sections[-1].end = spec._length
         return spec
 
 
-def replace_macros(string, spec=None):
+class SpecDocument:
+    """An editable spec file that keeps its original formatting.
+
+    While Spec only extracts information, a SpecDocument keeps all lines of the file and changes
+    just the parts that are edited. Several edits can be made before the file is written back once,
+    atomically::
+
+        document = SpecDocument.from_file('foo.spec')
+        document.set_tag('Version', '19.08.1')
+        document.set_tag('Release', '0')
+        document.remove_patch('fix-build.patch')
+        document.add_patch('0001-new-fix.patch')
+        document.write()
+
+    Only the main preamble, i.e. the lines before the first %package or body section, is edited.
+
+    """
+
+    def __init__(self, lines, filename=None):
+        """Creates a document from the lines of a spec file, including their line endings."""
+        self.lines = list(lines)
+        self.filename = filename
+
+    @staticmethod
+    def from_file(filename):
+        """Creates a new SpecDocument from a given file.
+
+        :param filename: The path to the spec file.
+        :return: A new SpecDocument object.
+        """
+        with open(filename, 'r', encoding='utf-8', newline='') as f:
+            return SpecDocument(f, filename=filename)
+
+    def __str__(self):
+        return ''.join(self.lines)
+
+    def _preamble_end(self):
+        for index, line in enumerate(self.lines):
+            if line[:1] == '%':
+                words = line.split(None, 1)
+                if words and (words[0] == '%package' or words[0] in _body_sections):
+                    return index
+        return len(self.lines)
+
+    def _tag_lines(self, tag):
+        """Yields (index, number, match) for each preamble line of the given tag."""
+        for index in range(self._preamble_end()):
+            match = _tag_line_pattern.match(self.lines[index])
+            if match is None:
+                continue
+            name, number = match.group(1), match.group(2)
+            if name == tag and (not number or tag in _numbered_tags):
+                yield index, number, match
+
+    def get_tag(self, tag):
+        """Returns the value of the first occurrence of a preamble tag, or None."""
+        for index, number, match in self._tag_lines(tag):
+            value = match.group(4) + match.group(5)
+            return value.strip() if _tag_takes_rest_of_line(tag) else match.group(4)
+        return None
+
+    def set_tag(self, tag, value):
+        """Changes the value of the first occurrence of a preamble tag.
+
+        Whitespace around the value, and for single word tags anything after the value, are kept.
+
+        :raises KeyError: If the tag does not exist in the preamble.
+        """
+        for index, number, match in self._tag_lines(tag):
+            self.lines[index] = self._replace_value(match, value, _tag_takes_rest_of_line(tag))
+            return
+        raise KeyError(tag)
+
+    @staticmethod
+    def _replace_value(match, value, rest_of_line):
+        rest = match.group(5)
+        if rest_of_line:
+            # Keep only the trailing whitespace
+            rest = rest[len(rest.rstrip()):]
+        return '{}{}{}{}{}{}'.format(match.group(1), match.group(2), match.group(3), value, rest,
+                                     match.group(6) or '')
+
+    def _numbered(self, tag):
+        return [(int(number or 0), match.group(4)) for _, number, match in self._tag_lines(tag)]
+
+    @property
+    def sources(self):
+        """The (number, value) pairs of all Source tags, in file order."""
+        return self._numbered('Source')
+
+    @property
+    def patches(self):
+        """The (number, value) pairs of all Patch tags, in file order."""
+        return self._numbered('Patch')
+
+    def set_source(self, number, value):
+        """Changes the value of Source<number>.
+
+        :raises KeyError: If there is no such source.
+        """
+        for index, tag_number, match in self._tag_lines('Source'):
+            if int(tag_number or 0) == number:
+                self.lines[index] = self._replace_value(match, value, False)
+                return
+        raise KeyError('Source{}'.format(number))
+
+    def add_patch(self, filename, number=None):
+        """Adds a Patch tag after the last Patch (or Source) tag.
+
+        If the %prep section applies patches with %patch directives, a copy of the last of them
+        applying the new patch is added after it, so the new directive has the same form
+        (%patchN or %patch -P N), options and line ending. Spec files using %autosetup or
+        %autopatch need no changes.
+
+        :param filename: The patch file name.
+        :param number: The patch number, by default one more than the highest existing number.
+        :return: The number of the new patch.
+        """
+        patch_lines = list(self._tag_lines('Patch'))
+        if number is None:
+            number = max([int(n or 0) for _, n, _ in patch_lines], default=-1) + 1
+
+        anchors = patch_lines or list(self._tag_lines('Source'))
+        if anchors:
+            index, _, match = anchors[-1]
+            template = match
+        else:
+            index, template = self._preamble_end() - 1, None
+
+        if template is not None:
+            # Align the value like the surrounding tags
+            width = len(template.group(1)) + len(template.group(2)) + len(template.group(3))
+            prefix = 'Patch{}:'.format(number).ljust(width)
+            if prefix[-1] != ' ':
+                prefix += ' '
+            newline = template.group(6) or '\n'
+        else:
+            prefix = 'Patch{}: '.format(number)
+            newline = '\r\n' if index >= 0 and self.lines[index].endswith('\r\n') else '\n'
+        self.lines.insert(index + 1, prefix + filename + newline)
+
+        directives = [i for i, line in enumerate(self.lines) if _patch_directive(line) is not None]
+        if directives:
+            # Copy the last directive, so that its form, options and line ending are kept
+            last = directives[-1]
+            line = self.lines[last]
+            _, start, end = _patch_directive(line)
+            if start is None:
+                directive = '%patch -P {}'.format(number) + line[len('%patch'):]
+            else:
+                directive = line[:start] + str(number) + line[end:]
+            self.lines.insert(last + 1, directive)
+
+        return number
+
+    def remove_patch(self, patch):
+        """Removes a Patch tag and the %patch directives applying it.
+
+        :param patch: The patch file name or number.
+        :return: The number of the removed patch.
+        :raises KeyError: If there is no such patch.
+        """
+        for index, number, match in self._tag_lines('Patch'):
+            number = int(number or 0)
+            if patch == number or patch == match.group(4):
+                del self.lines[index]
+                break
+        else:
+            raise KeyError(patch)
+
+        self.lines = [line for line in self.lines
+                      if not _is_patch_directive(line, number)]
+        return number
+
+    def write(self, filename=None):
+        """Writes the document back, atomically.
+
+        The contents are written to a temporary file in the same directory, which then replaces
+        the target. An interrupted write therefore never leaves a half-written spec file behind.
+
+        :param filename: The path to write to, by default the file the document was read from.
+        """
+        filename = filename or self.filename
+        if filename is None:
+            raise ValueError('No filename given')
+        _atomic_write(str(filename), str(self))
+
+
+def _tag_takes_rest_of_line(tag):
+    entry = _tags.get(tag)
+    return entry is not None and entry[2]
+
+
+def _patch_directive(line):
+    """Returns (number, start, end) of a %patch directive, with start and end delimiting the patch
+    number in the line, or None if the line is no %patch directive.
+
+    A directive without a number applies patch 0, start and end are None then.
+    """
+    match = _patch_directive_pattern.match(line)
+    if match is None:
+        return None
+    if match.group(1):
+        return int(match.group(1)), match.start(1), match.end(1)
+    number = (_patch_option_pattern.search(line, match.end()) or
+              _patch_argument_pattern.match(line, match.end()))
+    if number is None:
+        return 0, None, None
+    return int(number.group(1)), number.start(1), number.end(1)
+
+
+def _is_patch_directive(line, number):
+    directive = _patch_directive(line)
+    return directive is not None and directive[0] == number
+
+
+def _atomic_write(filename, text):
+    directory, basename = os.path.split(os.path.abspath(filename))
+    fd, temporary = tempfile.mkstemp(prefix='.' + basename + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(temporary, stat.S_IMODE(os.stat(filename).st_mode))
+        except FileNotFoundError:
+            pass
+        os.replace(temporary, filename)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def replace_macros(string, spec=None, **overrides):
     """Replace all macros in given string with corresponding values.
 
     For example: a string '%{name}-%{version}.tar.gz' will be transformed to 'foo-2.0.tar.gz'.
 
+    Macros are taken from the %define and %global lines and the tags of the spec, and expanded
+    recursively (see pyrpm.macros). Keyword arguments override single macros, e.g.
+    replace_macros(source, spec, version='2.1'). Results are memoized per spec.
+
     TODO: There is also `rpm --eval "%{macro}"` which could give us the expanded definition of a
     macro. Useful for macros that are global, e.g. %{_build_arch}.
 
     :return A string where all macros in given input are substituted as good as possible.
+    :raises MacroCycleError: if a macro is defined in terms of itself.
 
     """
     if spec:
         assert isinstance(spec, Spec)
+        return spec.expander(**overrides).expand(string)
 
-    def _macro_repl(match):
-        attr_name = match.group(1)
-        if spec:
-            value = getattr(spec, attr_name, None)
-            if value:
-                return str(value)
-        return match.string[match.start():match.end()]
-
-    return re.sub(_macro_pattern, _macro_repl, string)
+    return MacroExpander(overrides).expand(string)
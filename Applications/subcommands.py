@@ -0,0 +1,43 @@
+"""The subcommands of the KDE OBS tools.
+
+kde_obs.py and update_applications.py both register the subcommands of
+this table, so that the names, targets and help texts are kept in one
+place. Targets are dotted paths, and only the module of the subcommand
+that runs is imported.
+"""
+
+from arghandler import register_subcommand
+
+__all__ = ["SUBCOMMANDS", "register_subcommands"]
+
+SUBCOMMANDS = (
+    ("update_packages", "update_applications:update_packages",
+     "Update OBS packages to a new upstream release"),
+    ("changelogs", "update_applications:changelogs",
+     "Generate the changelog entries of a release ahead of the update"),
+    ("index_commits", "update_applications:index_commits",
+     "Build or refresh the commit index of upstream checkouts"),
+    ("survey", "update_applications:survey",
+     "List name, version, sources and patches of all packages"),
+    ("sync_patches", "update_applications:sync_patches",
+     "Take over the patches of packages from another project"),
+    ("sync_develproject", "update_applications:sync_develproject",
+     "Copy changed files of packages from the devel project checkout"),
+    ("merge_changelogs", "update_applications:merge_changelogs",
+     "Merge the entries of two .changes files or projects"),
+    ("update_source_services", "update_applications:update_source_services",
+     "Update the _service files of packages"),
+)
+
+
+def register_subcommands(module=None, functions=None):
+    """Register the subcommands of SUBCOMMANDS with arghandler.
+
+    Targets in module are taken from functions, e.g. the globals() of the
+    module when it runs as a script, instead of importing it again.
+    """
+    for name, target, help_text in SUBCOMMANDS:
+        target_module, _, function = target.partition(":")
+        if target_module == module:
+            target = functions[function]
+        register_subcommand(name, target, help=help_text)
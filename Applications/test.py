@@ -0,0 +1,23 @@
+"""Runs the tests of the modules in this directory (see tests/)."""
+
+import unittest
+
+from tests.cache import *
+from tests.changelogs import *
+from tests.changes import *
+from tests.develproject import *
+from tests.fileops import *
+from tests.gitindex import *
+from tests.instrument import *
+from tests.journal import *
+from tests.macros import *
+from tests.oscpool import *
+from tests.packages import *
+from tests.parser import *
+from tests.patches import *
+from tests.pipeline import *
+from tests.spec import *
+from tests.survey import *
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""Tests of SpecCache, the on-disk cache of parsed specs."""
+
+import itertools
+import os
+from pathlib import Path
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from pyrpm.cache import SpecCache
+from pyrpm.spec import Spec
+
+SPEC = """\
+Name:           {name}
+Version:        1.0
+Release:        0
+Summary:        {name}
+Source:         {name}-%{{version}}.tar.xz
+
+%description
+{name}, {filler}
+"""
+
+
+class SpecCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+        self.filename = self.path / "cache" / "specs.sqlite"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, filler=""):
+
+        specfile = self.path / (name + ".spec")
+        specfile.write_text(SPEC.format(name=name, filler=filler))
+        return specfile
+
+    def used(self):
+
+        connection = sqlite3.connect(str(self.filename))
+        try:
+            return dict(connection.execute("SELECT path, used FROM entries"))
+        finally:
+            connection.close()
+
+    def test_stat_hit(self):
+        specfile = self.write("foo")
+        with SpecCache(self.filename) as cache:
+            first = Spec.from_file(str(specfile), cache=cache)
+            second = Spec.from_file(str(specfile), cache=cache)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        self.assertEqual(second.name, "foo")
+        self.assertEqual(second.sources, first.sources)
+        self.assertEqual(second.filename, str(specfile))
+        self.assertEqual(second.descriptions["foo"], "foo, ")
+
+    def test_digest_hit(self):
+        specfile = self.write("foo")
+        with SpecCache(self.filename) as cache:
+            Spec.from_file(str(specfile), cache=cache)
+
+            # Touched but unchanged, and an identical copy elsewhere
+            stat = specfile.stat()
+            os.utime(str(specfile), ns=(stat.st_atime_ns,
+                                        stat.st_mtime_ns + 10 ** 9))
+            Spec.from_file(str(specfile), cache=cache)
+            copy = self.path / "copy.spec"
+            shutil.copy(str(specfile), str(copy))
+            self.assertEqual(Spec.from_file(str(copy), cache=cache).name,
+                             "foo")
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+            # Now cached by the new mtime
+            Spec.from_file(str(specfile), cache=cache)
+            self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_changed_file(self):
+        specfile = self.write("foo")
+        with SpecCache(self.filename) as cache:
+            Spec.from_file(str(specfile), cache=cache)
+            specfile.write_text(specfile.read_text().replace("1.0", "2.0.1"))
+            self.assertEqual(Spec.from_file(str(specfile),
+                                            cache=cache).version, "2.0.1")
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_parser_version(self):
+        specfile = self.write("foo")
+        with SpecCache(self.filename) as cache:
+            Spec.from_file(str(specfile), cache=cache)
+
+        with mock.patch("pyrpm.cache.PARSER_VERSION", -1):
+            with SpecCache(self.filename) as cache:
+                Spec.from_file(str(specfile), cache=cache)
+                self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    @mock.patch("pyrpm.cache.time.time", side_effect=itertools.count(1))
+    def test_close_writes_back_hits(self, time):
+        specfile = self.write("foo")
+        with SpecCache(self.filename) as cache:
+            Spec.from_file(str(specfile), cache=cache)
+        stored = self.used()[str(specfile)]
+
+        with SpecCache(self.filename) as cache:
+            Spec.from_file(str(specfile), cache=cache)
+            # Hits are only written back in batches
+            self.assertEqual(self.used()[str(specfile)], stored)
+        self.assertGreater(self.used()[str(specfile)], stored)
+
+    @mock.patch("pyrpm.cache.time.time", side_effect=itertools.count(1))
+    def test_eviction(self, time):
+        specfiles = [self.write(name, filler=name * 2000)
+                     for name in ("a", "b", "c")]
+        with SpecCache(self.filename) as cache:
+            Spec.from_file(str(specfiles[0]), cache=cache)
+            size = cache._total_bytes
+            cache.max_bytes = size * 2 + size // 2
+
+            Spec.from_file(str(specfiles[1]), cache=cache)
+            # a is now more recently used than b
+            Spec.from_file(str(specfiles[0]), cache=cache)
+            Spec.from_file(str(specfiles[2]), cache=cache)
+
+            self.assertLessEqual(cache._total_bytes, cache.max_bytes)
+        self.assertEqual(sorted(self.used()),
+                         [str(specfiles[0]), str(specfiles[2])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+"""Tests of staging changelog entries ahead of a release and of using them
+in package updates."""
+
+import argparse
+import io
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+
+from gitindex import RefIndex
+from tests.gitindex import commit, git
+from update_applications import (PackageUpdate, changelogs,
+                                 stage_changes_entry, staged_entry_path)
+
+SPEC = """\
+Name:           foo
+Version:        19.08.0
+Release:        0
+Source:         %{name}-%{version}.tar.xz
+"""
+
+
+class ChangelogsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = Path(self.directory.name)
+        self.checkouts = path / "checkouts"
+        self.project = path / "project"
+        self.staging = path / "staging"
+
+        repo = self.checkouts / "foo"
+        repo.mkdir(parents=True)
+        git(repo, "init", "-q", "-b", "master")
+        commit(repo, "Initial import")
+        git(repo, "tag", "v19.08.0")
+        commit(repo, "Fix crash\n\nBUG: 12345")
+        git(repo, "tag", "v19.08.1")
+
+        (self.project / "foo").mkdir(parents=True)
+        (self.project / "foo" / "foo.spec").write_text(SPEC)
+        (self.project / "foo" / "foo.changes").write_text("- Old entry\n")
+
+        self.staged = staged_entry_path(self.staging, "foo", "19.08.0",
+                                        "19.08.1")
+
+    def tearDown(self):
+        RefIndex.clear_cache()
+        self.directory.cleanup()
+
+    def stage(self, **settings):
+
+        return stage_changes_entry("foo", self.staging, "19.08.1",
+                                   self.checkouts, self.project,
+                                   committer="me@example.org", **settings)
+
+    def test_staged_entry_path(self):
+        self.assertEqual(self.staged, self.staging / "foo" /
+                         "19.08.0..19.08.1.changes")
+
+    def test_stage_changes_entry(self):
+        staged, output = self.stage()
+
+        self.assertTrue(staged)
+        self.assertIn("Staged {}".format(self.staged), output)
+        entry = self.staged.read_text()
+        self.assertIn("- Update to 19.08.1\n", entry)
+        self.assertIn("- Changes since 19.08.0:\n"
+                      "  * Fix crash (kde#12345)\n", entry)
+        self.assertIn("me@example.org", entry)
+
+        # An entry staged before is kept, unless forced
+        self.staged.write_text("edited\n")
+        staged, output = self.stage()
+        self.assertTrue(staged)
+        self.assertIn("{} already staged".format(self.staged), output)
+        self.assertEqual(self.staged.read_text(), "edited\n")
+
+        self.stage(force=True)
+        self.assertEqual(self.staged.read_text(), entry)
+
+    def test_unknown_version(self):
+        (self.project / "foo" / "foo.spec").unlink()
+        staged, output = self.stage()
+
+        self.assertFalse(staged)
+        self.assertIn("No current version known for foo", output)
+        self.assertFalse(self.staging.exists())
+
+    def test_subcommand(self):
+        packagelist = Path(self.directory.name) / "packages"
+        packagelist.write_text("foo\nbar\n")
+        args = ["-s", str(self.checkouts), "-o", str(self.staging),
+                "-p", str(self.project), "--version-to", "19.08.1",
+                "-e", "me@example.org", "-j", "2", str(packagelist)]
+
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            changelogs(argparse.ArgumentParser(), None, args)
+        self.assertIn("Processed 2 packages: staged 1, skipped 1",
+                      stdout.getvalue())
+        self.assertTrue(self.staged.exists())
+
+        # A second run leaves the staged package alone
+        self.staged.write_text("edited\n")
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            changelogs(argparse.ArgumentParser(), None, args)
+        self.assertIn("{} already staged".format(self.staged),
+                      stdout.getvalue())
+        self.assertEqual(self.staged.read_text(), "edited\n")
+
+    @mock.patch("update_applications.record_changes")
+    def test_update_uses_staged_entry(self, record_changes):
+        self.staged.parent.mkdir(parents=True)
+        self.staged.write_text("- Staged entry\n")
+        update = PackageUpdate("foo", "19.08.1", self.directory.name,
+                               self.project, "me@example.org",
+                               checkout_dir=self.checkouts,
+                               output=io.StringIO(),
+                               staged_changes=self.staging)
+        update.current_version = "19.08.0"
+
+        self.assertTrue(update.changelog())
+        self.assertFalse(record_changes.called)
+        self.assertIn("Using staged changelog entry",
+                      update.output.getvalue())
+        self.assertEqual((self.project / "foo" / "foo.changes").read_text(),
+                         "- Staged entry\n\n- Old entry\n")
+
+        # Without a staged entry the history is read as before
+        update.current_version = "19.08.0.1"
+        self.assertTrue(update.changelog())
+        self.assertTrue(record_changes.called)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,188 @@
+"""Tests of reading and merging .changes files."""
+
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+
+import changes
+
+DELIMITER = changes.DELIMITER
+
+
+def entry(date, author, *lines):
+
+    return "{}\n{} - {}\n\n{}\n\n".format(DELIMITER, date, author,
+                                          "\n".join(lines))
+
+
+UPDATE = entry("Thu Sep  5 10:00:00 UTC 2019", "a@suse.com",
+               "- Update to 19.08.1", "  * New bugfix release")
+FIX = entry("Mon Sep  2 08:00:00 UTC 2019", "b@suse.com",
+            "- Add fix.patch")
+OLD = entry("Thu Aug 15 10:00:00 UTC 2019", "a@suse.com",
+            "- Update to 19.08.0")
+
+
+class MergeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.first = Path(self.directory.name) / "first.changes"
+        self.second = Path(self.directory.name) / "second.changes"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, first, second):
+
+        self.first.write_text(first)
+        self.second.write_text(second)
+
+    def test_merge_both(self):
+        self.write(UPDATE + OLD, FIX + OLD)
+        result = changes.merge_files(self.first, self.second)
+
+        self.assertEqual(result.written, [self.second, self.first])
+        self.assertEqual(self.first.read_text(), UPDATE + FIX + OLD)
+        self.assertEqual(self.second.read_text(), UPDATE + FIX + OLD)
+
+        # Merging again changes nothing
+        result = changes.merge_files(self.first, self.second)
+        self.assertEqual(result.written, [])
+        self.assertEqual(result.describe(), [
+            "{}: unchanged".format(self.second)])
+
+    def test_oneway(self):
+        self.write(UPDATE + OLD, FIX + OLD)
+        result = changes.merge_files(self.first, self.second, oneway=True)
+
+        self.assertEqual(result.written, [self.second])
+        self.assertEqual(self.first.read_text(), UPDATE + OLD)
+        self.assertEqual(self.second.read_text(), UPDATE + FIX + OLD)
+
+    def test_whitespace_differences(self):
+        # The same entry, saved with trailing blanks and extra blank lines
+        update = entry("Thu Sep  5 10:00:00 UTC 2019", "a@suse.com  ",
+                       "", "- Update to 19.08.1   ",
+                       "  * New bugfix release", "")
+        self.write(UPDATE + OLD, update + OLD)
+        result = changes.merge_files(self.first, self.second)
+
+        self.assertEqual(result.written, [])
+        self.assertEqual(self.second.read_text(), update + OLD)
+
+    def test_same_second_different_authors(self):
+        other = entry("Thu Sep  5 10:00:00 UTC 2019", "b@suse.com",
+                      "- Update to 19.08.1", "  * New bugfix release")
+        self.write(UPDATE + OLD, other + OLD)
+        changes.merge_files(self.first, self.second)
+
+        # Both are kept, in the order of the files given
+        merged = changes.ChangesFile.from_file(self.first).entries
+        self.assertEqual([entry.author for entry in merged],
+                         ["a@suse.com", "b@suse.com", "a@suse.com"])
+        self.assertEqual(self.second.read_text(), UPDATE + other + OLD)
+
+    def test_date_formats(self):
+        # As written by update_applications, one hour east of UTC
+        update = entry("Thu 05 Sep 11.00.00 CET 2019", "a@suse.com",
+                       "- Update to 19.08.1", "  * New bugfix release")
+        self.write(UPDATE + OLD, update + OLD)
+
+        self.assertEqual(changes.merge_files(self.first, self.second).written,
+                         [])
+
+    def test_invalid_header_blocks_write(self):
+        invalid = entry("Someday", "c@suse.com", "- Something")
+        self.write(UPDATE + OLD, FIX + invalid + OLD)
+        result = changes.merge_files(self.first, self.second)
+
+        self.assertEqual(result.written, [])
+        self.assertEqual(result.invalid, ["Someday - c@suse.com"])
+        self.assertEqual(result.describe()[1], "-> Someday - c@suse.com")
+        self.assertEqual(self.first.read_text(), UPDATE + OLD)
+        self.assertEqual(self.second.read_text(), FIX + invalid + OLD)
+
+
+class ReaderTestCase(unittest.TestCase):
+    """iter_entries() maps files, and reads them in blocks where that
+    fails; both must give the entries parse_changes() finds."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = Path(self.directory.name) / "foo.changes"
+        text = UPDATE + FIX + "".join(
+            entry("Thu Aug 15 10:{:02d}:00 UTC 2019".format(number % 60),
+                  "a@suse.com", "- Change {}".format(number))
+            for number in range(200)) + OLD
+        self.filename.write_text(text)
+        self.expected = [entry.text for entry in
+                         changes.parse_changes(text).entries]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, limit=None, mapped=True):
+
+        if mapped:
+            return [entry.text for entry in
+                    changes.iter_entries(self.filename, limit)]
+        with mock.patch("changes.mmap.mmap", side_effect=OSError):
+            return [entry.text for entry in
+                    changes.iter_entries(self.filename, limit)]
+
+    def test_both_paths(self):
+        self.assertEqual(len(self.expected), 203)
+        self.assertEqual(self.read(), self.expected)
+        self.assertEqual(self.read(mapped=False), self.expected)
+        self.assertEqual(changes.last_version(self.filename), "19.08.1")
+        with mock.patch("changes.mmap.mmap", side_effect=OSError):
+            self.assertEqual(changes.last_version(self.filename), "19.08.1")
+
+    def test_block_boundaries(self):
+        # Block sizes smaller than a delimiter, and ones making delimiters
+        # span blocks at all offsets
+        first = self.filename.read_bytes().find(
+            DELIMITER.encode(), len(UPDATE))
+        for size in [7, 64, 100, 4096] + list(range(first - 68, first + 2)):
+            with mock.patch("changes._BLOCK_SIZE", size):
+                self.assertEqual(self.read(mapped=False), self.expected,
+                                 "block size {}".format(size))
+
+    def test_limit(self):
+        for mapped in (True, False):
+            self.assertEqual(self.read(2, mapped), self.expected[:2])
+            self.assertEqual(self.read(0, mapped), [])
+            self.assertEqual(self.read(1000, mapped), self.expected)
+
+    def test_stops_at_limit(self):
+        positions = list()
+        read_chunks = changes._read_chunks
+
+        def spy(handle):
+            for chunk in read_chunks(handle):
+                positions.append(handle.tell())
+                yield chunk
+
+        with mock.patch("changes._BLOCK_SIZE", 1024), \
+                mock.patch("changes._read_chunks", spy), \
+                mock.patch("changes._parse_entry",
+                           wraps=changes._parse_entry) as parse:
+            self.assertEqual(self.read(2, mapped=False), self.expected[:2])
+
+        self.assertEqual(parse.call_count, 2)
+        self.assertEqual(len(positions), 2)
+        self.assertLess(max(positions), 2048)
+        self.assertLess(max(positions), self.filename.stat().st_size)
+
+    def test_empty_and_missing(self):
+        self.filename.write_text("")
+        self.assertEqual(self.read(), [])
+        self.assertIsNone(changes.last_version(self.filename))
+        self.assertIsNone(changes.last_version(self.filename.with_name(
+            "missing.changes")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Tests of syncing packages from a devel project checkout."""
+
+import io
+import os
+from pathlib import Path
+import tempfile
+import unittest
+
+from update_applications import sync_package_files
+
+FAKE_OSC = """\
+#!/bin/sh
+echo "$@ in $(pwd)" >> "{log}"
+"""
+
+
+class SyncPackageFilesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = Path(self.directory.name)
+        self.devel = path / "devel"
+        self.project = path / "project"
+        for project, files in ((self.devel, {"foo.spec": "new spec\n",
+                                             "new.patch": "new\n",
+                                             "_service": "devel\n"}),
+                               (self.project, {"foo.spec": "old spec\n",
+                                               "old.patch": "old\n",
+                                               "_service": "project\n"})):
+            (project / "foo").mkdir(parents=True)
+            for name, text in files.items():
+                (project / "foo" / name).write_text(text)
+
+        self.log = path / "osc.log"
+        self.osc = path / "osc"
+        self.osc.write_text(FAKE_OSC.format(log=self.log))
+        os.chmod(str(self.osc), 0o755)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def sync(self, osc):
+
+        output = io.StringIO()
+        self.assertTrue(sync_package_files("foo", self.devel, self.project,
+                                           output=output, osc=osc))
+        return output.getvalue()
+
+    def test_sync(self):
+        output = self.sync(str(self.osc))
+        package = self.project / "foo"
+
+        self.assertEqual(sorted(path.name for path in package.iterdir()),
+                         ["_service", "foo.spec", "new.patch"])
+        self.assertEqual((package / "foo.spec").read_text(), "new spec\n")
+        self.assertEqual((package / "_service").read_text(), "project\n")
+        self.assertIn("foo: updated foo.spec; added new.patch; removed "
+                      "old.patch", output)
+        self.assertEqual(self.log.read_text(),
+                         "addremove in {}\n".format(package.resolve()))
+
+        # Nothing to add or remove the second time
+        self.assertIn("foo: unchanged", self.sync(str(self.osc)))
+        self.assertEqual(len(self.log.read_text().splitlines()), 1)
+
+    def test_reminder(self):
+        output = self.sync(None)
+        self.assertIn("Run osc addremove in {}".format(self.project / "foo"),
+                      output)
+        self.assertFalse(self.log.exists())
+
+    def test_failed_addremove(self):
+        output = self.sync(str(self.osc.with_name("missing-osc")))
+        self.assertIn("Run osc addremove", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
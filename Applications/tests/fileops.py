@@ -0,0 +1,215 @@
+"""Tests of the atomic file operations on package checkouts."""
+
+import errno
+import io
+import os
+from pathlib import Path
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from fileops import DirectoryIndex, place_file, prepend_files, write_file
+from update_applications import PackageUpdate, TarballDirectory
+
+HEADER = ("-" * 67 + "\n"
+          "Fri Sep  6 12:00:00 UTC 2019 - me@example.org\n\n"
+          "- Update to 19.08.1\n\n")
+
+
+class FileopsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assert_no_temporary_files(self):
+
+        self.assertEqual([path.name for path in self.path.iterdir()
+                          if path.name.startswith(".")], [])
+
+
+class PrependFilesTestCase(FileopsTestCase):
+
+    def test_byte_for_byte(self):
+        changes = self.path / "foo.changes"
+        # No trailing newline, and bytes that are not UTF-8
+        old = b"- Initial package\r\n\xff\xfe no newline"
+        changes.write_bytes(old)
+
+        prepend_files([changes], HEADER)
+        self.assertEqual(changes.read_bytes(), HEADER.encode() + old)
+        prepend_files([changes], b"")
+        self.assertEqual(changes.read_bytes(), HEADER.encode() + old)
+        self.assert_no_temporary_files()
+
+    def test_several_files(self):
+        names = ["foo.changes", "libfoo.changes", "new.changes"]
+        for name in names[:2]:
+            (self.path / name).write_text(name + "\n")
+
+        prepend_files((self.path / name for name in names), HEADER)
+        for name in names[:2]:
+            self.assertEqual((self.path / name).read_text(),
+                             HEADER + name + "\n")
+        # Missing files are created
+        self.assertEqual((self.path / names[2]).read_text(), HEADER)
+        self.assert_no_temporary_files()
+
+    def test_failure_leaves_files_untouched(self):
+        first = self.path / "foo.changes"
+        first.write_text("foo\n")
+        missing = self.path / "missing" / "bar.changes"
+
+        with self.assertRaises(FileNotFoundError):
+            prepend_files([first, missing], HEADER)
+        self.assertEqual(first.read_text(), "foo\n")
+        self.assert_no_temporary_files()
+
+    def test_permissions(self):
+        changes = self.path / "foo.changes"
+        changes.write_text("foo\n")
+        changes.chmod(0o640)
+
+        prepend_files([changes], HEADER)
+        self.assertEqual(stat.S_IMODE(changes.stat().st_mode), 0o640)
+
+
+class WriteFileTestCase(FileopsTestCase):
+
+    def test_write_file(self):
+        spec = self.path / "foo.spec"
+        spec.write_text("Version: 1.0\n")
+        spec.chmod(0o600)
+
+        write_file(spec, "Version: 2.0\r\nno newline")
+        self.assertEqual(spec.read_bytes(), b"Version: 2.0\r\nno newline")
+        self.assertEqual(stat.S_IMODE(spec.stat().st_mode), 0o600)
+        self.assert_no_temporary_files()
+
+    def test_new_file(self):
+        spec = self.path / "foo.spec"
+
+        write_file(str(spec), "Name: foo\n")
+        self.assertEqual(spec.read_text(), "Name: foo\n")
+        # As created by mkstemp()
+        self.assertEqual(stat.S_IMODE(spec.stat().st_mode), 0o600)
+
+    def test_failure_keeps_original(self):
+        spec = self.path / "foo.spec"
+        spec.write_text("Name: foo\n")
+
+        with self.assertRaises(UnicodeEncodeError):
+            write_file(spec, "\udcff")
+        self.assertEqual(spec.read_text(), "Name: foo\n")
+        self.assert_no_temporary_files()
+
+
+def unsupported(*args):
+
+    raise OSError(errno.EOPNOTSUPP, "Operation not supported")
+
+
+@mock.patch("fileops.fcntl.ioctl", side_effect=unsupported)
+class PlaceFileTestCase(FileopsTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.source = self.path / "foo-19.08.1.tar.xz"
+        self.source.write_bytes(b"tarball")
+        self.source.chmod(0o644)
+        self.destination = self.path / "checkout.tar.xz"
+
+    def test_hardlink(self, ioctl):
+        self.assertEqual(place_file(self.source, self.destination),
+                         "hardlink")
+        self.assertTrue(ioctl.called)
+        self.assertTrue(self.source.samefile(self.destination))
+        self.assert_no_temporary_files()
+
+    def test_copy(self, ioctl):
+        with mock.patch("fileops.os.link", side_effect=unsupported) as link:
+            self.assertEqual(place_file(self.source, self.destination),
+                             "copy")
+        self.assertTrue(ioctl.called)
+        self.assertTrue(link.called)
+        self.assertFalse(self.source.samefile(self.destination))
+        self.assertEqual(self.destination.read_bytes(), b"tarball")
+        self.assertEqual(stat.S_IMODE(self.destination.stat().st_mode),
+                         0o644)
+        self.assert_no_temporary_files()
+
+    def test_no_hardlink(self, ioctl):
+        self.destination.write_bytes(b"old")
+        with mock.patch("fileops.os.link") as link:
+            self.assertEqual(place_file(self.source, self.destination,
+                                        hardlink=False), "copy")
+        self.assertFalse(link.called)
+        self.assertEqual(self.source.stat().st_nlink, 1)
+        self.assertEqual(self.destination.read_bytes(), b"tarball")
+
+    def test_failure(self, ioctl):
+        with mock.patch("fileops.os.link", side_effect=unsupported), \
+                mock.patch("fileops.copy_contents", side_effect=unsupported):
+            with self.assertRaises(OSError):
+                place_file(self.source, self.destination)
+        self.assertFalse(self.destination.exists())
+        self.assert_no_temporary_files()
+
+
+class DirectoryIndexTestCase(FileopsTestCase):
+
+    def test_directory_index(self):
+        (self.path / "foo-19.08.1.tar.xz").write_bytes(b"")
+        index = DirectoryIndex(self.path)
+        self.assertIn("foo-19.08.1.tar.xz", index)
+        self.assertNotIn("foo-19.08.0.tar.xz", index)
+
+        # Not refreshed by itself
+        (self.path / "foo-19.08.0.tar.xz").write_bytes(b"")
+        self.assertNotIn("foo-19.08.0.tar.xz", index)
+        index.add("foo-19.08.0.tar.xz")
+        index.discard("foo-19.08.1.tar.xz")
+        self.assertIn("foo-19.08.0.tar.xz", index)
+        self.assertNotIn("foo-19.08.1.tar.xz", index)
+
+        self.assertEqual(DirectoryIndex(self.path / "missing").names, set())
+
+    def test_tarball_lookup(self):
+        tarballs = self.path / "tarballs"
+        tarballs.mkdir()
+        for name in ("foo-19.08.0.tar.xz", "foo-19.08.1.tar.xz",
+                     "foobar-19.08.1.tar.xz", "libfoo-19.08.1.tar.xz"):
+            (tarballs / name).write_text(name)
+        package = self.path / "project" / "foo"
+        package.mkdir(parents=True)
+        (package / "foo.spec").write_text(
+            "Name: foo\nVersion: 19.08.0\n"
+            "Source: lib%{name}-%{version}.tar.xz\n")
+
+        directory = TarballDirectory(tarballs)
+        update = PackageUpdate("foo", "19.08.1", tarballs,
+                               self.path / "project", "me@example.org",
+                               output=io.StringIO(), tarballs=directory)
+        self.assertEqual(update.tarball_name, "libfoo-19.08.1.tar.xz")
+        self.assertTrue(update.tarball())
+
+        self.assertEqual((package / "libfoo-19.08.1.tar.xz").read_text(),
+                         "libfoo-19.08.1.tar.xz")
+        self.assertTrue(directory.is_done("libfoo-19.08.1.tar.xz"))
+        self.assertFalse(directory.is_pending("libfoo-19.08.1.tar.xz"))
+        self.assertTrue((tarballs / "done" / "libfoo-19.08.1.tar.xz")
+                        .exists())
+        self.assertEqual(sorted(os.listdir(str(tarballs))), [
+            "done", "foo-19.08.0.tar.xz", "foo-19.08.1.tar.xz",
+            "foobar-19.08.1.tar.xz"])
+
+        # The tarball is gone from the pending ones now
+        self.assertFalse(update.tarball())
+
+
+if __name__ == "__main__":
+    unittest.main()
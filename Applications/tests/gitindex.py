@@ -0,0 +1,241 @@
+"""Tests of the commit index against git log, on temporary repositories."""
+
+import os
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from gitindex import CommitIndex, RefIndex, read_log_records
+from update_applications import MAX_LOG_ENTRIES, format_log_entries
+
+
+def git(repo, *args, date="1567677600 +0000"):
+
+    environment = dict(os.environ, GIT_AUTHOR_NAME="A", GIT_COMMITTER_NAME="A",
+                       GIT_AUTHOR_EMAIL="a@example.org",
+                       GIT_COMMITTER_EMAIL="a@example.org",
+                       GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date)
+    return subprocess.check_output(["git"] + list(args), cwd=str(repo),
+                                   env=environment,
+                                   universal_newlines=True).strip()
+
+
+def commit(repo, message, date="1567677600 +0000"):
+
+    git(repo, "commit", "-q", "--allow-empty", "-m", message, date=date)
+
+
+class CommitIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.repo = Path(self.directory.name) / "repo"
+        self.repo.mkdir()
+        git(self.repo, "init", "-q", "-b", "master")
+        self.index = CommitIndex(Path(self.directory.name) / "index.sqlite")
+
+    def tearDown(self):
+        RefIndex.clear_cache()
+        self.directory.cleanup()
+
+    def git_log(self, commit_from, commit_to):
+
+        output = git(self.repo, "log", "--no-merges", "--format=%H %s",
+                     "{}..{}".format(commit_from, commit_to))
+        return [tuple(line.split(" ", 1)) for line in output.splitlines()]
+
+    def index_log(self, commit_from, commit_to, limit=None):
+
+        records = self.index.log_records("repo", commit_from, commit_to,
+                                         limit)
+        return [(commit, subject) for commit, subject, _ in records]
+
+    def test_same_timestamps_in_git_log_order(self):
+        for number in range(5):
+            commit(self.repo, "old {}".format(number))
+        git(self.repo, "tag", "v1")
+        for number in range(30):
+            commit(self.repo, "new {}".format(number))
+        git(self.repo, "tag", "v2")
+        self.index.refresh(self.repo)
+
+        self.assertEqual(len(self.index_log("v1", "v2")), 30)
+        self.assertEqual(self.index_log("v1", "v2"), self.git_log("v1", "v2"))
+        self.assertEqual(self.index_log("v1", "v2", limit=3),
+                         self.git_log("v1", "v2")[:3])
+        self.assertEqual(self.index_log("v2", "v1"), [])
+
+    def test_merged_branch(self):
+        commit(self.repo, "base", date="1000000000 +0000")
+        git(self.repo, "tag", "v1")
+        git(self.repo, "checkout", "-q", "-b", "feature")
+        commit(self.repo, "feature 1", date="1000000100 +0000")
+        commit(self.repo, "feature 2", date="1000000300 +0000")
+        git(self.repo, "checkout", "-q", "master")
+        commit(self.repo, "master 1", date="1000000200 +0000")
+        git(self.repo, "tag", "before-merge")
+        git(self.repo, "merge", "-q", "--no-ff", "-m", "merge", "feature",
+            date="1000000400 +0000")
+        commit(self.repo, "master 2", date="1000000400 +0000")
+        git(self.repo, "tag", "v2")
+        self.index.refresh(self.repo)
+
+        self.assertEqual(self.index_log("v1", "v2"), self.git_log("v1", "v2"))
+        self.assertEqual(self.index_log("feature", "v2"),
+                         self.git_log("feature", "v2"))
+        self.assertEqual(self.index_log("before-merge", "feature"),
+                         self.git_log("before-merge", "feature"))
+
+    def test_incremental_refresh(self):
+        commit(self.repo, "first")
+        git(self.repo, "tag", "v1")
+        self.assertEqual(self.index.refresh(self.repo), 1)
+
+        commit(self.repo, "second\n\nBUG: 12345")
+        commit(self.repo, "third")
+        git(self.repo, "tag", "v2")
+        self.assertEqual(self.index.refresh(self.repo), 2)
+        self.assertEqual(self.index.refresh(self.repo), 0)
+
+        records = self.index.log_records("repo", "v1", "v2")
+        self.assertEqual([(subject, bugs) for _, subject, bugs in records],
+                         [("third", []), ("second", ["12345"])])
+        self.assertEqual(self.index_log("v1", "v2"), self.git_log("v1", "v2"))
+
+    def test_unknown_range(self):
+        commit(self.repo, "first")
+        self.assertIsNone(self.index.log_records("repo", "v1", "master"))
+        self.index.refresh(self.repo)
+        self.assertIsNone(self.index.log_records("repo", "v0", "master"))
+        self.assertIsNone(self.index.log_records("other", "v0", "master"))
+
+
+class RefIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.repos = list()
+        for name in ("one", "two"):
+            repo = Path(self.directory.name) / name
+            repo.mkdir()
+            git(repo, "init", "-q", "-b", "master")
+            commit(repo, "first")
+            git(repo, "tag", "v1")
+            self.repos.append(repo)
+
+    def tearDown(self):
+        RefIndex.clear_cache()
+        self.directory.cleanup()
+
+    def test_refs(self):
+        index = RefIndex.for_repo(self.repos[0])
+        self.assertTrue(index.has_tag("v1"))
+        self.assertFalse(index.has_tag("v2"))
+        self.assertEqual(index.branch("master"), "master")
+        self.assertIsNone(index.branch("Applications/19.08"))
+
+    def test_cached_per_repository(self):
+        paths = [self.repos[number % 2] for number in range(32)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            indexes = list(executor.map(RefIndex.for_repo, paths))
+
+        self.assertEqual(len(set(map(id, indexes))), 2)
+        self.assertIs(RefIndex.for_repo(self.repos[0] / ".." / "one"),
+                      indexes[0])
+
+        RefIndex.clear_cache()
+        self.assertIsNot(RefIndex.for_repo(self.repos[0]), indexes[0])
+
+
+class LogRecordsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.repo = Path(self.directory.name) / "repo"
+        self.repo.mkdir()
+        git(self.repo, "init", "-q", "-b", "master")
+        commit(self.repo, "Initial import")
+        git(self.repo, "tag", "v1")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def entries(self):
+
+        return list(format_log_entries("v1", "master", str(self.repo)))
+
+    def test_read_log_records(self):
+        commit(self.repo, "Fix crash\n\nBUG: 12345\nMore\ntext")
+        commit(self.repo, "Add feature")
+
+        records = list(read_log_records(["v1..master"], str(self.repo)))
+        self.assertEqual([record[1:] for record in records], [
+            ("Add feature", "\n"), ("Fix crash", "BUG: 12345\nMore\ntext\n")])
+        self.assertEqual(records[0][0], git(self.repo, "rev-parse", "HEAD"))
+
+        records = read_log_records(["--reverse"], str(self.repo), limit=2)
+        self.assertEqual([record[1] for record in records],
+                         ["Initial import", "Fix crash"])
+
+    def test_kills_git_when_stopped_early(self):
+        # Enough history for git to block on the full pipe
+        parent = "from {}\n".format(git(self.repo, "rev-parse", "HEAD"))
+        commands = list()
+        for number in range(2000):
+            message = "Change {}\n\n{}\n".format(number, "x" * 500)
+            commands.append(
+                "commit refs/heads/master\n"
+                "committer A <a@example.org> 1567677600 +0000\n"
+                "data {}\n{}{}".format(len(message), message,
+                                        parent if number == 0 else ""))
+        subprocess.run(["git", "fast-import", "--quiet"], cwd=str(self.repo),
+                       input="\n".join(commands) + "\n",
+                       universal_newlines=True, check=True)
+
+        processes = list()
+        popen = subprocess.Popen
+
+        def spawn(*args, **kwargs):
+
+            process = popen(*args, **kwargs)
+            process.kill = mock.Mock(wraps=process.kill)
+            processes.append(process)
+            return process
+
+        with mock.patch("gitindex.subprocess.Popen", side_effect=spawn):
+            records = read_log_records(["master"], str(self.repo))
+            self.assertEqual(next(records)[1], "Change 1999")
+            records.close()
+
+        self.assertTrue(processes[0].kill.called)
+        self.assertIsNotNone(processes[0].returncode)
+        self.assertTrue(processes[0].stdout.closed)
+
+    def test_format_log_entries(self):
+        self.assertEqual(self.entries(), ["  * None"])
+
+        commit(self.repo, "Fix crash\n\nBUG: 12345\n"
+                          "BUG: https://bugs.kde.org/show_bug.cgi?id=678")
+        commit(self.repo, "Add feature\n\nFEATURE: 90\nCCBUG: 91")
+        commit(self.repo, "GIT_SILENT made messages (after extraction)")
+        commit(self.repo, "SVN_SILENT made messages (.desktop file)")
+        self.assertEqual(self.entries(), [
+            "  * Add feature (kde#90)", "  * Fix crash (kde#12345, kde#678)"])
+
+    def test_record_cap(self):
+        for number in range(MAX_LOG_ENTRIES):
+            commit(self.repo, "Change {}".format(number))
+        entries = self.entries()
+        self.assertEqual(len(entries), MAX_LOG_ENTRIES)
+        self.assertEqual(entries[0],
+                         "  * Change {}".format(MAX_LOG_ENTRIES - 1))
+
+        commit(self.repo, "One change too many")
+        self.assertEqual(self.entries(), ["- Too many changes to list here"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Tests of recording spans with instrument."""
+
+import argparse
+from pathlib import Path
+import tempfile
+import unittest
+
+import instrument
+from update_applications import update_packages
+
+
+class InstrumentTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        instrument.disable()
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(instrument.recorder())
+        with instrument.span("io", "nothing") as span:
+            span.bytes = 10
+        self.assertEqual(span.bytes, 0)
+
+    def test_enable_and_disable(self):
+        recorder = instrument.enable()
+        self.assertIs(instrument.recorder(), recorder)
+        with instrument.span("subprocess", "git log") as span:
+            span.bytes = 10
+        self.assertIs(span.recorder, recorder)
+        self.assertEqual(span.bytes, 10)
+
+        self.assertIs(instrument.disable(), recorder)
+        self.assertIsNone(instrument.recorder())
+        self.assertIsNone(instrument.disable())
+        with instrument.span("subprocess", "git log") as span:
+            pass
+        self.assertNotIsInstance(span, instrument.Span)
+
+    def test_command_name(self):
+        self.assertEqual(instrument.command_name(["/usr/bin/osc", "up"]),
+                         "osc up")
+        self.assertEqual(instrument.command_name("git -C foo log"), "git")
+        self.assertEqual(instrument.command_name([]), "")
+
+    def test_failed_update_stops_tracing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            trace = Path(directory) / "trace.json"
+            with self.assertRaises(OSError):
+                update_packages(argparse.ArgumentParser(), None, [
+                    "-p", directory, "--tarball-dir", directory,
+                    "-e", "me@example.org", "--trace", str(trace),
+                    str(Path(directory) / "missing-list")])
+
+        self.assertIsNone(instrument.recorder())
+
+
+if __name__ == "__main__":
+    unittest.main()
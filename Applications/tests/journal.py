@@ -0,0 +1,113 @@
+"""Tests of the update journal and of resuming package updates from it."""
+
+import io
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+
+from journal import UpdateJournal
+from oscpool import CheckoutPool
+from update_applications import UPDATE_STAGES, PackageUpdate
+
+
+class UpdateJournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = Path(self.directory.name) / "journal"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_reopen(self):
+        with UpdateJournal(self.filename) as journal:
+            journal.record("kate", "19.08.1", "checkout")
+            journal.record("kate", "19.08.1", "spec",
+                           {"current_version": "19.08.0"})
+            self.assertTrue(journal.is_done("kate", "19.08.1", "spec"))
+
+        with UpdateJournal(self.filename) as journal:
+            self.assertEqual(journal.completed("kate", "19.08.1"), {
+                "checkout": {}, "spec": {"current_version": "19.08.0"}})
+            self.assertEqual(journal.completed("kate", "19.08.2"), {})
+            self.assertFalse(journal.is_done("kate", "19.08.1", "post"))
+
+    def test_truncated_line(self):
+        with UpdateJournal(self.filename) as journal:
+            journal.record("kate", "19.08.1", "checkout")
+        with open(str(self.filename), "a") as handle:
+            handle.write('{"package": "kate", "version": "19.08.1", "sta')
+
+        with UpdateJournal(self.filename) as journal:
+            journal.record("kate", "19.08.1", "tarball")
+        with UpdateJournal(self.filename) as journal:
+            self.assertEqual(sorted(journal.completed("kate", "19.08.1")),
+                             ["checkout", "tarball"])
+
+    def test_close_twice(self):
+        journal = UpdateJournal(self.filename)
+        journal.close()
+        journal.close()
+
+
+class ResumeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = Path(self.directory.name)
+        self.project = path / "project"
+        self.tarballs = path / "tarballs"
+        for directory in (self.project / "kate", self.project / "okular",
+                          self.tarballs):
+            directory.mkdir(parents=True)
+        self.journal = UpdateJournal(path / "journal")
+        self.calls = list()
+        self.checkouts = CheckoutPool(
+            self.project, lambda command, **kwargs: self.calls.append(command))
+
+    def tearDown(self):
+        self.journal.close()
+        self.directory.cleanup()
+
+    def update(self, name):
+
+        return PackageUpdate(name, "19.08.1", self.tarballs, self.project,
+                             "me@example.org", output=io.StringIO(),
+                             checkouts=self.checkouts, journal=self.journal)
+
+    def test_completed_package_skipped(self):
+        for stage in UPDATE_STAGES:
+            self.journal.record("kate", "19.08.1", stage)
+        update = self.update("kate")
+
+        self.assertFalse(update.run())
+        self.assertIn("kate already updated to 19.08.1",
+                      update.output.getvalue())
+        self.assertEqual(self.calls, [])
+
+    @mock.patch("update_applications.record_changes")
+    def test_resume_after_completed_stages(self, record_changes):
+        for stage in ("checkout", "tarball"):
+            self.journal.record("okular", "19.08.1", stage)
+        self.journal.record("okular", "19.08.1", "spec",
+                            {"current_version": "19.08.0"})
+        update = self.update("okular")
+
+        self.assertTrue(update.run())
+        # Nothing checked out, no tarball needed, and the version the spec
+        # had before is taken from the journal
+        self.assertEqual(self.calls, [])
+        self.assertEqual(update.current_version, "19.08.0")
+        self.assertEqual(record_changes.call_args[0][:4],
+                         ("okular", None, "19.08.0", "19.08.1"))
+        self.assertEqual(sorted(self.journal.completed("okular", "19.08.1")),
+                         sorted(UPDATE_STAGES))
+
+        # A second run skips the package
+        self.assertFalse(self.update("okular").run())
+        self.assertEqual(record_changes.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+"""Tests of the RPM macro expansion of pyrpm."""
+
+import unittest
+
+from pyrpm.macros import MacroCycleError, MacroExpander
+from pyrpm.spec import Spec, replace_macros
+
+
+class MacroExpanderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.expander = MacroExpander(
+            {"name": "foo", "version": "1.2", "_tar_path": "%{version}",
+             "source": "https://example.org/%{name}/%{name}-%version.tar.xz",
+             "empty": ""},
+            {"_bindir": "/usr/bin"})
+
+    def test_plain(self):
+        expand = self.expander.expand
+        self.assertEqual(expand("%{name}-%{_tar_path}.tar.xz"),
+                         "foo-1.2.tar.xz")
+        self.assertEqual(expand("%name-%version"), "foo-1.2")
+        self.assertEqual(expand("%{_bindir}/foo"), "/usr/bin/foo")
+        self.assertEqual(expand("100%%"), "100%")
+        self.assertEqual(expand("no macros"), "no macros")
+
+    def test_undefined_left_alone(self):
+        expand = self.expander.expand
+        self.assertEqual(expand("%{undefined}-%undefined"),
+                         "%{undefined}-%undefined")
+        self.assertEqual(expand("%(echo foo) %[1 + 1] %{name"),
+                         "%(echo foo) %[1 + 1] %{name")
+
+    def test_conditionals(self):
+        expand = self.expander.expand
+        self.assertEqual(expand("%{?name}"), "foo")
+        self.assertEqual(expand("%{?beta}"), "")
+        self.assertEqual(expand("%{!?name}"), "")
+        self.assertEqual(expand("%{?name:-%{version}}"), "-1.2")
+        self.assertEqual(expand("%{?beta:-beta}"), "")
+        self.assertEqual(expand("%{!?beta:stable}"), "stable")
+        self.assertEqual(expand("%{!?name:stable}"), "")
+        self.assertEqual(expand("%{?!beta:stable}"), "stable")
+        self.assertEqual(expand("%{?empty:set}"), "set")
+        self.assertEqual(expand("%{?_bindir:%{_bindir}/foo}"), "/usr/bin/foo")
+
+    def test_builtins(self):
+        expand = self.expander.expand
+        self.assertEqual(expand("%{basename:%{source}}"), "foo-1.2.tar.xz")
+        self.assertEqual(expand("%{dirname:%{source}}"),
+                         "https://example.org/foo")
+        self.assertEqual(expand("%{suffix:%{source}}"), "xz")
+        self.assertEqual(expand("%{suffix:/usr/bin}"), "")
+        self.assertEqual(expand("%{upper:%{name}}-%{lower:ABC}"), "FOO-abc")
+
+        # A macro of the same name takes precedence
+        expander = MacroExpander({"basename": "mine"})
+        self.assertEqual(expander.expand("%{basename}"), "mine")
+
+    def test_memoization(self):
+        self.assertEqual(self.expander.value("source"),
+                         "https://example.org/foo/foo-1.2.tar.xz")
+        self.assertIn("version", self.expander._values)
+        self.expander.expand("%{name}-%{version}")
+        self.assertIn("%{name}-%{version}", self.expander._strings)
+
+        # Values are expanded once per expander
+        self.expander.macros["version"] = "2.0"
+        self.assertEqual(self.expander.expand("%{version}"), "1.2")
+        self.assertEqual(MacroExpander(self.expander.macros).expand(
+            "%{version}"), "2.0")
+
+    def test_cycles(self):
+        expander = MacroExpander({"a": "%{b}", "b": "x%{c}", "c": "%{a}",
+                                  "self": "%self", "ok": "%{c}"})
+        with self.assertRaises(MacroCycleError) as context:
+            expander.expand("%{a}")
+        self.assertEqual(context.exception.names, ["a", "b", "c", "a"])
+        self.assertRaises(MacroCycleError, expander.expand, "%{self}")
+        self.assertRaises(MacroCycleError, expander.value, "ok")
+        self.assertIsInstance(context.exception, ValueError)
+
+        # Nothing partial was memoized
+        self.assertEqual(expander._strings, {})
+        self.assertEqual(expander._values, {})
+
+
+class SpecMacrosTestCase(unittest.TestCase):
+
+    def spec(self, *lines):
+
+        return Spec.from_lines(["Name: foo\n", "Version: 1.2\n"] +
+                               [line + "\n" for line in lines])
+
+    def test_defines(self):
+        spec = self.spec("%define rname foo-bar",
+                         "%global tarname %{rname}-%{version}",
+                         "%define with_options(a:) ignored",
+                         "%define gone 1", "%undefine gone")
+        self.assertEqual(spec.macros, {"rname": "foo-bar",
+                                       "tarname": "%{rname}-%{version}",
+                                       "with_options": "ignored"})
+        self.assertEqual(replace_macros("%{tarname}.tar.xz", spec),
+                         "foo-bar-1.2.tar.xz")
+        self.assertEqual(replace_macros("%{tarname}", spec, version="2.0"),
+                         "foo-bar-2.0")
+
+    def test_conditional_defines(self):
+        spec = self.spec("%define set 1",
+                         "%{!?unset: %define default %{version}}",
+                         "%{!?set: %define not_made 1}",
+                         "%{?set: %global made 1}",
+                         "%{?unset:%global not_made 1}",
+                         "%{?version:%define from_tag 1}",
+                         "%{!?unset: %{?other}}")
+        self.assertEqual(spec.macros, {"set": "1", "default": "%{version}",
+                                       "made": "1", "from_tag": "1"})
+        self.assertEqual(replace_macros("%{default}", spec), "1.2")
+
+    def test_cycle(self):
+        spec = self.spec("%define a %{b}", "%define b %{a}")
+        self.assertRaises(MacroCycleError, replace_macros, "%{a}", spec)
+
+
+if __name__ == "__main__":
+    unittest.main()
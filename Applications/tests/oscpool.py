@@ -0,0 +1,111 @@
+"""Tests of CheckoutPool with a stub osc runner."""
+
+from pathlib import Path
+import subprocess
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from oscpool import CheckoutPool
+
+
+class StubRunner:
+    """Fails the first failures calls for each package, and records the
+    commands run and how many ran at once."""
+
+    def __init__(self, failures=0, duration=0):
+        self.failures = failures
+        self.duration = duration
+        self.calls = list()
+        self.running = 0
+        self.most_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, command, cwd=None, output=None):
+
+        with self._lock:
+            self.calls.append((command, Path(cwd)))
+            attempts = len(self.calls)
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        try:
+            if self.duration:
+                # Not time.sleep(), which the tests replace
+                threading.Event().wait(self.duration)
+            if attempts <= self.failures:
+                raise subprocess.CalledProcessError(1, command)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+class CheckoutPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.project = Path(self.directory.name)
+        (self.project / "existing").mkdir()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_commands(self):
+        runner = StubRunner()
+        pool = CheckoutPool(self.project, runner, osc="fake-osc")
+        pool.checkout("existing")
+        pool.checkout("new")
+        self.assertEqual(runner.calls, [
+            (["fake-osc", "up"], self.project / "existing"),
+            (["fake-osc", "co", "new"], self.project)])
+
+        # Fresh packages are not checked out again
+        pool.checkout("new")
+        self.assertEqual(len(runner.calls), 2)
+
+    @mock.patch("oscpool.random.uniform", return_value=0.5)
+    @mock.patch("oscpool.time.sleep")
+    def test_retries_with_backoff(self, sleep, uniform):
+        runner = StubRunner(failures=3)
+        pool = CheckoutPool(self.project, runner, retries=3, backoff=2.0)
+        pool.checkout("existing")
+
+        self.assertEqual(len(runner.calls), 4)
+        self.assertEqual([call[0][0] for call in sleep.call_args_list],
+                         [2.5, 4.5, 8.5])
+        uniform.assert_called_with(0, 2.0)
+        self.assertTrue(pool.is_fresh("existing"))
+
+    @mock.patch("oscpool.time.sleep")
+    def test_retries_exhausted(self, sleep):
+        runner = StubRunner(failures=3)
+        pool = CheckoutPool(self.project, runner, retries=2)
+
+        self.assertRaises(subprocess.CalledProcessError, pool.checkout,
+                          "existing")
+        self.assertEqual(len(runner.calls), 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertFalse(pool.is_fresh("existing"))
+
+    def test_per_host_limit(self):
+        runner = StubRunner(duration=0.05)
+        pool = CheckoutPool(self.project, runner, jobs=8, per_host=2)
+        names = ["package{}".format(number) for number in range(8)]
+
+        self.assertEqual(pool.prefetch(names), [])
+        self.assertEqual(len(runner.calls), 8)
+        self.assertEqual(runner.most_running, 2)
+        self.assertTrue(all(pool.is_fresh(name) for name in names))
+
+    @mock.patch("oscpool.time.sleep")
+    def test_prefetch_failures(self, sleep):
+        runner = StubRunner(failures=2)
+        pool = CheckoutPool(self.project, runner, jobs=1, retries=0)
+
+        self.assertEqual(sorted(pool.prefetch(["a", "b", "c"])), ["a", "b"])
+        self.assertFalse(pool.is_fresh("a"))
+        self.assertTrue(pool.is_fresh("c"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""Tests of running package updates concurrently with process_packages."""
+
+import io
+import threading
+import unittest
+from unittest import mock
+
+from update_applications import process_packages
+
+PACKAGES = ["kate", "konsole", "okular", "dolphin"]
+
+# With three jobs, the first three packages run at once
+FINISH_ORDER = ["okular", "konsole", "kate", "dolphin"]
+
+
+class StubUpdate:
+    """Updates packages by printing a few lines, finishing them in
+    FINISH_ORDER; raises for the names in failing."""
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.finished = list()
+        self.threads = set()
+        self.running = 0
+        self.most_running = 0
+        self.lock = threading.Lock()
+        self.events = {name: threading.Event() for name in PACKAGES}
+        self.events[FINISH_ORDER[0]].set()
+
+    def __call__(self, name, output=None):
+
+        with self.lock:
+            self.threads.add(threading.current_thread())
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        try:
+            print("{}: start".format(name), file=output)
+            self.events[name].wait(5)
+            print("{}: done".format(name), file=output)
+            if name in self.failing:
+                raise RuntimeError(name)
+            return name != "okular"
+        finally:
+            with self.lock:
+                self.finished.append(name)
+                self.running -= 1
+            index = FINISH_ORDER.index(name)
+            if index + 1 < len(FINISH_ORDER):
+                self.events[FINISH_ORDER[index + 1]].set()
+
+
+class ProcessPackagesTestCase(unittest.TestCase):
+
+    def run_packages(self, update, jobs):
+
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            try:
+                return process_packages(PACKAGES, update, jobs)
+            finally:
+                self.output = stdout.getvalue()
+
+    def expected_output(self):
+
+        return "".join("{0}: start\n{0}: done\n".format(name)
+                       for name in PACKAGES)
+
+    def test_parallel(self):
+        update = StubUpdate()
+        results = self.run_packages(update, 3)
+
+        self.assertEqual(results, {"updated": 3, "failedskipped": 1})
+        self.assertEqual(update.finished, FINISH_ORDER)
+        self.assertEqual(update.most_running, 3)
+        # Unmixed, in the order of submission
+        self.assertEqual(self.output, self.expected_output())
+
+    def test_exception(self):
+        update = StubUpdate(failing=("okular",))
+        with self.assertRaisesRegex(RuntimeError, "okular"):
+            self.run_packages(update, 3)
+
+        # The packages after the failed one were still updated
+        self.assertEqual(update.finished, FINISH_ORDER)
+        self.assertEqual(self.output, self.expected_output())
+
+    def test_serial(self):
+        update = StubUpdate()
+        for event in update.events.values():
+            event.set()
+        results = self.run_packages(update, 1)
+
+        self.assertEqual(results, {"updated": 3, "failedskipped": 1})
+        self.assertEqual(update.finished, PACKAGES)
+        self.assertEqual(update.threads, {threading.main_thread()})
+        self.assertEqual(update.most_running, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,311 @@
+"""Tests of the spec parser of pyrpm, also against the regex parser it
+replaced (kept as the baseline of benchmarks/bench_spec_parser.py)."""
+
+import os
+import tempfile
+import unittest
+
+from benchmarks.bench_spec_parser import (legacy_parse, parse_lines,
+                                          synthetic_spec)
+from pyrpm import spec as pyrpm_spec
+from pyrpm.spec import Spec
+
+SPEC = """\
+#
+# spec file for package foo
+#
+%define _tar_path 19.08
+%define configure_options \\
+    -DBUILD_TESTING=OFF \\
+    -DKDE_INSTALL_USE_QT_SYS_PATHS=ON
+Name:           foo
+Version:        19.08.1
+Release:        0
+Epoch:          1
+Summary:        A test package
+License:        GPL-2.0-or-later AND LGPL-2.1-or-later
+Group:          System/GUI/KDE
+URL:            https://www.kde.org
+Source:         https://download.kde.org/%{name}-%{version}.tar.xz
+Source1:        baselibs.conf
+Patch:          fix-build.patch
+Patch12:        0001-Fix-crash.patch
+BuildRequires:  cmake >= 3.0
+%if 0%{?suse_version} > 1500
+BuildRequires:  cmake(Qt5Core) >= 5.12
+%else
+BuildRequires:  libqt5-qtbase-devel
+%endif
+Requires:       kf5-filesystem
+
+%description
+A package used in tests.
+
+%package devel
+Summary:        Development files of foo
+Requires:       %{name} = %{version}
+
+%description devel
+Development files.
+
+%package -n libfoo5
+Summary:        The foo library
+License:        LGPL-2.1-or-later
+
+%description -n libfoo5
+The library.
+
+%prep
+%setup -q
+%patch0 -p1
+
+%build
+%cmake_kf5 -d build -- %{configure_options}
+%make_jobs
+
+%files
+%license COPYING
+
+%files devel
+%{_kf5_includedir}/
+
+%files -n libfoo5
+%{_kf5_libdir}/libfoo.so.*
+
+%changelog
+"""
+
+# Attributes set by both parsers
+ATTRIBUTES = ("name", "version", "release", "epoch", "summary", "license",
+              "group", "url", "sources", "patches", "build_requires",
+              "requires")
+
+
+def parse_file(text):
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "foo.spec")
+        with open(filename, "w", encoding="utf-8") as handle:
+            handle.write(text)
+        return Spec.from_file(filename)
+
+
+def attributes(obj):
+
+    return {name: getattr(obj, name) for name in ATTRIBUTES
+            if hasattr(obj, name)}
+
+
+class ParserTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.spec = parse_file(SPEC)
+
+    def test_tags(self):
+        spec = self.spec
+        self.assertEqual(spec.name, "foo")
+        self.assertEqual(spec.version, "19.08.1")
+        self.assertEqual(spec.release, "0")
+        self.assertEqual(spec.epoch, 1)
+        self.assertEqual(spec.summary, "A test package")
+        self.assertEqual(spec.license,
+                         "GPL-2.0-or-later AND LGPL-2.1-or-later")
+        self.assertEqual(spec.url, "https://www.kde.org")
+        self.assertEqual(spec.sources, [
+            "https://download.kde.org/%{name}-%{version}.tar.xz",
+            "baselibs.conf"])
+        self.assertEqual(spec.patches, ["fix-build.patch",
+                                        "0001-Fix-crash.patch"])
+        self.assertEqual(spec.requires, ["kf5-filesystem"])
+
+    def test_conditionals(self):
+        # Both branches are read, rpm would pick one of them
+        self.assertEqual(self.spec.build_requires, [
+            "cmake >= 3.0", "cmake(Qt5Core) >= 5.12",
+            "libqt5-qtbase-devel"])
+
+    def test_multi_line_define(self):
+        # Continuation lines are neither tags nor the end of the preamble
+        self.assertEqual(self.spec.name, "foo")
+        self.assertFalse(hasattr(self.spec, "configure_options"))
+        self.assertEqual(len(self.spec.build_requires), 3)
+
+    def test_subpackages(self):
+        spec = self.spec
+        self.assertEqual([package.name for package in spec.packages],
+                         ["foo", "foo-devel", "libfoo5"])
+        self.assertEqual([package.is_subpackage for package in spec.packages],
+                         [False, True, True])
+        packages = spec.packages_dict
+        self.assertEqual(packages["foo-devel"].summary,
+                         "Development files of foo")
+        self.assertEqual(packages["foo-devel"].requires,
+                         ["%{name} = %{version}"])
+        self.assertEqual(packages["libfoo5"].license, "LGPL-2.1-or-later")
+        # Subpackage tags do not override those of the main package
+        self.assertEqual(spec.summary, "A test package")
+
+    def test_body_sections(self):
+        spec = parse_file(SPEC.replace(
+            "A package used in tests.\n",
+            "A package used in tests.\nVersion: 2.0\nSource2: not.tar\n"))
+        self.assertEqual(spec.version, "19.08.1")
+        self.assertEqual(len(spec.sources), 2)
+
+    def test_crlf(self):
+        spec = parse_file(SPEC.replace("\n", "\r\n"))
+        self.assertEqual(attributes(spec), attributes(self.spec))
+
+    def test_replace_macros(self):
+        self.assertEqual(pyrpm_spec.replace_macros(self.spec.sources[0],
+                                                   self.spec),
+                         "https://download.kde.org/foo-19.08.1.tar.xz")
+
+
+class SectionsTestCase(unittest.TestCase):
+    """Sections are located while parsing and read from the file later."""
+
+    TEXT = """\
+Name:           foo
+Version:        1.0
+Summary:        Foo
+
+%description
+Foo, with a caf\u00e9 in its description.
+
+%package -n libfoo5
+Summary:        The foo library
+
+%description -n libfoo5
+The library.
+
+%prep
+%setup -q
+
+%post -n libfoo5 -p /sbin/ldconfig
+
+%post
+touch /var/lib/foo
+
+%files
+%license COPYING
+%doc README.md
+%{_bindir}/foo
+
+%files -n libfoo5 -f foo.lang
+%defattr(-,root,root)
+%dir %{_libdir}/foo
+%{_libdir}/libfoo.so.*
+"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "foo.spec")
+        self.write(self.TEXT)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, text, newline="\n"):
+
+        with open(self.filename, "w", encoding="utf-8",
+                  newline=newline) as handle:
+            handle.write(text)
+
+    def test_sections(self):
+        spec = Spec.from_file(self.filename)
+        self.assertEqual(
+            [(section.directive, section.package)
+             for section in spec.sections],
+            [("%description", "foo"), ("%package", "libfoo5"),
+             ("%description", "libfoo5"), ("%prep", "foo"),
+             ("%post", "libfoo5"), ("%post", "foo"), ("%files", "foo"),
+             ("%files", "libfoo5")])
+        self.assertEqual(spec.sections[-1].end,
+                         len(self.TEXT.encode("utf-8")))
+        self.assertFalse(hasattr(spec, "_text"))
+
+    def test_descriptions(self):
+        for newline in ("\n", "\r\n"):
+            self.write(self.TEXT, newline)
+            spec = Spec.from_file(self.filename)
+            self.assertEqual(sorted(spec.descriptions), ["foo", "libfoo5"])
+            self.assertEqual(spec.descriptions["foo"],
+                             "Foo, with a caf\u00e9 in its description.")
+            self.assertEqual(spec.descriptions["libfoo5"], "The library.")
+
+    def test_files(self):
+        spec = Spec.from_file(self.filename)
+        files = spec.files["foo"]
+        self.assertEqual([entry.path for entry in files],
+                         ["COPYING", "README.md", "%{_bindir}/foo"])
+        self.assertEqual(files[1].directives, ["%doc"])
+        self.assertEqual(files.filelists, [])
+
+        files = spec.files["libfoo5"]
+        self.assertEqual(files.filelists, ["foo.lang"])
+        self.assertEqual(files.defattr, "%defattr(-,root,root)")
+        self.assertEqual([entry.path for entry in files],
+                         ["%{_libdir}/foo", "%{_libdir}/libfoo.so.*"])
+        self.assertTrue(files[0].is_dir)
+
+    def test_script(self):
+        spec = Spec.from_file(self.filename)
+        self.assertEqual(spec.script("%prep"), "%setup -q\n\n")
+        self.assertEqual(spec.script("%post"), "touch /var/lib/foo\n\n")
+        self.assertEqual(spec.script("%post", "libfoo5"), "\n")
+        self.assertEqual(spec.sections[4].arguments,
+                         ["-n", "libfoo5", "-p", "/sbin/ldconfig"])
+        self.assertIsNone(spec.script("%install"))
+
+    def test_changed_file(self):
+        spec = Spec.from_file(self.filename)
+        self.assertEqual(spec.descriptions["libfoo5"], "The library.")
+        self.write(self.TEXT.replace("The library.", "A library."))
+        with self.assertRaises(ValueError):
+            spec.script("%prep")
+        # Parsed sections are not read again
+        self.assertEqual(spec.descriptions["libfoo5"], "The library.")
+
+    def test_from_lines(self):
+        with open(self.filename, encoding="utf-8") as handle:
+            spec = Spec.from_lines(handle)
+        self.assertEqual(spec.summary, "Foo")
+        with self.assertRaises(ValueError):
+            spec.descriptions["foo"]
+        spec.filename = self.filename
+        self.assertEqual(spec.descriptions["libfoo5"], "The library.")
+
+
+class LegacyParserTestCase(unittest.TestCase):
+    """The dispatching parser gives the results of the old regex parser,
+    except for tag-like lines in body sections."""
+
+    def assert_same(self, lines):
+
+        legacy = parse_lines(legacy_parse, lines)
+        current = parse_lines(pyrpm_spec._parse, lines)
+        self.assertEqual(attributes(current), attributes(legacy))
+        self.assertEqual([package.name for package in current.packages],
+                         [package.name for package in legacy.packages])
+        for new, old in zip(current.packages, legacy.packages):
+            self.assertEqual(attributes(new), attributes(old))
+
+    def test_synthetic_spec(self):
+        self.assert_same(synthetic_spec())
+
+    def test_spec(self):
+        self.assert_same(SPEC.splitlines(True))
+
+    def test_tags_in_body(self):
+        lines = SPEC.replace("Development files.\n",
+                             "Development files.\nRequires: not a tag\n")
+        legacy = parse_lines(legacy_parse, lines.splitlines(True))
+        current = parse_lines(pyrpm_spec._parse, lines.splitlines(True))
+        self.assertEqual(legacy.packages[1].requires[-1], "not a tag")
+        self.assertEqual(current.packages[1].requires,
+                         ["%{name} = %{version}"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+"""Tests of syncing the patches of a package between two project
+checkouts."""
+
+import io
+from pathlib import Path
+import tempfile
+import unittest
+
+from update_applications import sync_package_patches, update_patches
+
+SPEC = """\
+Name:           foo
+Version:        19.08.0
+Release:        0
+Source:         foo-%{version}.tar.xz
+{patches}
+%description
+Foo.
+
+%prep
+%setup -q
+{directives}
+%build
+"""
+
+
+def write_package(directory, patches):
+
+    directory.mkdir(parents=True)
+    tags = "".join("Patch{}:         {}\n".format(number, name)
+                   for number, name in enumerate(patches))
+    directives = "".join("%patch{} -p1\n".format(number)
+                         for number in range(len(patches)))
+    (directory / "foo.spec").write_text(
+        SPEC.replace("{patches}", tags).replace("{directives}", directives))
+    for name, text in patches.items():
+        (directory / name).write_text(text)
+
+
+class UpdatePatchesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.devel = Path(self.directory.name) / "devel" / "foo"
+        self.project = Path(self.directory.name) / "project" / "foo"
+        write_package(self.project, {"dropped.patch": "dropped\n",
+                                     "kept.patch": "kept\n",
+                                     "changed.patch": "old\n"})
+        write_package(self.devel, {"kept.patch": "kept\n",
+                                   "changed.patch": "new\n",
+                                   "added.patch": "added\n"})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_update_patches(self):
+        changes = update_patches(self.devel / "foo.spec",
+                                 self.project / "foo.spec")
+        self.assertEqual(changes.dropped, ["dropped.patch"])
+        self.assertEqual(changes.added, ["added.patch"])
+        self.assertEqual(changes.changed, ["changed.patch"])
+        self.assertEqual(changes.describe(), [
+            "- Dropped patches:", "  * dropped.patch",
+            "- Added patches:", "  * added.patch",
+            "- Updated patches:", "  * changed.patch"])
+
+        self.assertFalse((self.project / "dropped.patch").exists())
+        self.assertEqual((self.project / "changed.patch").read_text(),
+                         "new\n")
+        self.assertEqual((self.project / "added.patch").read_text(),
+                         "added\n")
+        spec = (self.project / "foo.spec").read_text()
+        self.assertNotIn("dropped.patch", spec)
+        self.assertNotIn("%patch0 ", spec)
+        self.assertIn("Patch3:         added.patch\n", spec)
+        self.assertIn("%patch3 -p1\n", spec)
+        self.assertEqual(
+            sorted(path.name for path in self.project.iterdir()),
+            ["added.patch", "changed.patch", "foo.spec", "kept.patch"])
+
+        # Nothing left to do
+        changes = update_patches(self.devel / "foo.spec",
+                                 self.project / "foo.spec")
+        self.assertFalse(changes)
+
+    def test_missing_patch_file(self):
+        (self.devel / "added.patch").unlink()
+        spec = (self.project / "foo.spec").read_text()
+        output = io.StringIO()
+
+        self.assertIsNone(update_patches(self.devel / "foo.spec",
+                                         self.project / "foo.spec", output))
+        self.assertIn("added.patch", output.getvalue())
+        self.assertEqual((self.project / "foo.spec").read_text(), spec)
+        self.assertTrue((self.project / "dropped.patch").exists())
+
+    def test_macro_cycle_skips_package(self):
+        specfile = self.devel / "foo.spec"
+        specfile.write_text("%define loop %{loop}\n" + specfile.read_text()
+                            .replace("added.patch", "%{loop}.patch"))
+        output = io.StringIO()
+
+        self.assertFalse(sync_package_patches(
+            "foo", self.devel.parent, self.project.parent, output))
+        self.assertIn("foo: recursive macro expansion", output.getvalue())
+        self.assertTrue((self.project / "dropped.patch").exists())
+
+    def test_patch_in_subdirectory_skips_package(self):
+        specfile = self.devel / "foo.spec"
+        specfile.write_text(specfile.read_text()
+                            .replace("added.patch", "patches/added.patch"))
+        (self.devel / "patches").mkdir()
+        (self.devel / "added.patch").rename(
+            self.devel / "patches" / "added.patch")
+        spec = (self.project / "foo.spec").read_text()
+        output = io.StringIO()
+
+        self.assertFalse(sync_package_patches(
+            "foo", self.devel.parent, self.project.parent, output))
+        self.assertIn("foo: Not a file name: 'patches/added.patch', "
+                      "skipping", output.getvalue())
+        self.assertEqual((self.project / "foo.spec").read_text(), spec)
+        self.assertEqual((self.project / "changed.patch").read_text(),
+                         "old\n")
+        self.assertEqual(
+            sorted(path.name for path in self.project.iterdir()),
+            ["changed.patch", "dropped.patch", "foo.spec", "kept.patch"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+"""Tests of the staged Pipeline, with trivial stage functions."""
+
+import io
+import threading
+import time
+import unittest
+
+from pipeline import Pipeline
+
+
+class Job:
+    """Records its stages in a log shared by all jobs."""
+
+    def __init__(self, number, log, fail_at=None, stop_at=None, delays=None):
+        self.number = number
+        self.log = log
+        self.fail_at = fail_at
+        self.stop_at = stop_at
+        self.delays = delays or {}
+
+    def _stage(self, stage):
+
+        time.sleep(self.delays.get(stage, 0))
+        self.log.append((stage, self.number))
+        if stage == self.fail_at:
+            raise RuntimeError("{} failed".format(self.number))
+        return stage != self.stop_at
+
+    def fetch(self):
+        return self._stage("fetch")
+
+    def build(self):
+        return self._stage("build")
+
+    def publish(self):
+        return self._stage("publish")
+
+
+STAGES = ("fetch", "build", "publish")
+
+
+class PipelineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.log = list()
+        self.done = list()
+
+    def on_done(self, job, result, error):
+
+        self.done.append((job.number, result, error))
+
+    def pipeline(self, limits=None, queue_size=8):
+
+        return Pipeline(STAGES, limits or dict.fromkeys(STAGES, 1),
+                        self.on_done, queue_size)
+
+    def test_stage_order(self):
+        self.pipeline(dict(fetch=3, build=2, publish=1)).run(
+            Job(number, self.log) for number in range(20))
+
+        for number in range(20):
+            self.assertEqual([stage for stage, job in self.log
+                              if job == number], list(STAGES))
+        self.assertEqual(sorted(self.done),
+                         [(number, True, None) for number in range(20)])
+
+    def test_serial_stages_keep_job_order(self):
+        self.pipeline().run(Job(number, self.log) for number in range(10))
+
+        for stage in STAGES:
+            self.assertEqual([job for name, job in self.log if name == stage],
+                             list(range(10)))
+        self.assertEqual([number for number, _, _ in self.done],
+                         list(range(10)))
+
+    def test_finish_early(self):
+        pipeline = self.pipeline()
+        pipeline.run(Job(number, self.log,
+                         stop_at="build" if number % 2 else None)
+                     for number in range(6))
+
+        self.assertEqual(sorted(self.done), [
+            (number, not number % 2, None) for number in range(6)])
+        self.assertNotIn(("publish", 1), self.log)
+        self.assertEqual(pipeline.stats["build"].processed, 6)
+        self.assertEqual(pipeline.stats["build"].finished_early, 3)
+        self.assertEqual(pipeline.stats["publish"].processed, 3)
+
+    def test_backpressure(self):
+        # A slow last stage holds up the faster ones before it
+        created = list()
+        lag = list()
+        lock = threading.Lock()
+
+        def jobs():
+            for number in range(30):
+                with lock:
+                    lag.append(len(created) - len([
+                        stage for stage, _ in self.log
+                        if stage == "publish"]))
+                created.append(number)
+                yield Job(number, self.log, delays={"publish": 0.005})
+
+        pipeline = self.pipeline(queue_size=2)
+        pipeline.run(jobs())
+
+        # At most one job per worker and two per queue are in flight
+        self.assertLessEqual(max(lag), 3 + 3 * 2)
+        self.assertEqual(len(self.done), 30)
+        for stage in STAGES:
+            stats = pipeline.stats[stage]
+            self.assertEqual(stats.processed, 30)
+            self.assertLessEqual(stats.max_depth, 2)
+        self.assertGreater(pipeline.stats["publish"].blocked_seconds, 0)
+        self.assertGreater(pipeline.stats["publish"].busy_seconds, 0.1)
+
+    def test_first_exception_aborts(self):
+        created = list()
+
+        def jobs():
+            for number in range(1000):
+                created.append(number)
+                yield Job(number, self.log, fail_at="build"
+                          if number == 3 else None,
+                          delays={"publish": 0.01})
+
+        with self.assertRaises(RuntimeError) as context:
+            self.pipeline(queue_size=2).run(jobs())
+
+        self.assertEqual(str(context.exception), "3 failed")
+        self.assertIn((3, False, context.exception), self.done)
+        self.assertLess(len(created), 20)
+        self.assertNotIn(("publish", 3), self.log)
+
+    def test_report(self):
+        pipeline = self.pipeline(dict(fetch=4, build=2, publish=1))
+        pipeline.run(Job(number, self.log) for number in range(5))
+        stream = io.StringIO()
+        pipeline.report(stream)
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[1].split()[:3], ["fetch", "5", "4"])
+        self.assertTrue(lines[3].endswith("/8"))
+
+
+if __name__ == "__main__":
+    unittest.main()
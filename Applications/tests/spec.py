@@ -0,0 +1,113 @@
+"""Tests of SpecDocument, editing spec files without reformatting them."""
+
+import os
+import tempfile
+import unittest
+
+from pyrpm.spec import SpecDocument
+
+SPEC = """\
+Name:           foo
+Version:        19.08.0
+Release:        0
+Summary:        Foo  # not a comment
+License:        GPL-2.0-or-later
+URL:            https://www.kde.org
+Source:         %{name}-%{version}.tar.xz
+Source1:        %{name}-%{version}.tar.xz.sig
+Patch:          fix-build.patch
+Patch1:         0001-Fix-crash.patch
+
+%description
+Foo.
+
+%prep
+%setup -q
+{directives}
+%build
+"""
+
+NUMBERED = "%patch -p1\n%patch1 -p1\n"
+OPTION = "%patch -P 0 -p1\n%patch -P 1 -p1\n"
+
+
+def document(directives=NUMBERED, newline="\n"):
+
+    text = SPEC.replace("{directives}", directives)
+    lines = text.replace("\n", newline).splitlines(True)
+    return SpecDocument(lines)
+
+
+class SpecDocumentTestCase(unittest.TestCase):
+
+    def test_round_trip(self):
+        for newline in ("\n", "\r\n"):
+            text = SPEC.replace("{directives}", NUMBERED).replace("\n",
+                                                                  newline)
+            with tempfile.TemporaryDirectory() as directory:
+                filename = os.path.join(directory, "foo.spec")
+                with open(filename, "w", newline="") as handle:
+                    handle.write(text)
+                SpecDocument.from_file(filename).write()
+                with open(filename, "rb") as handle:
+                    self.assertEqual(handle.read(), text.encode())
+
+    def test_set_tag(self):
+        spec = document()
+        spec.set_tag("Version", "19.08.1")
+        spec.set_tag("Summary", "Bar")
+        self.assertIn("Version:        19.08.1\n", spec.lines)
+        self.assertIn("Summary:        Bar\n", spec.lines)
+        self.assertEqual(spec.get_tag("Version"), "19.08.1")
+        self.assertRaises(KeyError, spec.set_tag, "Epoch", "1")
+
+    def test_set_source(self):
+        spec = document(newline="\r\n")
+        spec.set_source(0, "foo-1.tar.xz")
+        spec.set_source(1, "foo-1.tar.xz.sig")
+        self.assertEqual(spec.sources, [(0, "foo-1.tar.xz"),
+                                        (1, "foo-1.tar.xz.sig")])
+        self.assertIn("Source:         foo-1.tar.xz\r\n", spec.lines)
+        self.assertRaises(KeyError, spec.set_source, 2, "foo.asc")
+
+    def test_add_patch(self):
+        for directives, added in ((NUMBERED, "%patch2 -p1\n"),
+                                  (OPTION, "%patch -P 2 -p1\n"),
+                                  ("%patch -p1\n", "%patch -P 2 -p1\n")):
+            spec = document(directives)
+            self.assertEqual(spec.add_patch("new.patch"), 2)
+            self.assertEqual(spec.patches[-1], (2, "new.patch"))
+            self.assertIn("Patch2:         new.patch\n", spec.lines)
+            self.assertIn(added, spec.lines)
+            self.assertEqual(spec.lines.index(added),
+                             spec.lines.index("%build\n") - 2)
+
+    def test_add_patch_crlf(self):
+        spec = document(OPTION, newline="\r\n")
+        spec.add_patch("new.patch")
+        self.assertIn("Patch2:         new.patch\r\n", spec.lines)
+        self.assertIn("%patch -P 2 -p1\r\n", spec.lines)
+        self.assertTrue(all(line.endswith("\r\n") for line in spec.lines))
+
+    def test_remove_patch(self):
+        for directives in (NUMBERED, OPTION):
+            spec = document(directives)
+            self.assertEqual(spec.remove_patch("0001-Fix-crash.patch"), 1)
+            self.assertEqual(spec.patches, [(0, "fix-build.patch")])
+            self.assertEqual(str(spec).count("%patch"), 1)
+
+            # The unnumbered Patch is patch 0
+            self.assertEqual(spec.remove_patch(0), 0)
+            self.assertEqual(spec.patches, [])
+            self.assertNotIn("%patch", str(spec))
+            self.assertRaises(KeyError, spec.remove_patch, "fix-build.patch")
+
+    def test_remove_bare_patch(self):
+        spec = document("%patch\n%patch 1\n")
+        spec.remove_patch("fix-build.patch")
+        self.assertNotIn("%patch\n", spec.lines)
+        self.assertIn("%patch 1\n", spec.lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+"""Tests of the survey subcommand."""
+
+import argparse
+import io
+import json
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+
+from update_applications import survey
+
+
+class SurveyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.project = Path(self.directory.name) / "project"
+        (self.project / "foo").mkdir(parents=True)
+        (self.project / "foo" / "foo.spec").write_text(
+            "Name: foo\nVersion: 19.08.0\nRelease: 0\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def survey(self, *args):
+
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            survey(argparse.ArgumentParser(), None, ["-j", "1"] + list(args))
+        return stdout.getvalue()
+
+    def test_survey(self):
+        rows = json.loads(self.survey("-p", str(self.project)))
+        self.assertEqual([(row["package"], row["version"]) for row in rows],
+                         [("foo", "19.08.0")])
+
+    def test_missing_project_dir(self):
+        missing = self.project / "missing"
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+            with self.assertRaises(SystemExit) as context:
+                survey(argparse.ArgumentParser(), None, ["-p", str(missing)])
+        self.assertEqual(str(context.exception),
+                         "No such project directory: {}".format(missing))
+        self.assertEqual(stdout.getvalue(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,23 +1,43 @@
 #!/usr/bin/env python3
 
 import argparse
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from collections import Counter
-import fileinput
+import functools
+import io
+import json
 import os
 from pathlib import Path
 import re
-import shutil
+import sys
 import tempfile
+import threading
 import time
 import subprocess
 
-from arghandler import ArgumentHandler, subcmd
-from pyrpm.spec import Spec
+from arghandler import ArgumentHandler
+import changes
+from fileops import (DirectoryIndex, FileTransaction, directory_digests,
+                     file_digest, place_file, prepend_files, write_file)
+from gitindex import (CommitIndex, INDEX_FILENAME, RefIndex,
+                      find_repositories, parse_bugs, read_log_records)
+import instrument
+from journal import UpdateJournal
+from oscpool import CheckoutPool, read_file_list
+from pyrpm.spec import MacroCycleError, Spec, SpecDocument, replace_macros
+from subcommands import register_subcommands
 
 
 SPECIAL_CASES = ("kdelibs4", "kde-l10n")
-VERSION_RE = re.compile(r"(^Version:\s+).*")
+# Stages of a package update, see PackageUpdate
+UPDATE_STAGES = ("checkout", "tarball", "spec", "changelog", "post")
+# osc is network bound, tarballs are disk bound, changelogs need git
+DEFAULT_STAGE_JOBS = {"checkout": 4, "tarball": 2, "spec": 2,
+                      "changelog": 4, "post": 2}
+# Not taken over from the devel project: its sources come from git
+DEFAULT_SYNC_EXCLUDE = ("_service",)
+SURVEY_FIELDS = ("package", "spec", "name", "version", "release", "sources",
+                 "patches", "error")
 PATCH_RE = re.compile("(^Patch[0-9]{,}:).*")
 PROJECT_NAMES = {"plasma": "KDE:Frameworks5",
                  "frameworks": "KDE:Frameworks5",
@@ -26,6 +46,12 @@ BASE_URL = "https://www.kde.org/announcements/"
 URL_MAPPING = {"plasma": "plasma-{version_to}.php",
                "frameworks": "kde-frameworks-{version_to}.php",
                "applications": "announce-applications-{version_to}.php"}
+# Upstream branch a release is made from, used when its tag is not pushed yet
+STABLE_BRANCHES = {"plasma": "Plasma/{major_minor}",
+                   "applications": "Applications/{major_minor}"}
+
+MAX_LOG_ENTRIES = 30
+SILENT_MARKERS = ("GIT_SILENT", "SVN_SILENT")
 
 CHANGES_TEMPLATE = """
 -------------------------------------------------------------------
@@ -35,73 +61,125 @@ CHANGES_TEMPLATE = """
 """
 
 
-@contextmanager
-def cd(subpath):
-    old_path = Path.cwd()
-    os.chdir(old_path / subpath)
-    try:
-        yield
-    finally:
-        os.chdir(old_path)
+# Serializes the per-package output of concurrent runs
+_output_lock = threading.Lock()
+
+
+def run_command(command, cwd=None, output=None, shell=False, check=True):
+    """Run a command in cwd, sending its combined output to output.
+
+    Unlike os.chdir(), passing the working directory explicitly keeps this
+    safe to call from several threads at once.
+    """
+    with instrument.span("subprocess", instrument.command_name(command),
+                         cwd=cwd) as span:
+        process = subprocess.run(command,
+                                 cwd=None if cwd is None else str(cwd),
+                                 shell=shell, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT,
+                                 universal_newlines=True)
+        span.bytes = len(process.stdout or "")
+    if process.stdout:
+        print(process.stdout, end="", file=output)
+
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command,
+                                            process.stdout)
+
+    return process.returncode
 
 
-def format_log_entries(commit_from, commit_to):
+def format_log_entry(subject, bugs):
 
-    all_commits_cmd = ["git", "log", "--pretty=format:%H", "--no-merges",
-                       "{}..{}".format(commit_from, commit_to)]
+    bugs = ["kde#{}".format(bug) for bug in bugs]
+    entry = "  * {}".format(subject)
+    if bugs:
+        entry += " ({})".format(", ".join(bugs))
 
-    all_commits = subprocess.check_output(all_commits_cmd)
-    all_commits = all_commits.decode().split("\n")
+    return entry
 
-    if not all_commits:
-        return "  * None"
 
-    if len(all_commits) > 30:
-        return "- Too many changes to list here"
+def format_log_entries(commit_from, commit_to, cwd=None, commit_index=None):
 
-    for commit in all_commits:
-        entry = "  * {subject} {bugs}"
-        subject_cmd = ["git", "show", "-s", "--pretty=format:%s", commit]
-        subject = subprocess.check_output(subject_cmd).decode().strip()
+    # One more than the cap, to know whether the cap was exceeded
+    limit = MAX_LOG_ENTRIES + 1
+    commits = None
+    if commit_index is not None:
+        commits = commit_index.log_records(Path(cwd).name, commit_from,
+                                           commit_to, limit)
 
-        if "GIT_SILENT" in subject or "SVN_SILENT" in subject:
+    if commits is None:
+        revisions = ["--no-merges", "{}..{}".format(commit_from, commit_to)]
+        commits = [(commit, subject.strip(), parse_bugs(body))
+                   for commit, subject, body
+                   in read_log_records(revisions, cwd, limit)]
+
+    if not commits:
+        yield "  * None"
+        return
+
+    if len(commits) > MAX_LOG_ENTRIES:
+        yield "- Too many changes to list here"
+        return
+
+    for commit, subject, bugs in commits:
+        if any(marker in subject for marker in SILENT_MARKERS):
             continue
 
-        bug_content_cmd = ("git show {} | grep -E '^\s*BUG:' | "
-                           "cut -d: --fields=2 | sed 's/^/,kde#/'")
-        bug_content_cmd = bug_content_cmd.format(commit)
-        bug_content = subprocess.check_output(bug_content_cmd, shell=True)
-        bug_content = bug_content.decode()
+        yield format_log_entry(subject, bugs)
 
-        if not bug_content:
-            bug_content = ""
-        else:
-            bug_content = bug_content.replace(",", "").split("\n")
-            bug_content = ",".join(bug_content)
-            bug_content = "({})".format(bug_content)
 
-        entry = entry.format(subject=subject, bugs=bug_content).rstrip()
+def missing_entries(destination, version_to):
+    """Return the .changes files of destination whose newest entries do not
+    record the update to version_to yet.
 
-        yield entry
+    Only the head of each file is read, see changes.iter_entries().
+    """
+    if isinstance(destination, (str, Path)):
+        destination = [destination]
 
+    return [filename for filename in destination
+            if changes.last_version(filename) != version_to]
 
-def create_dummy_changes_entry(version_to, destination, kind):
+
+def format_dummy_changes_entry(version_to, kind):
 
     contents = "  * Update to {}".format(version_to)
     date = time.strftime("%a %d %b %H.%M.%S %Z %Y")
     url = BASE_URL + URL_MAPPING[kind].format(version_to=version_to)
     committer = ""
-    changes_entry = CHANGES_TEMPLATE.format(date=date, contents=contents,
-                                            committer=committer)
-    with fileinput.input(destination, inplace=True) as f:
-        for line in f:
-            if f.isfirstline():
-                print(changes_entry)
-            print(line.strip())
+    changes_entry = CHANGES_TEMPLATE.lstrip()
+    changes_entry = changes_entry.format(date=date, contents=contents,
+                                         committer=committer)
 
+    return changes_entry
 
-def create_changes_entry(repo_name, commit_from, commit_to, version_from,
-                         version_to, changetype, kind, destination, committer):
+
+def create_dummy_changes_entry(version_to, destination, kind):
+
+    # An interrupted earlier run may have written the entry already
+    destination = missing_entries(destination, version_to)
+    if not destination:
+        return
+
+    prepend_entry(destination, format_dummy_changes_entry(version_to, kind))
+
+
+def prepend_entry(destination, entry):
+
+    # destination is one .changes file or all of those of a package
+    if isinstance(destination, (str, Path)):
+        destination = [destination]
+
+    with instrument.span("io", "prepend changes") as span:
+        prepend_files(destination, entry + "\n")
+        span.bytes = sum(os.path.getsize(str(filename))
+                         for filename in destination)
+
+
+def format_changes_entry(repo_name, commit_from, commit_to, version_from,
+                         version_to, changetype, kind, committer, cwd=None,
+                         commit_index=None):
 
     url = BASE_URL + URL_MAPPING[kind].format(version_to=version_to)
 
@@ -112,7 +190,8 @@ def create_changes_entry(repo_name, commit_from, commit_to, version_from,
     contents.append("  * {}".format(url))
     contents.append("- Changes since {}:".format(version_from))
 
-    for entry in format_log_entries(commit_from, commit_to):
+    for entry in format_log_entries(commit_from, commit_to, cwd,
+                                    commit_index):
         contents.append(entry)
 
     contents = "\n".join(contents)
@@ -121,11 +200,20 @@ def create_changes_entry(repo_name, commit_from, commit_to, version_from,
     changes_entry = changes_entry.format(date=date, contents=contents,
                                          committer=committer)
 
-    with fileinput.input(destination, inplace=True) as f:
-        for line in f:
-            if f.isfirstline():
-                print(changes_entry)
-            print(line.rstrip())
+    return changes_entry
+
+
+def create_changes_entry(repo_name, commit_from, commit_to, version_from,
+                         version_to, changetype, kind, destination, committer,
+                         cwd=None, commit_index=None):
+
+    destination = missing_entries(destination, version_to)
+    if not destination:
+        return
+
+    prepend_entry(destination, format_changes_entry(
+        repo_name, commit_from, commit_to, version_from, version_to,
+        changetype, kind, committer, cwd, commit_index))
 
 
 def get_current_version(specfile: Path):
@@ -136,84 +224,529 @@ def get_current_version(specfile: Path):
     return version, patches
 
 
-def update_patches(specfile_source, specfile_destination):
-    pass
+def guess_tarball_name(package_name, version_to, obs_directory):
+    """Return the tarball name from the spec of package_name in the project
+    checkout obs_directory, or the usual name-version.tar.xz."""
 
+    specfile = Path(obs_directory).expanduser() / package_name / (
+        package_name + ".spec")
 
-def update_from_develproject(source_project, destination_project):
-    pass
+    return (specfile.exists() and
+            tarball_name_from_spec(specfile, version_to) or
+            "{name}-{version_to}.tar.xz".format(name=package_name,
+                                                version_to=version_to))
 
 
-def update_package(package_name, version_to, tarball_directory, obs_directory,
-                   committer, kind="applications", changetype="bugfix",
-                   checkout_dir=None):
+def upstream_repo_name(tarball_name, version_to, package_name):
 
-    tarball_directory = Path(tarball_directory).expanduser()
-    tarball_name = "{name}-{version_to}.tar.xz".format(name=package_name,
-                                                       version_to=version_to)
-    project_name = PROJECT_NAMES[kind]
+    # We can safely ignore "problems" with kde-l10n as they're still in SVN
+    return tarball_name.partition("-" + version_to)[0] or package_name
 
-    done_subdir = Path(tarball_directory) / "done"
-    done_subdir.mkdir(exist_ok=True)
 
-    if (done_subdir / tarball_name).exists():
-        print("Tarball {} already processed, skipping".format(tarball_name))
-        return False
+def tarball_name_from_spec(specfile: Path, version_to):
+    """Return the file name the first Source of specfile will have for
+    version_to, or None if the spec does not tell."""
 
-    obs_directory = Path(obs_directory).expanduser() / package_name
-    checkout_package(obs_directory)
+    try:
+        spec = Spec.from_file(str(specfile))
+    except OSError:
+        return None
 
-    tarball_path = tarball_directory / tarball_name
-    destination_path = obs_directory / tarball_name
+    sources = getattr(spec, "sources", None)
+    if not sources:
+        return None
 
-    # We can safely ignore "problems" with kde-l10n as they're still in SVN
-    upstream_reponame = tarball_name.replace("-{}.tar.xz".format(version_to),
-                                             "")
+    try:
+        source = replace_macros(sources[0], spec, version=version_to)
+    except MacroCycleError:
+        return None
+
+    # "url#/name" downloads url and stores it as name
+    name = source.rpartition("#/")[2].rpartition("/")[2]
+    if "%" in name or version_to not in name:
+        return None
+
+    return name
+
+
+class PatchChanges:
+    """How the patches of a spec differ from those of a newer one.
+
+    dropped and added are patch names only in the old or the new spec,
+    changed are patches of both whose files differ, missing are patches of
+    the new spec without a file.
+    """
+
+    def __init__(self, dropped, added, changed, missing):
+        self.dropped = dropped
+        self.added = added
+        self.changed = changed
+        self.missing = missing
+
+    def __bool__(self):
+        return bool(self.dropped or self.added or self.changed)
+
+    def describe(self):
+        """Return the changes as lines of the report sync_patches prints."""
+        lines = list()
+        for heading, names in (("Dropped patches:", self.dropped),
+                               ("Added patches:", self.added),
+                               ("Updated patches:", self.changed)):
+            if names:
+                lines.append("- " + heading)
+                lines.extend("  * " + name for name in names)
+
+        return lines
+
+
+def spec_patches(spec):
+    """Return the patches of spec as {file name: name as written}."""
+    return {replace_macros(patch, spec): patch
+            for patch in getattr(spec, "patches", [])}
+
+
+def compare_patches(old_patches, new_patches, old_directory, new_directory):
+    """Compare two spec_patches() results, and the patch files in both
+    directories by their SHA-256."""
+
+    dropped = [name for name in old_patches if name not in new_patches]
+    added = list()
+    changed = list()
+    missing = list()
+    for name in new_patches:
+        digest = file_digest(Path(new_directory) / name)
+        if digest is None:
+            missing.append(name)
+        elif name not in old_patches:
+            added.append(name)
+        elif digest != file_digest(Path(old_directory) / name):
+            changed.append(name)
+
+    return PatchChanges(dropped, added, changed, missing)
+
+
+def update_patches(specfile_source, specfile_destination, output=None):
+    """Bring the patches of specfile_destination in line with those of
+    specfile_source.
+
+    Patch files are copied from and removed like in the directory of
+    specfile_source, and Patch tags and %patch lines added to or removed
+    from specfile_destination, in one FileTransaction. Returns the
+    PatchChanges, or None if patch files of specfile_source are missing.
+    Raises MacroCycleError if a patch name cannot be expanded, and
+    ValueError if it is not a plain file name.
+    """
+    specfile_source = Path(specfile_source)
+    specfile_destination = Path(specfile_destination)
+    source_directory = specfile_source.parent
+    destination_directory = specfile_destination.parent
+
+    old_patches = spec_patches(Spec.from_file(str(specfile_destination)))
+    new_patches = spec_patches(Spec.from_file(str(specfile_source)))
+    patch_changes = compare_patches(old_patches, new_patches,
+                                    destination_directory, source_directory)
+
+    if patch_changes.missing:
+        print("Patches missing in {}: {}".format(
+            source_directory, ", ".join(patch_changes.missing)), file=output)
+        return None
+
+    if not patch_changes:
+        return patch_changes
+
+    document = SpecDocument.from_file(str(specfile_destination))
+    for name in patch_changes.dropped:
+        document.remove_patch(old_patches[name])
+    for name in patch_changes.added:
+        document.add_patch(name)
+
+    with FileTransaction(destination_directory) as transaction:
+        for name in patch_changes.added + patch_changes.changed:
+            transaction.copy(source_directory / name, name)
+        for name in patch_changes.dropped:
+            transaction.remove(name)
+        transaction.write(specfile_destination.name, str(document))
+
+    return patch_changes
+
+
+def sync_package_patches(package_name, source_project, destination_project,
+                         output=None):
+    """Sync the patches of a package; returns False if it was skipped."""
+    specfiles = [Path(project).expanduser() / package_name /
+                 (package_name + ".spec")
+                 for project in (source_project, destination_project)]
+    for specfile in specfiles:
+        if not specfile.exists():
+            print("{} missing, skipping".format(specfile), file=output)
+            return False
 
-    if not tarball_path.exists():
-        print("Tarball {} missing, skipping".format(tarball_name))
+    try:
+        patch_changes = update_patches(specfiles[0], specfiles[1], output)
+    except (MacroCycleError, ValueError) as error:
+        print("{}: {}, skipping".format(package_name, error), file=output)
+        return False
+    if patch_changes is None:
         return False
 
-    shutil.copy(str(tarball_path), str(destination_path))
-    tarball_path.rename(done_subdir / tarball_name)
+    if patch_changes:
+        print("Patches of {}:".format(package_name), file=output)
+        print("\n".join(patch_changes.describe()), file=output)
+    else:
+        print("Patches of {} unchanged".format(package_name), file=output)
+
+    return True
+
 
-    with cd(obs_directory):
-        specfile = package_name + ".spec"
-        current_version, patches = get_current_version(specfile)
-        update_version(specfile, version_to, patches)
-        changes_file = str(obs_directory / (package_name + ".changes"))
-        record_changes(package_name, checkout_dir, current_version,
-                       version_to, upstream_reponame, changetype,
-                       kind, changes_file, committer)
-        if "kde-l10n" in package_name:
-            subprocess.call("pre_checkin.sh", shell=True)
+def sync_package_files(package_name, source_project, destination_project,
+                       exclude=DEFAULT_SYNC_EXCLUDE, output=None, osc="osc"):
+    """Make a package checkout of destination_project match the same
+    package in source_project, copying only the files that differ.
+
+    Files are compared by MD5. For files osc checked out and nobody touched
+    since, the MD5 recorded in .osc/_files is used, so that only changed
+    files are read. All changes are made in one FileTransaction.
+
+    Files added or removed are then registered with "osc addremove", or
+    with osc None only listed as still to be registered.
+    """
+    source = Path(source_project).expanduser() / package_name
+    destination = Path(destination_project).expanduser() / package_name
+    for directory in (source, destination):
+        if not directory.is_dir():
+            print("{} missing, skipping".format(directory), file=output)
+            return False
+
+    old, old_read = directory_digests(destination,
+                                      read_file_list(destination))
+    new, new_read = directory_digests(source, read_file_list(source))
+    for name in exclude:
+        old.pop(name, None)
+        new.pop(name, None)
+
+    changed = sorted(name for name in new
+                     if name in old and new[name] != old[name])
+    added = sorted(name for name in new if name not in old)
+    removed = sorted(name for name in old if name not in new)
+
+    if changed or added or removed:
+        with FileTransaction(destination) as transaction:
+            for name in changed + added:
+                transaction.copy(source / name, name)
+            for name in removed:
+                transaction.remove(name)
+
+    summary = ["{} {}".format(label, ", ".join(names)) for label, names in
+               (("updated", changed), ("added", added),
+                ("removed", removed)) if names]
+    print("{}: {} ({} files read)".format(
+        package_name, "; ".join(summary) or "unchanged", old_read + new_read),
+        file=output)
+
+    if (added or removed) and osc is not None:
+        try:
+            run_command([osc, "addremove"], cwd=destination, output=output)
+            return True
+        except (OSError, subprocess.CalledProcessError):
+            pass
+    if added or removed:
+        print("Run osc addremove in {} before committing".format(
+            destination), file=output)
 
     return True
 
 
-def update_version(specfile, version_to, patches=None):
+def update_from_develproject(source_project, destination_project, packages,
+                             jobs=1, exclude=DEFAULT_SYNC_EXCLUDE, osc="osc"):
+    """Sync packages of a checkout of destination_project from a checkout
+    of source_project, jobs packages at a time."""
+
+    update = functools.partial(sync_package_files,
+                               source_project=source_project,
+                               destination_project=destination_project,
+                               exclude=exclude, osc=osc)
+
+    return process_packages(packages, update, jobs)
+
+
+class TarballDirectory:
+    """The tarball directory and its done/ subdirectory.
+
+    Both are listed once, so that checking a tarball is a set lookup
+    instead of a stat() per package.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path).expanduser()
+        self.done_path = self.path / "done"
+        self.done_path.mkdir(exist_ok=True)
+        self.pending = DirectoryIndex(self.path)
+        self.done = DirectoryIndex(self.done_path)
+
+    def is_pending(self, name):
+        return name in self.pending
+
+    def is_done(self, name):
+        return name in self.done
+
+    def mark_done(self, name):
+
+        (self.path / name).rename(self.done_path / name)
+        self.pending.discard(name)
+        self.done.add(name)
+
+
+def _journaled(*attributes):
+    """Make a PackageUpdate stage skip itself if its journal has it done.
 
-    with fileinput.input(specfile, inplace=True) as f:
-        for line in f:
-            line = line.rstrip()
-            if VERSION_RE.match(line):
-                line = VERSION_RE.sub(r"\g<1>" + version_to, line)
-            # TODO: Do the same for patches
-            print(line)
+    The named attributes of the update are recorded along with the stage
+    and restored when it is skipped, for the stages that follow.
+    """
+    def decorator(stage):
 
+        @functools.wraps(stage)
+        def wrapper(self):
 
-def upstream_tag_available(tag):
+            if self.journal is None:
+                return self._timed(stage)
 
-    command = ("git tag -l | grep {}".format(tag))
-    code = subprocess.call(command, shell=True)
+            completed = self.journal.completed(self.package_name,
+                                               self.version_to)
+            if all(name in completed for name in UPDATE_STAGES):
+                print("{} already updated to {}, skipping".format(
+                    self.package_name, self.version_to), file=self.output)
+                return False
 
-    return code == 0
+            if stage.__name__ in completed:
+                data = completed[stage.__name__]
+                for attribute in attributes:
+                    setattr(self, attribute, data.get(attribute))
+                return True
+
+            if not self._timed(stage):
+                return False
+
+            self.journal.record(self.package_name, self.version_to,
+                                stage.__name__,
+                                {attribute: getattr(self, attribute)
+                                 for attribute in attributes})
+            return True
+
+        return wrapper
+
+    return decorator
+
+
+class PackageUpdate:
+    """The update of one package, split into the stages in UPDATE_STAGES.
+
+    Each stage is a method returning True to continue with the next one,
+    or False if the package was skipped. run() goes through all stages in
+    order; the pipeline runs each stage on its own worker pool instead.
+
+    With a journal (an UpdateJournal), completed stages are recorded and
+    not repeated by later runs, and the tarball done/ directory is no
+    longer used to decide what to skip.
+
+    With staged_changes, the changelog entries staged there by the
+    changelogs subcommand are used where available.
+    """
+
+    def __init__(self, package_name, version_to, tarball_directory,
+                 obs_directory, committer, kind="applications",
+                 changetype="bugfix", checkout_dir=None, output=None,
+                 commit_index=None, stable_branch=None, tarballs=None,
+                 checkouts=None, journal=None, staged_changes=None):
+        self.package_name = package_name
+        self.version_to = version_to
+        self.committer = committer
+        self.kind = kind
+        self.changetype = changetype
+        self.checkout_dir = checkout_dir
+        self.output = output
+        self.commit_index = commit_index
+        self.stable_branch = stable_branch
+        self.checkouts = checkouts
+        self.journal = journal
+        self.staged_changes = staged_changes
+
+        if tarballs is None:
+            tarballs = TarballDirectory(tarball_directory)
+        self.tarballs = tarballs
+        self.obs_directory = Path(obs_directory).expanduser() / package_name
+        self.current_version = None
+        self._tarball_name = None
+
+    @property
+    def tarball_name(self):
+        """The tarball's name as given by the spec's first Source, or the
+        usual name-version.tar.xz if there is no spec (yet)."""
+
+        if self._tarball_name is None:
+            self._tarball_name = guess_tarball_name(
+                self.package_name, self.version_to, self.obs_directory.parent)
+        return self._tarball_name
+
+    def _timed(self, stage):
+
+        with instrument.span("stage", stage.__name__,
+                             package=self.package_name):
+            return stage(self)
+
+    @_journaled()
+    def checkout(self):
+
+        if self.journal is None and self.tarballs.is_done(self.tarball_name):
+            print("Tarball {} already processed, skipping".format(
+                self.tarball_name), file=self.output)
+            return False
+
+        checkout_package(self.obs_directory, self.output, self.checkouts)
+        # The checkout may have brought a new or changed spec
+        self._tarball_name = None
+
+        return True
+
+    @_journaled()
+    def tarball(self):
+
+        if self.tarballs.is_pending(self.tarball_name):
+            source = self.tarballs.path / self.tarball_name
+        elif self.journal is not None and self.tarballs.is_done(
+                self.tarball_name):
+            # Moved to done/ by a run which died before journaling it
+            source = self.tarballs.done_path / self.tarball_name
+        else:
+            print("Tarball {} missing, skipping".format(self.tarball_name),
+                  file=self.output)
+            return False
+
+        with instrument.span("io", "place tarball") as span:
+            method = place_file(source, self.obs_directory / self.tarball_name)
+            if method == "copy":
+                span.bytes = source.stat().st_size
+        if not self.tarballs.is_done(self.tarball_name):
+            self.tarballs.mark_done(self.tarball_name)
+
+        return True
+
+    @_journaled("current_version")
+    def spec(self):
+
+        specfile = self.obs_directory / (self.package_name + ".spec")
+        self.current_version = get_current_version(specfile)[0]
+        try:
+            update_version(specfile, self.version_to)
+        except KeyError:
+            print("{} has no Version tag, skipping".format(specfile.name),
+                  file=self.output)
+            return False
+
+        return True
+
+    @_journaled()
+    def changelog(self):
+
+        upstream_reponame = upstream_repo_name(
+            self.tarball_name, self.version_to, self.package_name)
+
+        changes_files = sorted(self.obs_directory.glob("*.changes"))
+        changes_files = changes_files or [
+            self.obs_directory / (self.package_name + ".changes")]
+
+        if self.staged_changes is not None:
+            staged = staged_entry_path(self.staged_changes, self.package_name,
+                                       self.current_version, self.version_to)
+            if staged.exists():
+                print("Using staged changelog entry {}".format(staged),
+                      file=self.output)
+                destination = missing_entries(changes_files, self.version_to)
+                if destination:
+                    prepend_entry(destination, staged.read_text())
+                return True
+
+        record_changes(self.package_name, self.checkout_dir,
+                       self.current_version, self.version_to,
+                       upstream_reponame, self.changetype, self.kind,
+                       changes_files, self.committer, self.output,
+                       self.commit_index, self.stable_branch)
+
+        return True
+
+    @_journaled()
+    def post(self):
+
+        if "kde-l10n" in self.package_name:
+            run_command("pre_checkin.sh", cwd=self.obs_directory,
+                        output=self.output, shell=True, check=False)
+
+        return True
+
+    def run(self):
+
+        for stage in UPDATE_STAGES:
+            if not getattr(self, stage)():
+                return False
+
+        return True
+
+
+def update_package(package_name, version_to, tarball_directory, obs_directory,
+                   committer, kind="applications", changetype="bugfix",
+                   checkout_dir=None, output=None, commit_index=None,
+                   stable_branch=None, tarballs=None, checkouts=None,
+                   journal=None, staged_changes=None):
+
+    return PackageUpdate(package_name, version_to, tarball_directory,
+                         obs_directory, committer, kind, changetype,
+                         checkout_dir, output, commit_index, stable_branch,
+                         tarballs, checkouts, journal, staged_changes).run()
+
+
+def update_version(specfile, version_to):
+    """Set the Version tag of specfile to version_to.
+
+    Patches are not touched, see update_patches() for syncing them. Raises
+    KeyError if the spec has no Version tag in its preamble.
+    """
+    document = SpecDocument.from_file(str(specfile))
+    document.set_tag("Version", version_to)
+    document.write()
+
+
+def default_stable_branch(kind, version):
+
+    if kind not in STABLE_BRANCHES:
+        return None
+
+    major_minor = ".".join(version.split(".")[:2])
+
+    return STABLE_BRANCHES[kind].format(major_minor=major_minor)
 
 
 def record_changes(package_name, checkout_dir, version_from, version_to,
                    upstream_reponame, changetype="bugfix",
                    kind="applications", changes_file=None,
-                   committer=None):
+                   committer=None, output=None, commit_index=None,
+                   stable_branch=None):
+
+    # An interrupted earlier run may have written the entry already
+    destination = missing_entries(changes_file, version_to)
+    if not destination:
+        return
+
+    prepend_entry(destination, changes_entry_for(
+        package_name, checkout_dir, version_from, version_to,
+        upstream_reponame, changetype, kind, committer, output, commit_index,
+        stable_branch))
+
+
+def changes_entry_for(package_name, checkout_dir, version_from, version_to,
+                      upstream_reponame, changetype="bugfix",
+                      kind="applications", committer=None, output=None,
+                      commit_index=None, stable_branch=None):
+    """Return the .changes entry for the update of package_name, from the
+    history of its upstream checkout if there is one."""
 
     commit_from = "v{}".format(version_from)
     commit_to = "v{}".format(version_to)
@@ -221,35 +754,206 @@ def record_changes(package_name, checkout_dir, version_from, version_to,
     upstream_repo_path = Path(checkout_dir).expanduser() / upstream_reponame
 
     if not upstream_repo_path.exists():
-        print("Missing checkout for {}".format(upstream_reponame))
-        create_dummy_changes_entry(version_to, changes_file, kind)
-        return
+        print("Missing checkout for {}".format(upstream_reponame),
+              file=output)
+        return format_dummy_changes_entry(version_to, kind)
 
-    with cd(upstream_repo_path):
+    refs = RefIndex.for_repo(upstream_repo_path)
 
-        if not upstream_tag_available(commit_to):
+    if not refs.has_tag(commit_to):
 
-            if package_name == "kdelibs":
-                commit_to = "KDE/4.14"
-            else:
-                commit_to = "Applications/16.12"  # FIXME
+        if package_name == "kdelibs":
+            commit_to = "KDE/4.14"
+        else:
+            if stable_branch is None:
+                stable_branch = default_stable_branch(kind, version_to)
+            commit_to = refs.branch(stable_branch) if stable_branch else None
 
-        create_changes_entry(upstream_reponame, commit_from, commit_to,
-                             version_from, version_to, changetype, kind,
-                             changes_file, committer)
+            if commit_to is None:
+                print("Neither v{} nor a stable branch found in {}".format(
+                    version_to, upstream_reponame), file=output)
+                return format_dummy_changes_entry(version_to, kind)
 
+            # The previous release may not have been tagged either
+            if not refs.has_tag(commit_from):
+                commit_from = refs.latest_tag(stable_branch) or commit_from
 
-def checkout_package(obs_package_dir):
+    return format_changes_entry(upstream_reponame, commit_from, commit_to,
+                                version_from, version_to, changetype, kind,
+                                committer, upstream_repo_path, commit_index)
+
+
+def staged_entry_path(staging_dir, package_name, version_from, version_to):
+    """Where the changelogs subcommand stages the entry of an update."""
+
+    return Path(staging_dir).expanduser() / package_name / (
+        "{}..{}.changes".format(version_from, version_to))
+
+
+def stage_changes_entry(package_name, staging_dir, version_to, checkout_dir,
+                        project_dir=None, version_from=None, force=False,
+                        commit_index=None, **settings):
+    """Write the .changes entry for the update of package_name to the
+    staging directory, for update_packages --changelogs to use later.
+
+    The current version and the upstream repository are taken from the
+    package's spec in project_dir if given. Returns whether an entry was
+    staged (or already was), and the output.
+    """
+    output = io.StringIO()
+    tarball_name = "{}-{}.tar.xz".format(package_name, version_to)
+    if project_dir is not None:
+        specfile = Path(project_dir).expanduser() / package_name / (
+            package_name + ".spec")
+        if version_from is None and specfile.exists():
+            version_from = get_current_version(specfile)[0]
+        tarball_name = guess_tarball_name(package_name, version_to,
+                                          project_dir)
+
+    if version_from is None:
+        print("No current version known for {}, skipping".format(
+            package_name), file=output)
+        return False, output.getvalue()
+
+    staged = staged_entry_path(staging_dir, package_name, version_from,
+                               version_to)
+    if staged.exists() and not force:
+        print("{} already staged".format(staged), file=output)
+        return True, output.getvalue()
+
+    if commit_index is not None:
+        commit_index = open_commit_index(commit_index)
+    entry = changes_entry_for(
+        package_name, checkout_dir, version_from, version_to,
+        upstream_repo_name(tarball_name, version_to, package_name),
+        output=output, commit_index=commit_index, **settings)
+
+    staged.parent.mkdir(parents=True, exist_ok=True)
+    write_file(staged, entry)
+    print("Staged {}".format(staged), file=output)
+
+    return True, output.getvalue()
+
+
+def _stage_changes_entry(arguments):
+
+    package_name, settings = arguments
+    return stage_changes_entry(package_name, **settings)
 
-    if obs_package_dir.exists():
-        with cd(obs_package_dir):
-            subprocess.check_call(["osc", "up"])
-    else:
-        with cd(obs_package_dir.parent):
-            subprocess.check_call(["osc", "co", obs_package_dir.name])
+
+def checkout_package(obs_package_dir, output=None, checkouts=None):
+
+    # A no-op if the pool already brought the package up to date
+    if checkouts is None:
+        checkouts = CheckoutPool(obs_package_dir.parent, run_command,
+                                 retries=0)
+    checkouts.checkout(obs_package_dir.name, output)
+
+
+@functools.lru_cache(maxsize=None)
+def open_commit_index(filename):
+    """Open each commit index once, shared by all subcommands of a batch."""
+    return CommitIndex(filename)
+
+
+def read_package_lists(filenames):
+
+    for filename in filenames:
+        with open(filename) as handle:
+            for line in handle:
+                name = line.strip()
+                if name:
+                    yield name
+
+
+def process_packages(packages, update, jobs=1):
+    """Call update() for every package, running up to jobs of them at once.
+
+    Each concurrent package collects its output in a buffer. The buffers
+    are printed in one piece each, in the order of packages. If a package
+    raises an exception, the other packages are still finished and the
+    first exception is raised at the end. Results are only counted from
+    the calling thread.
+    """
+    results = Counter()
+
+    if jobs <= 1:
+        for name in packages:
+            result = update(name)
+            results.update(["updated" if result else "failedskipped"])
+        return results
+
+    error = None
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        updates = list()
+        for name in packages:
+            output = io.StringIO()
+            updates.append((executor.submit(update, name, output=output),
+                            output))
+        try:
+            for future, output in updates:
+                exception = future.exception()
+                with _output_lock:
+                    sys.stdout.write(output.getvalue())
+                    sys.stdout.flush()
+                if exception is not None:
+                    error = error or exception
+                    continue
+                results.update(["updated" if future.result()
+                                else "failedskipped"])
+        except BaseException:
+            for future, _ in updates:
+                future.cancel()
+            raise
+
+    if error is not None:
+        raise error
+
+    return results
+
+
+def parse_stage_jobs(value):
+    """Parse "stage=N,..." into a dict of worker counts per update stage."""
+    limits = dict()
+    for item in value.split(","):
+        stage, _, count = item.partition("=")
+        if stage.strip() not in UPDATE_STAGES or not count.strip().isdigit():
+            raise argparse.ArgumentTypeError(
+                "expected STAGE=N with STAGE one of {}, not {!r}".format(
+                    ", ".join(UPDATE_STAGES), item))
+        limits[stage.strip()] = int(count)
+
+    return limits
+
+
+def pipeline_packages(packages, make_update, limits, queue_size=8,
+                      monitor_interval=None):
+    """Run the stages of all package updates in a Pipeline.
+
+    make_update(name, output=...) returns the PackageUpdate of a package.
+    Its output is printed in one piece once the package leaves the
+    pipeline. Returns the counted results and the pipeline, for its
+    statistics.
+    """
+    # asyncio takes as long to import as the rest of this module
+    from pipeline import Pipeline
+
+    results = Counter()
+
+    def on_done(job, result, error):
+        with _output_lock:
+            sys.stdout.write(job.output.getvalue())
+            sys.stdout.flush()
+        if error is None:
+            results.update(["updated" if result else "failedskipped"])
+
+    pipeline = Pipeline(UPDATE_STAGES, limits, on_done, queue_size,
+                        monitor_interval)
+    pipeline.run(make_update(name, output=io.StringIO()) for name in packages)
+
+    return results, pipeline
 
 
-@subcmd
 def update_packages(parser, context, args):
 
     parser.add_argument("-t", "--type", choices=("bugfix", "feature"),
@@ -269,40 +973,465 @@ def update_packages(parser, context, args):
                         choices=("plasma", "frameworks", "applications"))
     parser.add_argument("-e", "--committer", default="", required=True,
                         help="Email address of the committer")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of packages to process in parallel")
+    parser.add_argument("--commit-index",
+                        help="Commit index built by index_commits, used "
+                        "instead of git history where possible")
+    parser.add_argument("--osc-jobs", type=int, default=0,
+                        help="Check out or update all packages up front, "
+                        "this many at a time")
+    parser.add_argument("--osc-per-host", type=int, default=2,
+                        help="Maximal concurrent osc commands per OBS host")
+    parser.add_argument("--osc-retries", type=int,
+                        help="How often to retry failed osc commands "
+                        "(default: 3 with --osc-jobs, otherwise 0)")
+    parser.add_argument("--osc", default="osc",
+                        help="osc command to use")
+    parser.add_argument("--journal",
+                        help="Record completed stages in this file and "
+                        "resume from it, instead of skipping packages with "
+                        "tarballs in done/")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Time all commands and stages, write them to "
+                        "FILE as a Chrome trace and print a summary")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Run the update stages of different packages "
+                        "concurrently, connected by bounded queues")
+    parser.add_argument("--stage-jobs", type=parse_stage_jobs, default={},
+                        help="Workers per pipeline stage, e.g. "
+                        "checkout=4,changelog=8 (default: {})".format(
+                            ",".join("{}={}".format(*item) for item in
+                                     DEFAULT_STAGE_JOBS.items())))
+    parser.add_argument("--queue-size", type=int, default=8,
+                        help="Packages waiting in front of each pipeline "
+                        "stage at most")
+    parser.add_argument("--pipeline-stats", type=float, metavar="SECONDS",
+                        help="Print the pipeline queue depths every "
+                        "SECONDS seconds")
+    parser.add_argument("--changelogs", metavar="DIR",
+                        help="Use the changelog entries staged in DIR by "
+                        "the changelogs subcommand where available")
     parser.add_argument("packagelist", nargs="+",
                         help="Files with package lists")
 
     options = parser.parse_args(args)
 
+    # Batch mode runs further commands in this process, which must not be
+    # traced
+    recorder = instrument.enable() if options.trace else None
+    try:
+        run_package_updates(options)
+        if recorder is not None:
+            recorder.summary()
+            recorder.write_trace(options.trace)
+    finally:
+        if recorder is not None:
+            instrument.disable()
+
+
+def run_package_updates(options):
+    """Run the updates an update_packages command line asks for."""
+
+    packages = list(read_package_lists(options.packagelist))
+
+    journal = None
+    if options.journal:
+        journal = UpdateJournal(Path(options.journal).expanduser())
+
+    # A journal left open would not matter to a process that exits, but
+    # batch mode runs further commands
+    try:
+        # Retries only pay off for the many commands of a prefetch, a single
+        # checkout failing for good should not wait for the backoff
+        retries = options.osc_retries
+        if retries is None:
+            retries = 3 if options.osc_jobs > 0 else 0
+        checkouts = CheckoutPool(options.project_dir, run_command,
+                                 jobs=options.osc_jobs,
+                                 per_host=options.osc_per_host,
+                                 retries=retries, osc=options.osc)
+        if options.osc_jobs > 0:
+            checkouts.prefetch([name for name in packages if journal is None or
+                                not journal.is_done(name, options.version_to,
+                                                    "checkout")])
+
+        commit_index = None
+        if options.commit_index:
+            commit_index = open_commit_index(
+                Path(options.commit_index).expanduser())
+
+        settings = dict(version_to=options.version_to,
+                        tarball_directory=options.tarball_dir,
+                        obs_directory=options.project_dir,
+                        committer=options.committer,
+                        kind=options.kind,
+                        changetype=options.type,
+                        checkout_dir=options.checkout_dir,
+                        commit_index=commit_index,
+                        stable_branch=options.stable_branch,
+                        tarballs=TarballDirectory(options.tarball_dir),
+                        checkouts=checkouts,
+                        journal=journal,
+                        staged_changes=options.changelogs)
+
+        if options.pipeline:
+            limits = dict(DEFAULT_STAGE_JOBS, **options.stage_jobs)
+            results, pipeline = pipeline_packages(
+                packages, functools.partial(PackageUpdate, **settings), limits,
+                options.queue_size, options.pipeline_stats)
+            pipeline.report()
+        else:
+            update = functools.partial(update_package, **settings)
+            results = process_packages(packages, update, options.jobs)
+
+        print("Processed {} packages: updated {}, failed/skipped {}".format(
+            sum(results.values()), results["updated"],
+            results["failedskipped"]))
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def changelogs(parser, context, args):
+
+    from multiprocessing import Pool
+
+    parser.add_argument("-t", "--type", choices=("bugfix", "feature"),
+                        help="Type of release (bugfix or feature)",
+                        default="bugfix")
+    parser.add_argument("-s", "--checkout-dir", required=True,
+                        help="KDE source checkout directory")
+    parser.add_argument("-o", "--staging-dir", required=True,
+                        help="Directory to write the entries to, for "
+                        "update_packages --changelogs")
+    parser.add_argument("-p", "--project-dir",
+                        help="OBS project checkout directory, to take the "
+                        "current versions and upstream names from")
+    parser.add_argument("--version-from",
+                        help="Current version, instead of the one of each "
+                        "spec")
+    parser.add_argument("--version-to", required=True,
+                        help="New version to update to")
+    parser.add_argument("-b", "--stable-branch",
+                        help="Use information from this branch if a tag is "
+                        "not available")
+    parser.add_argument("-k", "--kind", default="applications",
+                        choices=("plasma", "frameworks", "applications"))
+    parser.add_argument("-e", "--committer", default="", required=True,
+                        help="Email address of the committer")
+    parser.add_argument("--commit-index",
+                        help="Commit index built by index_commits, used "
+                        "instead of git history where possible")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Number of packages to process in parallel")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Generate entries again that are already "
+                        "staged")
+    parser.add_argument("packagelist", nargs="+",
+                        help="Files with package lists")
+
+    options = parser.parse_args(args)
+
+    if options.project_dir is None and options.version_from is None:
+        parser.error("one of --project-dir and --version-from is required")
+
+    packages = list(read_package_lists(options.packagelist))
+    commit_index = (str(Path(options.commit_index).expanduser())
+                    if options.commit_index else None)
+    settings = dict(staging_dir=options.staging_dir,
+                    version_to=options.version_to,
+                    checkout_dir=options.checkout_dir,
+                    project_dir=options.project_dir,
+                    version_from=options.version_from,
+                    force=options.force,
+                    commit_index=commit_index,
+                    changetype=options.type,
+                    kind=options.kind,
+                    committer=options.committer,
+                    stable_branch=options.stable_branch)
+
     results = Counter()
+    with Pool(max(options.jobs, 1)) as pool:
+        for staged, output in pool.imap_unordered(
+                _stage_changes_entry,
+                [(name, settings) for name in packages]):
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            results.update(["staged" if staged else "skipped"])
+
+    print("Processed {} packages: staged {}, skipped {}".format(
+        sum(results.values()), results["staged"], results["skipped"]))
+
+
+def index_commits(parser, context, args):
+
+    parser.add_argument("-s", "--checkout-dir", required=True,
+                        help="KDE source checkout directory")
+    parser.add_argument("-i", "--index-file",
+                        help="Index file to create or refresh (default: {} "
+                        "in the checkout directory)".format(INDEX_FILENAME))
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of repositories to read in parallel")
+    parser.add_argument("repository", nargs="*",
+                        help="Only refresh these repositories")
+
+    options = parser.parse_args(args)
+
+    checkout_dir = Path(options.checkout_dir).expanduser()
+    index_file = options.index_file or checkout_dir / INDEX_FILENAME
+    commit_index = open_commit_index(Path(index_file).expanduser())
+
+    if options.repository:
+        repositories = [checkout_dir / name for name in options.repository]
+    else:
+        repositories = list(find_repositories(checkout_dir))
+
+    with ThreadPoolExecutor(max_workers=max(options.jobs, 1)) as executor:
+        counts = executor.map(commit_index.refresh, repositories)
+        for repository, count in zip(repositories, counts):
+            print("{}: {} new commits".format(repository.name, count))
+
+    print("Indexed {} repositories into {}".format(len(repositories),
+                                                   index_file))
+
+
+def find_specfiles(project_dir):
+
+    with os.scandir(str(project_dir)) as packages:
+        for package in packages:
+            if package.name.startswith(".") or not package.is_dir():
+                continue
+            with os.scandir(package.path) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".spec") and entry.is_file():
+                        yield entry.path
+
+
+# Per-process state of the survey workers
+_survey_cache = None
+
+
+def _init_survey_worker(cache_file):
+
+    global _survey_cache
+
+    from multiprocessing.util import Finalize
+    from pyrpm.cache import SpecCache
+
+    if cache_file is not None:
+        _survey_cache = SpecCache(cache_file)
+        # Writes back the usage of cache hits when the worker exits, which
+        # needs the pool to be closed and joined rather than terminated
+        Finalize(_survey_cache, _survey_cache.close, exitpriority=10)
+
+
+def survey_spec(specfile):
+
+    path = Path(specfile)
+    row = {"package": path.parent.name, "spec": path.name}
+
+    try:
+        specfile = Spec.from_file(str(path), cache=_survey_cache)
+    except (OSError, UnicodeDecodeError, ValueError) as error:
+        row["error"] = str(error)
+        return row
+
+    row["name"] = getattr(specfile, "name", None)
+    row["version"] = getattr(specfile, "version", None)
+    row["release"] = getattr(specfile, "release", None)
+    row["sources"] = getattr(specfile, "sources", [])
+    row["patches"] = getattr(specfile, "patches", [])
+
+    return row
+
+
+class SurveyWriter:
+    """Write survey rows as they arrive, as a JSON array or as CSV."""
+
+    def __init__(self, stream, output_format):
+        self.stream = stream
+        self.output_format = output_format
+        self.count = 0
+        if output_format == "csv":
+            import csv
+            self._writer = csv.DictWriter(stream, SURVEY_FIELDS)
+            self._writer.writeheader()
+        else:
+            stream.write("[")
+
+    def write(self, row):
+
+        if self.output_format == "csv":
+            row = dict(row)
+            for field in ("sources", "patches"):
+                row[field] = " ".join(row.get(field, []))
+            self._writer.writerow(row)
+        else:
+            self.stream.write(",\n" if self.count else "\n")
+            self.stream.write(json.dumps(row, sort_keys=True))
+        self.count += 1
+
+    def close(self):
+
+        if self.output_format != "csv":
+            self.stream.write("\n]\n")
+        self.stream.flush()
+
+
+def survey(parser, context, args):
+
+    from multiprocessing import Pool
+    from pyrpm.cache import SpecCache
+
+    parser.add_argument("-p", "--project-dir", required=True,
+                        help="OBS project checkout directory")
+    parser.add_argument("-f", "--format", choices=("json", "csv"),
+                        default="json", help="Output format")
+    parser.add_argument("-o", "--output",
+                        help="Write the survey to this file instead of "
+                        "standard output")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Number of spec files to parse in parallel")
+    parser.add_argument("--outdated", metavar="VERSION",
+                        help="Only list specs not at this version")
+    parser.add_argument("--spec-cache", nargs="?",
+                        const=SpecCache.default_path(),
+                        help="Use a parse cache, optionally at this path")
+
+    options = parser.parse_args(args)
+
+    project_dir = Path(options.project_dir).expanduser()
+    # Checked before any output is written, find_specfiles() is lazy
+    if not project_dir.is_dir():
+        sys.exit("No such project directory: {}".format(project_dir))
+    specfiles = find_specfiles(project_dir)
+
+    stream = (sys.stdout if options.output is None
+              else open(options.output, "w", newline=""))
+    writer = SurveyWriter(stream, options.format)
+
+    with Pool(max(options.jobs, 1), _init_survey_worker,
+                              (options.spec_cache,)) as pool:
+        for row in pool.imap_unordered(survey_spec, specfiles, chunksize=16):
+            if options.outdated and row.get("version") == options.outdated:
+                continue
+            writer.write(row)
+        # Let the workers exit normally, closing their caches
+        pool.close()
+        pool.join()
+
+    writer.close()
+    if stream is not sys.stdout:
+        stream.close()
+
+
+def sync_patches(parser, context, args):
+
+    parser.add_argument("-s", "--source-project", required=True,
+                        help="Checkout of the OBS project to take the "
+                        "patches from")
+    parser.add_argument("-p", "--project-dir", required=True,
+                        help="OBS project checkout directory")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of packages to process in parallel")
+    parser.add_argument("packagelist", nargs="+",
+                        help="Files with package lists")
+
+    options = parser.parse_args(args)
+
+    packages = list(read_package_lists(options.packagelist))
+    update = functools.partial(sync_package_patches,
+                               source_project=options.source_project,
+                               destination_project=options.project_dir)
+    results = process_packages(packages, update, options.jobs)
+
+    print("Processed {} packages: synced {}, failed/skipped {}".format(
+        sum(results.values()), results["updated"], results["failedskipped"]))
+
+
+def sync_develproject(parser, context, args):
+
+    parser.add_argument("-s", "--source-project", required=True,
+                        help="Checkout of the devel project. Files are "
+                        "compared by the checksums osc keeps in .osc/_files; "
+                        "in packages without them (not checked out with "
+                        "osc) every file is read on every run")
+    parser.add_argument("-p", "--project-dir", required=True,
+                        help="OBS project checkout directory")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of packages to process in parallel")
+    parser.add_argument("--osc", default="osc",
+                        help="osc command to run addremove with")
+    parser.add_argument("--no-addremove", action="store_true",
+                        help="Do not run osc addremove for added and "
+                        "removed files, only remind of it")
+    parser.add_argument("-x", "--exclude", action="append",
+                        help="File to leave alone, can be repeated "
+                        "(default: {})".format(
+                            ", ".join(DEFAULT_SYNC_EXCLUDE)))
+    parser.add_argument("packagelist", nargs="+",
+                        help="Files with package lists")
+
+    options = parser.parse_args(args)
+
+    packages = list(read_package_lists(options.packagelist))
+    exclude = (DEFAULT_SYNC_EXCLUDE if options.exclude is None
+               else tuple(options.exclude))
+    results = update_from_develproject(
+        options.source_project, options.project_dir, packages, options.jobs,
+        exclude, None if options.no_addremove else options.osc)
+
+    print("Processed {} packages: synced {}, failed/skipped {}".format(
+        sum(results.values()), results["updated"], results["failedskipped"]))
+
+
+def merge_changelogs(parser, context, args):
+
+    parser.add_argument("--oneway", action="store_true",
+                        help="Only change the second file or project")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Number of packages to merge in parallel")
+    parser.add_argument("first",
+                        help=".changes file or OBS project checkout")
+    parser.add_argument("second",
+                        help=".changes file or OBS project checkout")
+
+    options = parser.parse_args(args)
+
+    first, second = Path(options.first), Path(options.second)
+    for path in (first, second):
+        if not path.exists():
+            parser.error("File or directory doesn't exist: {}".format(path))
+    if first.is_dir() != second.is_dir():
+        parser.error("Don't mix directories and files")
+
+    if first.is_dir():
+        results = changes.merge_projects(first, second, options.oneway,
+                                         options.jobs)
+    else:
+        results = [changes.merge_files(first, second, options.oneway)]
+
+    counts = Counter()
+    for result in results:
+        counts.update(["invalid" if result.invalid else
+                       "merged" if result.written else "unchanged"])
+        if result.invalid or result.written:
+            print("\n".join(result.describe()))
+
+    print("Merged {} changelogs: updated {}, unchanged {}, invalid {}".format(
+        sum(counts.values()), counts["merged"], counts["unchanged"],
+        counts["invalid"]))
+
 
-    for filename in options.packagelist:
-        with open(filename) as handle:
-            for line in handle:
-                name = line.strip()
-                result = update_package(name, options.version_to,
-                                        options.tarball_dir,
-                                        options.project_dir,
-                                        options.committer,
-                                        options.kind, options.type,
-                                        options.checkout_dir)
-                if result:
-                    results.update(["updated"])
-                else:
-                    results.update(["failedskipped"])
-
-    print("Processed {} packages: updated {}, failed/skipped {}".format(
-        results["updated"], results["failedskipped"]))
-
-
-@subcmd
 def update_source_services(parser, context, args):
     pass
 
 
 def main():
 
-    handler = ArgumentHandler()
+    register_subcommands("update_applications", globals())
+    handler = ArgumentHandler(use_subcommand_help=True)
     handler.run()
 
 